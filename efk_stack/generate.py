@@ -1,105 +1,505 @@
-import argparse
-import datetime
+import copy
+import json
 import os
+import sys
 
 from kg_efk import EFKOptions, EFKBuilder
-from kg_traefik2 import Traefik2Builder, Traefik2Options, Traefik2OptionsPort
-from kgpr_core.amazon.eks.kresource import KRPersistentVolumeProfile_AWSElasticBlockStore
-from kgpr_core.amazon.eks.provider import ProviderAmazonEKS
-from kgpr_core.digitalocean.kubernetes.kresource import KRPersistentVolumeProfile_CSI_DOBS
-from kgpr_core.digitalocean.kubernetes.provider import ProviderDigitalOceanKubernetes
-from kgpr_core.google.gke.kresource import KRPersistentVolumeProfile_GCEPersistentDisk
-from kgpr_core.google.gke.provider import ProviderGoogleGKE
-from kgpr_core.k3d.generic.provider import ProviderK3DGeneric
 from kubragen import KubraGen
-from kubragen.consts import PROVIDER_K3D, PROVIDER_GOOGLE, PROVIDER_DIGITALOCEAN, PROVIDER_AMAZON
-from kubragen.helper import QuotedStr
-from kubragen.jsonpatch import FilterJSONPatches_Apply, FilterJSONPatch
-from kubragen.kresource import KRPersistentVolumeProfile_HostPath, KRPersistentVolumeClaimProfile_Basic
-from kubragen.object import Object
+from kubragen.consts import PROVIDER_K3D
+from kubragen.data import ValueData
+from kubragen.helper import QuotedStr, LiteralStr
+from kubragen.jsonpatch import FilterJSONPatch
 from kubragen.option import OptionRoot
 from kubragen.options import Options
-from kubragen.output import OutputProject, OutputFile_ShellScript, OutputFile_Kubernetes, OD_FileTemplate, \
-    OutputDriver_Directory
+from kubragen.output import OutputProject, OutputFile_ShellScript, OutputFile_Kubernetes, OD_FileTemplate
+
+# the tools shared by the samples
+kgsamples_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+if kgsamples_path not in sys.path:
+    sys.path.insert(0, kgsamples_path)
+
+from kgsamples import sample
+from kgsamples.cache import BuildCache, cached_build
+from kgsamples.load import log_generator_deployment, http_load_job
+from kgsamples.profiles import guaranteed_resources, STORAGE_TIERS, ROLLOUT_PROFILES, PLACEMENT_PROFILES, \
+    NODE_POOL_LABELS, rollout_probe_patches, placement_patches
+from kgsamples.traefik import traefik_files
+
+
+#
+# Cluster size presets: replicas, resources, JVM heap and storage of each component
+#
+SIZE_PRESETS = {
+    'default': {
+        'traefik': {
+            'resources': None,
+        },
+        'echo': {
+            'replicas': 1,
+            'resources': None,
+        },
+        'elasticsearch': {
+            'replicas': None,
+            'resources': None,
+            'heap': None,
+            'storage': '50Gi',
+            # the dedicated topology node groups use the development sizes of the topology
+            'node_groups': None,
+            'retention': None,
+        },
+        'kibana': {
+            'resources': None,
+        },
+        'fluentd': {
+            'resources': None,
+        },
+    },
+    'small': {
+        'traefik': {
+            'resources': guaranteed_resources('250m', '128Mi'),
+        },
+        'echo': {
+            'replicas': 1,
+            'resources': guaranteed_resources('50m', '64Mi'),
+        },
+        'elasticsearch': {
+            'replicas': 1,
+            'resources': guaranteed_resources('1', '2Gi'),
+            'heap': '1g',
+            'storage': '20Gi',
+            'node_groups': {
+                'master': {
+                    'resources': guaranteed_resources('250m', '1Gi'),
+                },
+                'hot': {
+                    'resources': guaranteed_resources('1', '2Gi'),
+                    'heap': '1g',
+                    'storage': '20Gi',
+                },
+                'warm': {
+                    'resources': guaranteed_resources('250m', '2Gi'),
+                    'heap': '1g',
+                    'storage': '50Gi',
+                },
+                'ingest': {
+                    'resources': guaranteed_resources('250m', '1Gi'),
+                },
+            },
+            'retention': '7d',
+        },
+        'kibana': {
+            'resources': guaranteed_resources('250m', '1Gi'),
+        },
+        'fluentd': {
+            'resources': guaranteed_resources('100m', '256Mi'),
+        },
+    },
+    'medium': {
+        'traefik': {
+            'resources': guaranteed_resources('500m', '256Mi'),
+        },
+        'echo': {
+            'replicas': 2,
+            'resources': guaranteed_resources('100m', '64Mi'),
+        },
+        'elasticsearch': {
+            'replicas': 3,
+            'resources': guaranteed_resources('2', '8Gi'),
+            'heap': '4g',
+            'storage': '100Gi',
+            'node_groups': {
+                'master': {
+                    'replicas': 3,
+                    'resources': guaranteed_resources('500m', '2Gi'),
+                    'heap': '1g',
+                    'storage': '10Gi',
+                },
+                'hot': {
+                    'replicas': 2,
+                    'resources': guaranteed_resources('2', '8Gi'),
+                    'heap': '4g',
+                    'storage': '100Gi',
+                },
+                'warm': {
+                    'replicas': 2,
+                    'resources': guaranteed_resources('1', '8Gi'),
+                    'heap': '4g',
+                    'storage': '500Gi',
+                },
+                'ingest': {
+                    'replicas': 2,
+                    'resources': guaranteed_resources('1', '2Gi'),
+                    'heap': '1g',
+                },
+            },
+            'retention': '14d',
+        },
+        'kibana': {
+            'resources': guaranteed_resources('500m', '1Gi'),
+        },
+        'fluentd': {
+            'resources': guaranteed_resources('200m', '512Mi'),
+        },
+    },
+    'large': {
+        'traefik': {
+            'resources': guaranteed_resources('1', '512Mi'),
+        },
+        'echo': {
+            'replicas': 3,
+            'resources': guaranteed_resources('200m', '128Mi'),
+        },
+        'elasticsearch': {
+            'replicas': 3,
+            'resources': guaranteed_resources('4', '32Gi'),
+            'heap': '16g',
+            'storage': '500Gi',
+            'node_groups': {
+                'master': {
+                    'replicas': 3,
+                    'resources': guaranteed_resources('1', '4Gi'),
+                    'heap': '2g',
+                    'storage': '20Gi',
+                },
+                'hot': {
+                    'replicas': 3,
+                    'resources': guaranteed_resources('4', '32Gi'),
+                    'heap': '16g',
+                    'storage': '500Gi',
+                },
+                'warm': {
+                    'replicas': 2,
+                    'resources': guaranteed_resources('2', '16Gi'),
+                    'heap': '8g',
+                    'storage': '2Ti',
+                },
+                'ingest': {
+                    'replicas': 2,
+                    'resources': guaranteed_resources('2', '4Gi'),
+                    'heap': '2g',
+                },
+            },
+            'retention': '30d',
+        },
+        'kibana': {
+            'resources': guaranteed_resources('1', '2Gi'),
+        },
+        'fluentd': {
+            'resources': guaranteed_resources('500m', '1Gi'),
+        },
+    },
+}
+
+
+#
+# Elasticsearch topologies: node groups, each one deployed as its own StatefulSet with its own volume claim template.
+# The default topology runs all roles on the nodes of the EFKBuilder StatefulSet. The node groups have development
+# sizes, one node each without resources, and the size presets override them.
+#
+ES_TOPOLOGIES = {
+    'default': None,
+    'dedicated': {
+        'master': {
+            'roles': 'master',
+            'replicas': 1,
+            'resources': None,
+            'heap': '512m',
+            'storage': '5Gi',
+        },
+        'hot': {
+            # Elasticsearch 7.9 doesn't have data tier roles, use a node attribute for shard allocation filtering
+            'roles': 'data',
+            'attributes': {
+                'data': 'hot',
+            },
+            'replicas': 1,
+            'resources': None,
+            'heap': '1g',
+            'storage': '10Gi',
+        },
+        'warm': {
+            'roles': 'data',
+            'attributes': {
+                'data': 'warm',
+            },
+            'replicas': 1,
+            'resources': None,
+            'heap': '1g',
+            'storage': '20Gi',
+        },
+        'ingest': {
+            # ingest and coordinating, the only nodes that receive requests from Kibana and Fluentd
+            'roles': 'ingest',
+            'client': True,
+            'replicas': 1,
+            'resources': None,
+            'heap': '512m',
+            'storage': None,
+        },
+    },
+}
+
+
+# the sizes whose node groups fit on a development k3d cluster
+ES_TOPOLOGY_K3D_SIZES = ['default', 'small']
+
+
+def elasticsearch_node_group(statefulset, discovery_service, name, group, master_nodes, storage_tier):
+    """
+    Creates the StatefulSet of an Elasticsearch node group from the one built by EFKBuilder.
+    """
+    ret = copy.deepcopy(statefulset)
+    ret['metadata']['name'] = '{}-{}'.format(statefulset['metadata']['name'], name)
+    ret['spec']['serviceName'] = discovery_service
+    ret['spec']['replicas'] = group['replicas']
+    ret['spec']['selector']['matchLabels']['node-group'] = name
+    ret['spec']['template']['metadata']['labels']['node-group'] = name
+
+    podspec = ret['spec']['template']['spec']
+    container = podspec['containers'][0]
+    env = {item['name']: item for item in container['env']}
+    env['node.name']['value'] = QuotedStr('$(NODE_NAME).{}'.format(discovery_service))
+    env['discovery.seed_hosts']['value'] = ','.join(master_nodes)
+    env['cluster.initial_master_nodes']['value'] = ','.join(master_nodes)
+    env['ES_JAVA_OPTS']['value'] = '-Xms{heap} -Xmx{heap}'.format(heap=group['heap'])
+    container['env'].append({
+        'name': 'node.roles',
+        'value': group['roles'],
+    })
+    for attrname, attrvalue in group.get('attributes', {}).items():
+        container['env'].append({
+            'name': 'node.attr.{}'.format(attrname),
+            'value': attrvalue,
+        })
 
+    if group['resources'] is not None:
+        container['resources'] = group['resources']
+        for init_container in podspec['initContainers']:
+            init_container['resources'] = group['resources']
 
-def main():
-    parser = argparse.ArgumentParser(description='Kube Creator')
-    parser.add_argument('-p', '--provider', help='provider', required=True, choices=[
-        'google-gke',
-        'amazon-eks',
-        'digitalocean-kubernetes',
-        'k3d',
-    ])
-    parser.add_argument('-o', '--output-path', help='output path', default='output')
-    args = parser.parse_args()
-
-    if args.provider == 'k3d':
-        kgprovider = ProviderK3DGeneric()
-    elif args.provider == 'google-gke':
-        kgprovider = ProviderGoogleGKE()
-    elif args.provider == 'digitalocean-kubernetes':
-        kgprovider = ProviderDigitalOceanKubernetes()
-    elif args.provider == 'amazon-eks':
-        kgprovider = ProviderAmazonEKS()
+    if group['storage'] is None:
+        podspec['volumes'] = [{
+            'name': 'data',
+            'emptyDir': {},
+        }]
     else:
-        raise Exception('Unknown target')
-
-    kg = KubraGen(provider=kgprovider, options=Options({
-        'namespaces': {
-            'default': 'default',
-            'mon': 'monitoring',
+        del podspec['volumes']
+        ret['spec']['volumeClaimTemplates'] = [{
+            'metadata': {
+                'name': 'data',
+            },
+            'spec': {
+                'storageClassName': ValueData(value=storage_tier['storageclass'] if storage_tier is not None else None,
+                                              disabled_if_none=True),
+                'accessModes': ['ReadWriteOnce'],
+                'resources': {
+                    'requests': {
+                        'storage': group['storage'],
+                    },
+                },
+            },
+        }]
+
+    return ret
+
+
+# the index lifecycle of the dedicated topology, the age at which the indices move to the warm nodes
+ES_ILM_POLICY = 'kgsample-logs'
+ES_ILM_WARM_AFTER = '1d'
+ES_ILM_DEFAULT_RETENTION = '30d'
+
+
+def elasticsearch_ilm_objects(namespace, name, elasticsearch_url, retention, index_replicas):
+    """
+    Creates a ConfigMap with an ILM policy that moves the Fluentd indices from the ```data: hot``` nodes to the
+    ```data: warm``` nodes and deletes them after the retention, with an index template that allocates the new indices
+    on the hot nodes and sets the policy and the replicas, and a Job that installs both as soon as Elasticsearch is
+    available.
+    """
+    policy = {
+        'policy': {
+            'phases': {
+                'hot': {
+                    'min_age': '0ms',
+                    'actions': {
+                        'set_priority': {'priority': 100},
+                    },
+                },
+                'warm': {
+                    'min_age': ES_ILM_WARM_AFTER,
+                    'actions': {
+                        'allocate': {'require': {'data': 'warm'}},
+                        'forcemerge': {'max_num_segments': 1},
+                        'set_priority': {'priority': 50},
+                    },
+                },
+                'delete': {
+                    'min_age': retention,
+                    'actions': {
+                        'delete': {},
+                    },
+                },
+            },
         },
-    }))
-
-    if kgprovider.provider == PROVIDER_K3D:
-        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_HostPath())
-    elif kgprovider.provider == PROVIDER_GOOGLE:
-        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_GCEPersistentDisk())
-    elif kgprovider.provider == PROVIDER_DIGITALOCEAN:
-        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_CSI_DOBS())
-    elif kgprovider.provider == PROVIDER_AMAZON:
-        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_AWSElasticBlockStore())
-
-    if kgprovider.provider == PROVIDER_K3D:
-        kg.resources().persistentvolumeclaimprofile_add('default', KRPersistentVolumeClaimProfile_Basic(allow_selector=False))
-    else:
-        kg.resources().persistentvolumeclaimprofile_add('default', KRPersistentVolumeClaimProfile_Basic())
-
-    kg.resources().persistentvolume_add('elasticsearch-storage', 'default', {
-        'hostPath': {
-            'path': '/var/storage/elasticsearch'
+    }
+    template = {
+        # the daily indices of the Fluentd logstash format
+        'index_patterns': ['logstash-*'],
+        'priority': 100,
+        'template': {
+            'settings': {
+                'index.lifecycle.name': ES_ILM_POLICY,
+                'index.routing.allocation.require.data': 'hot',
+                'index.number_of_replicas': index_replicas,
+            },
+        },
+    }
+    return [{
+        'apiVersion': 'v1',
+        'kind': 'ConfigMap',
+        'metadata': {
+            'name': name,
+            'namespace': namespace,
         },
-        'csi': {
-            'fsType': 'ext4',
+        'data': {
+            'policy.json': LiteralStr(json.dumps(policy, indent=2)),
+            'template.json': LiteralStr(json.dumps(template, indent=2)),
         },
     }, {
+        'apiVersion': 'batch/v1',
+        'kind': 'Job',
         'metadata': {
-            'labels': {
-                'pv.role': 'elasticsearch',
-            },
+            'name': name,
+            'namespace': namespace,
         },
         'spec': {
-            'persistentVolumeReclaimPolicy': 'Retain',
-            'capacity': {
-                'storage': '50Gi'
+            'backoffLimit': 10,
+            'template': {
+                'spec': {
+                    'restartPolicy': 'OnFailure',
+                    'containers': [{
+                        'name': 'ilm',
+                        'image': 'curlimages/curl:7.72.0',
+                        'command': ['sh', '-c', ' && '.join([
+                            'until curl -sf -o /dev/null "{url}/_cluster/health?wait_for_status=yellow"; do sleep 5; done',
+                            'curl -sf -X PUT -H "Content-Type: application/json" --data-binary @/ilm/policy.json '
+                            '"{url}/_ilm/policy/{policy}"',
+                            'curl -sf -X PUT -H "Content-Type: application/json" --data-binary @/ilm/template.json '
+                            '"{url}/_index_template/{policy}"',
+                        ]).format(url=elasticsearch_url, policy=ES_ILM_POLICY)],
+                        'volumeMounts': [{
+                            'name': 'ilm',
+                            'mountPath': '/ilm',
+                        }],
+                    }],
+                    'volumes': [{
+                        'name': 'ilm',
+                        'configMap': {
+                            'name': name,
+                        },
+                    }],
+                },
             },
-            'accessModes': ['ReadWriteOnce'],
         },
-    })
+    }]
 
-    kg.resources().persistentvolumeclaim_add('elasticsearch-storage-claim', 'default', {
-        'namespace': 'monitoring',
-        'persistentVolume': 'elasticsearch-storage',
-    }, {
-        'spec': {
-            'selector': {
-                'matchLabels': {
-                    'pv.role': 'elasticsearch',
-                }
-            },
-        }
-    })
+
+#
+# Load generator profiles, used to benchmark the stack
+#
+LOAD_PROFILES = {
+    'default': None,
+    'light': {
+        'logs': {
+            'replicas': 1,
+            # lines per second per replica
+            'rate': 100,
+            'message_size': 200,
+        },
+        'http': {
+            'rps': 50,
+            'concurrency': 5,
+            'duration': '5m',
+        },
+    },
+    'heavy': {
+        'logs': {
+            'replicas': 4,
+            # lines per second per replica
+            'rate': 2500,
+            'message_size': 500,
+        },
+        'http': {
+            'rps': 1000,
+            'concurrency': 50,
+            'duration': '10m',
+        },
+    },
+}
+
+
+def arg_parser():
+    """
+    Returns the command line parser of the sample.
+    """
+    parser = sample.arg_parser(SIZE_PRESETS, LOAD_PROFILES)
+    parser.add_argument('--self-monitoring', help='expose the pipeline metrics to Prometheus', action='store_true')
+    parser.add_argument('--es-topology', help='elasticsearch topology', default='default',
+                        choices=list(ES_TOPOLOGIES))
+    return parser
+
+
+def build(args):
+    """
+    Builds the sample from the parsed command line arguments, without saving it.
+
+    :return: a (KubraGen, OutputProject) tuple
+    """
+    kgprovider = sample.kubragen_provider(args.provider)
+
+    size_preset = SIZE_PRESETS[args.size]
+    rollout_profile = ROLLOUT_PROFILES[args.rollout]
+    placement = PLACEMENT_PROFILES[args.placement]
+    load_profile = LOAD_PROFILES[args.load]
+    storage_tier = STORAGE_TIERS[args.storage_tier]
+    if storage_tier is not None:
+        storage_tier = storage_tier[kgprovider.provider]
+
+    build_cache = None
+    if not args.no_cache:
+        build_cache = BuildCache()
+    es_topology = ES_TOPOLOGIES[args.es_topology]
+    if es_topology is not None:
+        if sample.storage_disk(args, 'elasticsearch') is not None:
+            # each node of the node groups has its own volume
+            raise sample.OptionError('The disk of the "elasticsearch" volume cannot be used with the "{}" '
+                                     'Elasticsearch topology'.format(args.es_topology))
+        if storage_tier is not None and storage_tier.get('memory'):
+            # the node groups would hold all their data, up to terabytes, in memory
+            raise sample.OptionError('The "{}" storage tier cannot be used with the "{}" Elasticsearch '
+                                     'topology'.format(args.storage_tier, args.es_topology))
+        if kgprovider.provider == PROVIDER_K3D and args.size not in ES_TOPOLOGY_K3D_SIZES:
+            # the node groups need several nodes with tens of gigabytes of memory and up to terabytes of storage
+            raise sample.OptionError('The "{}" size of the "{}" Elasticsearch topology does not fit on k3d, use one of '
+                                     'the {} sizes'.format(args.size, args.es_topology,
+                                                           ', '.join(ES_TOPOLOGY_K3D_SIZES)))
+        es_topology = {name: dict(group, **(size_preset['elasticsearch']['node_groups'] or {}).get(name, {}))
+                       for name, group in es_topology.items()}
+
+    kg = KubraGen(provider=kgprovider, options=Options({
+        'namespaces': {
+            'default': 'default',
+            'mon': 'monitoring',
+        },
+    }))
+
+    sample.storage_profiles(kg)
+    if storage_tier is not None:
+        # also used by the volume claim templates of the node groups
+        sample.storage_class_add(kg, storage_tier)
+    if es_topology is None:
+        sample.storage_claim_add(kg, 'elasticsearch', storage_tier, size_preset['elasticsearch']['storage'],
+                                 sample.storage_disk(args, 'elasticsearch'))
 
     out = OutputProject(kg)
 
@@ -111,132 +511,32 @@ def main():
     #
     # Provider setup
     #
-    if kgprovider.provider == PROVIDER_K3D:
-        storage_directory = os.path.join(os.getcwd(), 'output', 'storage')
-        if not os.path.exists(storage_directory):
-            os.makedirs(storage_directory)
-        shell_script.append(f'# k3d cluster create kgsample-efk-stack --port 5051:80@loadbalancer --port 5052:443@loadbalancer -v {storage_directory}:/var/storage')
+    sample.cluster_setup(kg, out, shell_script, args, 'kgsample-efk-stack', placement)
 
     #
     # OUTPUTFILE: namespace.yaml
     #
-    file = OutputFile_Kubernetes('namespace.yaml')
-    file.append([{
-        'apiVersion': 'v1',
-        'kind': 'Namespace',
-        'metadata': {
-            'name': 'monitoring',
-        },
-    }])
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
-
-    #
-    # OUTPUTFILE: storage.yaml
-    #
-    file = OutputFile_Kubernetes('storage.yaml')
-
-    file.append(kg.persistentvolume_build())
-    file.append(kg.persistentvolumeclaim_build())
-
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+    sample.namespace_file(out, shell_script, placement)
 
     #
-    # SETUP: Traefik 2
+    # OUTPUTFILE: prepull.yaml
     #
-    traefik2_config = Traefik2Builder(kubragen=kg, options=Traefik2Options({
-            'namespace': OptionRoot('namespaces.default'),
-            'config': {
-                'traefik_args': [
-                    '--api.dashboard=true',
-                    '--api.insecure=false',
-                    '--entrypoints.web.Address=:80',
-                    '--entrypoints.api.Address=:8080',
-                    '--providers.kubernetescrd',
-                    f'--providers.kubernetescrd.namespaces=default,monitoring'
-                ],
-                'ports': [
-                    Traefik2OptionsPort(name='web', port_container=80, port_service=80),
-                    Traefik2OptionsPort(name='api', port_container=8080, port_service=8080),
-                ],
-                'create_traefik_crd': True,
-            },
-        })
-    )
-
-    traefik2_config.ensure_build_names(traefik2_config.BUILD_CRD, traefik2_config.BUILD_ACCESSCONTROL,
-                                       traefik2_config.BUILD_SERVICE)
+    images_file = None
+    prepull_file = None
+    if args.prepull:
+        # filled after all other files, with the images they use
+        images_file, prepull_file = sample.image_prepull_files(kg, out, shell_script, 'kgsample-efk-stack')
 
     #
-    # OUTPUTFILE: traefik-config-crd.yaml
+    # OUTPUTFILE: storage.yaml
     #
-    file = OutputFile_Kubernetes('traefik-config-crd.yaml')
+    sample.storage_file(kg, out, shell_script)
 
-    file.append(traefik2_config.build(traefik2_config.BUILD_CRD))
-
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
-
-    #
-    # OUTPUTFILE: traefik-config.yaml
     #
-    file = OutputFile_Kubernetes('traefik-config.yaml')
-
-    file.append(traefik2_config.build(traefik2_config.BUILD_ACCESSCONTROL))
-
-    file.append([{
-        'apiVersion': 'traefik.containo.us/v1alpha1',
-        'kind': 'IngressRoute',
-        'metadata': {
-            'name': 'traefik-api',
-            'namespace': kg.option_get('namespaces.default'),
-        },
-        'spec': {
-            'entryPoints': ['api'],
-            'routes': [{
-                'match': 'Method(`GET`)',
-                'kind': 'Rule',
-                'services': [{
-                    'name': 'api@internal',
-                    'kind': 'TraefikService'
-                }]
-            }]
-        }
-    }])
-
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
-
-    #
-    # OUTPUTFILE: traefik.yaml
+    # SETUP: Traefik 2
     #
-    file = OutputFile_Kubernetes('traefik.yaml')
-
-    file.append(traefik2_config.build(traefik2_config.BUILDITEM_SERVICE))
-
-    file.append({
-        'apiVersion': 'traefik.containo.us/v1alpha1',
-        'kind': 'IngressRoute',
-        'metadata': {
-            'name': 'admin-traefik',
-            'namespace': kg.option_get('namespaces.default'),
-        },
-        'spec': {
-            'entryPoints': ['web'],
-            'routes': [{
-                'match': f'Host(`admin-traefik.localdomain`)',
-                'kind': 'Rule',
-                'services': [{
-                    'name': traefik2_config.object_name('service'),
-                    'port': 8080
-                }],
-            }]
-        }
-    })
-
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+    traefik2_config, traefik_transport_name = traefik_files(kg, out, shell_script, args, size_preset, placement,
+                                                            build_cache)
 
     #
     # SETUP: efk
@@ -244,9 +544,10 @@ def main():
     efk_config = EFKBuilder(kubragen=kg, options=EFKOptions({
         'namespace': OptionRoot('namespaces.mon'),
         'config': {
-            'probes': False,
+            'probes': rollout_profile['startup'] is not None,
             'elasticsearch': {
-                'replicas': 1 if kgprovider.provider == PROVIDER_K3D else 3,
+                'replicas': size_preset['elasticsearch']['replicas'] if size_preset['elasticsearch']['replicas'] is not None
+                else 1 if kgprovider.provider == PROVIDER_K3D else 3,
             },
             'kibana': {
                 'service_port': 80,
@@ -257,15 +558,89 @@ def main():
         },
         'kubernetes': {
             'volumes': {
-                'elasticsearch-data': {
-                    'persistentVolumeClaim': {
-                        'claimName': 'elasticsearch-storage-claim'
-                    }
-                }
+                'elasticsearch-data': sample.storage_volume('elasticsearch', storage_tier,
+                                                            size_preset['elasticsearch']['storage']),
+            },
+            'resources': {
+                'elasticsearch-statefulset': size_preset['elasticsearch']['resources'],
+                'kibana-deployment': size_preset['kibana']['resources'],
+                'fluentd-daemonset': size_preset['fluentd']['resources'],
             },
         },
     }))
 
+    efk_jsonpatches = []
+    if size_preset['elasticsearch']['heap'] is not None:
+        efk_jsonpatches.append(FilterJSONPatch(filters={'names': [efk_config.BUILDITEM_ELASTICSEARCH_STATEFULSET]}, patches=[
+            {'op': 'test', 'path': '/spec/template/spec/containers/0/env/5/name', 'value': 'ES_JAVA_OPTS'},
+            {'op': 'replace', 'path': '/spec/template/spec/containers/0/env/5/value',
+             'value': '-Xms{heap} -Xmx{heap}'.format(heap=size_preset['elasticsearch']['heap'])},
+        ]))
+    if size_preset['elasticsearch']['resources'] is not None:
+        # init containers must also have resources for the pod to have the Guaranteed QoS class
+        efk_jsonpatches.append(FilterJSONPatch(filters={'names': [efk_config.BUILDITEM_ELASTICSEARCH_STATEFULSET]}, patches=[
+            {'op': 'add', 'path': '/spec/template/spec/initContainers/{}/resources'.format(init_container),
+             'value': size_preset['elasticsearch']['resources']} for init_container in range(3)
+        ]))
+    if rollout_profile['parallel']:
+        # the initial master nodes are all listed in the configuration, so they don't need to start in order
+        efk_jsonpatches.append(FilterJSONPatch(filters={'names': [efk_config.BUILDITEM_ELASTICSEARCH_STATEFULSET]}, patches=[
+            {'op': 'add', 'path': '/spec/podManagementPolicy', 'value': 'Parallel'},
+        ]))
+    if rollout_profile['startup'] is not None:
+        efk_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [efk_config.BUILDITEM_ELASTICSEARCH_STATEFULSET]},
+            patches=rollout_probe_patches(rollout_profile, {'path': '/_cluster/health?local=true', 'port': 9200})))
+        efk_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [efk_config.BUILDITEM_KIBANA_DEPLOYMENT]},
+            patches=rollout_probe_patches(rollout_profile, {'path': '/api/status', 'port': 5601})))
+    if args.self_monitoring:
+        # the fluentd image already serves its metrics on port 24231
+        efk_jsonpatches.append(FilterJSONPatch(filters={'names': [efk_config.BUILDITEM_FLUENTD_DAEMONSET]}, patches=[
+            {'op': 'merge', 'path': '/spec/template/metadata', 'value': {'annotations': {
+                'prometheus.io/scrape': QuotedStr('true'),
+                'prometheus.io/port': QuotedStr('24231'),
+            }}},
+            {'op': 'add', 'path': '/spec/template/spec/containers/0/ports', 'value': [{
+                'name': 'metrics',
+                'containerPort': 24231,
+            }]},
+        ]))
+        # Elasticsearch has no Prometheus endpoint, each node gets an exporter
+        efk_jsonpatches.append(FilterJSONPatch(filters={'names': [efk_config.BUILDITEM_ELASTICSEARCH_STATEFULSET]}, patches=[
+            {'op': 'merge', 'path': '/spec/template/metadata', 'value': {'annotations': {
+                'prometheus.io/scrape': QuotedStr('true'),
+                'prometheus.io/port': QuotedStr('9114'),
+            }}},
+            {'op': 'add', 'path': '/spec/template/spec/containers/-', 'value': {
+                'name': 'exporter',
+                'image': 'quay.io/prometheuscommunity/elasticsearch-exporter:v1.1.0',
+                'args': ['--es.uri=http://localhost:9200'],
+                'ports': [{
+                    'name': 'metrics',
+                    'containerPort': 9114,
+                }],
+                'resources': guaranteed_resources('100m', '64Mi'),
+            }},
+        ]))
+    if es_topology is not None:
+        # Kibana and Fluentd only connect to the client node group
+        efk_jsonpatches.append(FilterJSONPatch(filters={'names': [efk_config.BUILDITEM_ELASTICSEARCH_SERVICE]}, patches=[
+            {'op': 'add', 'path': '/spec/selector/node-group',
+             'value': [name for name, group in es_topology.items() if group.get('client')][0]},
+        ]))
+    if placement is not None:
+        efk_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [efk_config.BUILDITEM_ELASTICSEARCH_STATEFULSET]},
+            patches=placement_patches(placement, 'monitoring', NODE_POOL_LABELS[kgprovider.provider])))
+        efk_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [efk_config.BUILDITEM_KIBANA_DEPLOYMENT]},
+            patches=placement_patches(placement, 'monitoring', NODE_POOL_LABELS[kgprovider.provider])))
+        efk_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [efk_config.BUILDITEM_FLUENTD_DAEMONSET]},
+            patches=placement_patches(placement, 'monitoring', NODE_POOL_LABELS[kgprovider.provider], daemonset=True)))
+    efk_config.jsonpatches(efk_jsonpatches)
+
     efk_config.ensure_build_names(efk_config.BUILD_ACCESSCONTROL, efk_config.BUILD_CONFIG,
                                   efk_config.BUILD_SERVICE)
 
@@ -275,7 +650,7 @@ def main():
     file = OutputFile_Kubernetes('efk-config.yaml')
     out.append(file)
 
-    file.append(efk_config.build(efk_config.BUILD_ACCESSCONTROL, efk_config.BUILD_CONFIG))
+    file.append(cached_build(build_cache, efk_config, efk_config.BUILD_ACCESSCONTROL, efk_config.BUILD_CONFIG))
 
     shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
 
@@ -285,7 +660,45 @@ def main():
     file = OutputFile_Kubernetes('efk.yaml')
     out.append(file)
 
-    file.append(efk_config.build(efk_config.BUILD_SERVICE))
+    efk_objects = cached_build(build_cache, efk_config, efk_config.BUILD_SERVICE)
+    if es_topology is not None:
+        es_statefulset = [o for o in efk_objects if o.name == efk_config.BUILDITEM_ELASTICSEARCH_STATEFULSET][0]
+        es_discovery_service = efk_config.object_name('elasticsearch-service') + '-discovery'
+        es_master_nodes = ['{}-{}-{}.{}'.format(es_statefulset['metadata']['name'], name, rpl, es_discovery_service)
+                           for name, group in es_topology.items() if group['roles'] == 'master'
+                           for rpl in range(group['replicas'])]
+
+        es_objects = [{
+            'apiVersion': 'v1',
+            'kind': 'Service',
+            'metadata': {
+                'name': es_discovery_service,
+                'namespace': efk_config.namespace(),
+            },
+            'spec': {
+                'selector': {
+                    'app': efk_config.object_name('elasticsearch-pod-label-app'),
+                },
+                'clusterIP': 'None',
+                'publishNotReadyAddresses': True,
+                'ports': [{
+                    'port': 9300,
+                    'name': 'inter-node'
+                }],
+            }
+        }]
+        es_objects.extend([elasticsearch_node_group(es_statefulset, es_discovery_service, name, group, es_master_nodes,
+                                                    storage_tier) for name, group in es_topology.items()])
+        efk_objects = [es_object for o in efk_objects
+                       for es_object in (es_objects if o is es_statefulset else [o])]
+        efk_objects.extend(elasticsearch_ilm_objects(
+            efk_config.namespace(), efk_config.object_name('elasticsearch-service') + '-ilm',
+            'http://{}:9200'.format(efk_config.object_name('elasticsearch-service')),
+            size_preset['elasticsearch']['retention'] if size_preset['elasticsearch']['retention'] is not None
+            else ES_ILM_DEFAULT_RETENTION,
+            # a replica can only be allocated if both the hot and the warm node groups have another node
+            min(1, es_topology['hot']['replicas'] - 1, es_topology['warm']['replicas'] - 1)))
+    file.append(efk_objects)
 
     file.append([{
         'apiVersion': 'traefik.containo.us/v1alpha1',
@@ -303,6 +716,7 @@ def main():
                     'name': efk_config.object_name('kibana-service'),
                     'namespace': efk_config.namespace(),
                     'port': efk_config.option_get('config.kibana.service_port'),
+                    'serversTransport': ValueData(value=traefik_transport_name, disabled_if_none=True),
                 }],
             }]
         }
@@ -313,145 +727,37 @@ def main():
     #
     # OUTPUTFILE: http-echo.yaml
     #
-    file = OutputFile_Kubernetes('http-echo.yaml')
-    out.append(file)
-
-    file.append([{
-        'apiVersion': 'apps/v1',
-        'kind': 'Deployment',
-        'metadata': {
-            'name': 'echo-deployment',
-            'namespace': kg.option_get('namespaces.default'),
-            'labels': {
-                'app': 'echo'
-            }
-        },
-        'spec': {
-            'replicas': 1,
-            'selector': {
-                'matchLabels': {
-                    'app': 'echo'
-                }
-            },
-            'template': {
-                'metadata': {
-                    'labels': {
-                        'app': 'echo'
-                    }
-                },
-                'spec': {
-                    'containers': [{
-                        'name': 'echo',
-                        'image': 'mendhak/http-https-echo',
-                        'ports': [{
-                            'containerPort': 80
-                        },
-                        {
-                            'containerPort': 443
-                        }],
-                    }]
-                }
-            }
-        }
-    },
-    {
-        'apiVersion': 'v1',
-        'kind': 'Service',
-        'metadata': {
-            'name': 'echo-service',
-            'namespace': kg.option_get('namespaces.default'),
-        },
-        'spec': {
-            'selector': {
-                'app': 'echo'
-            },
-            'ports': [{
-                'name': 'http',
-                'port': 80,
-                'targetPort': 80,
-                'protocol': 'TCP'
-            }]
-        }
-    }, {
-        'apiVersion': 'traefik.containo.us/v1alpha1',
-        'kind': 'IngressRoute',
-        'metadata': {
-            'name': 'http-echo',
-            'namespace': kg.option_get('namespaces.default'),
-        },
-        'spec': {
-            'entryPoints': ['web'],
-            'routes': [{
-                # 'match': f'Host(`http-echo.localdomain`)',
-                'match': f'PathPrefix(`/`)',
-                'kind': 'Rule',
-                'services': [{
-                    'name': 'echo-service',
-                    'port': 80,
-                }],
-            }]
-        }
-    }])
-
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+    sample.http_echo_file(kg, out, shell_script, size_preset, traefik_transport_name)
 
     #
     # OUTPUTFILE: ingress.yaml
     #
-    file = OutputFile_Kubernetes('ingress.yaml')
-    http_path = '/'
-    if kgprovider.provider == PROVIDER_GOOGLE or kgprovider.provider == PROVIDER_AMAZON:
-        http_path = '/*'
-
-    file_data = [
-        Object({
-            'apiVersion': 'extensions/v1beta1',
-            'kind': 'Ingress',
-            'metadata': {
-                'name': 'ingress',
-                'namespace': kg.option_get('namespaces.default'),
-            },
-            'spec': {
-                'rules': [{
-                    'http': {
-                        'paths': [{
-                            'path': http_path,
-                            'backend': {
-                                'serviceName': traefik2_config.object_name('service'),
-                                'servicePort': 80,
-                            }
-                        }]
-                    }
-                }]
-            }
-        }, name='ingress', source='app', instance='ingress')
-    ]
-
-    if kgprovider.provider == PROVIDER_AMAZON:
-        FilterJSONPatches_Apply(file_data, jsonpatches=[
-            FilterJSONPatch(filters={'names': ['ingress']}, patches=[
-                {'op': 'merge', 'path': '/metadata', 'value': {'annotations': {
-                    'kubernetes.io/ingress.class': 'alb',
-                    'alb.ingress.kubernetes.io/scheme': 'internet-facing',
-                    'alb.ingress.kubernetes.io/listen-ports': QuotedStr('[{"HTTP": 80}]'),
-                }}}
-            ])
-        ])
-
-    file.append(file_data)
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+    sample.ingress_file(kg, out, shell_script, args, traefik2_config)
 
     #
-    # OUTPUT
+    # OUTPUTFILE: load.yaml
     #
-    output_path = os.path.join(args.output_path, '{}-{}'.format(
-        args.provider, datetime.datetime.today().strftime("%Y%m%d-%H%M%S")))
-    print('Saving files to {}'.format(output_path))
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
+    if load_profile is not None:
+        file = OutputFile_Kubernetes('load.yaml')
+        out.append(file)
+
+        file.append([
+            log_generator_deployment(kg.option_get('namespaces.default'), load_profile['logs']),
+            # the requests go through the Traefik web entrypoint to the echo service
+            http_load_job(kg.option_get('namespaces.default'), 'http://{}.{}.svc/'.format(
+                traefik2_config.object_name('service'), traefik2_config.namespace()), load_profile['http']),
+        ])
+
+        shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+
+    if images_file is not None:
+        sample.image_prepull_fill(out, images_file, prepull_file)
 
-    out.output(OutputDriver_Directory(output_path))
+    return kg, out
+
+
+def main():
+    sample.main(arg_parser(), build)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,7 @@
+"""
+Tools shared by the KubraGen samples.
+
+The samples are built on :mod:`kgsamples.sample`, :mod:`kgsamples.traefik` and :mod:`kgsamples.profiles`, which only
+need KubraGen and the packages of the samples. The other modules are imported only when the corresponding command line
+option is used, so each sample still runs with just its own requirements.
+"""
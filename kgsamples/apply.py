@@ -0,0 +1,210 @@
+"""
+Applies the generated objects directly to a Kubernetes cluster, without calling ``kubectl``.
+
+Requires the ``kubernetes`` package, used to read the kubeconfig and as the pooled HTTP client.
+"""
+import copy
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+import yaml
+from kubragen import KubraGen
+from kubragen.output import OutputProject, OutputFile_Kubernetes, OutputDataDumperDefault
+
+HASH_ANNOTATION = 'kgsamples/applied-hash'
+FIELD_MANAGER = 'kgsamples'
+
+APPLY_APPLIED = 'applied'
+APPLY_UNCHANGED = 'unchanged'
+
+
+class ApplyError(Exception):
+    """Error applying an object."""
+    pass
+
+
+def project_waves(kg: KubraGen, out: OutputProject) -> List[List[Dict[str, Any]]]:
+    """
+    Returns the objects of the Kubernetes files of the project, one wave per file, in output order.
+
+    The objects are rendered to YAML and loaded back, so they are exactly what is written to the output files.
+
+    :param kg: the :class:`kubragen.kubragen.Kubragen` instance
+    :param out: the output project
+    :return: the list of waves
+    """
+    dumper = OutputDataDumperDefault(kg, {})
+    ret = []
+    for file in out.out_sequence:
+        if not isinstance(file, OutputFile_Kubernetes):
+            continue
+        objects = [obj for obj in yaml.safe_load_all(file.to_string(dumper)) if obj is not None]
+        if len(objects) > 0:
+            ret.append(objects)
+    return ret
+
+
+def object_hash(obj: Dict[str, Any]) -> str:
+    """
+    Returns a hash of the object contents, used to skip objects that were already applied.
+    """
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class KubernetesApplier:
+    """
+    Applies objects using server-side apply through a single pooled connection to the Kubernetes API.
+
+    Objects are applied in waves. Each wave starts after the previous one finishes, and the objects inside a wave are
+    applied concurrently. Objects whose hash annotation matches the live object are skipped.
+
+    :param context: the kubeconfig context, the current context if None
+    :param max_workers: concurrent requests inside a wave, also used as the connection pool size
+    :param force: whether to apply objects even if their hash annotation matches
+    :param discovery_timeout: seconds to wait for the API of a newly created CustomResourceDefinition
+    """
+    def __init__(self, context: Optional[str] = None, max_workers: int = 8, force: bool = False,
+                 discovery_timeout: int = 60):
+        try:
+            from kubernetes import client, config
+            from kubernetes.client.rest import ApiException, RESTClientObject
+        except ImportError as e:
+            raise ImportError('The kubernetes package is required to apply, install it with '
+                              '"pip install kubernetes"') from e
+
+        self.configuration = client.Configuration()
+        config.load_kube_config(context=context, client_configuration=self.configuration)
+        self.configuration.connection_pool_maxsize = max_workers
+
+        self.rest_client = RESTClientObject(self.configuration)
+        self.api_exception = ApiException
+        self.max_workers = max_workers
+        self.force = force
+        self.discovery_timeout = discovery_timeout
+        self._discovery: Dict[str, Dict[str, Tuple[str, bool]]] = {}
+        self._discovery_lock = threading.Lock()
+
+    def _request(self, method: str, path: str, query: Optional[Sequence[Tuple[str, str]]] = None,
+                 content_type: Optional[str] = None, body: Optional[str] = None) -> Tuple[int, Any]:
+        """
+        Sends a request to the Kubernetes API.
+
+        :return: the response status and the decoded JSON body
+        """
+        url = self.configuration.host + path
+        if query is not None:
+            url += '?' + urlencode(query)
+        headers = {'Accept': 'application/json'}
+        if content_type is not None:
+            headers['Content-Type'] = content_type
+        for auth in self.configuration.auth_settings().values():
+            if auth['in'] == 'header' and auth['value']:
+                headers[auth['key']] = auth['value']
+
+        try:
+            response = self.rest_client.request(method, url, headers=headers, body=body)
+        except self.api_exception as e:
+            # older clients raise on error statuses
+            return e.status, self._decode(e.body)
+        return response.status, self._decode(response.data if response.data is not None else response.read())
+
+    @staticmethod
+    def _decode(data: Any) -> Any:
+        if not data:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return data
+
+    @staticmethod
+    def _api_path(api_version: str) -> str:
+        if '/' in api_version:
+            return '/apis/{}'.format(api_version)
+        return '/api/{}'.format(api_version)
+
+    def _discover(self, api_version: str) -> Dict[str, Tuple[str, bool]]:
+        """
+        Returns the resources of an API group version, by kind, as a (plural name, namespaced) tuple.
+        """
+        status, discovery = self._request('GET', self._api_path(api_version))
+        if status == 404:
+            return {}
+        if status != 200:
+            raise ApplyError('Error discovering "{}": {}'.format(api_version, discovery))
+        return {resource['kind']: (resource['name'], resource['namespaced'])
+                for resource in discovery['resources'] if '/' not in resource['name']}
+
+    def _resource(self, api_version: str, kind: str) -> Tuple[str, bool]:
+        """
+        Returns the plural name of the resource and whether it is namespaced. Waits for the kind to be available,
+        as CustomResourceDefinitions applied in a previous wave may not be established yet.
+        """
+        with self._discovery_lock:
+            resources = self._discovery.get(api_version)
+        # the lock is not held while waiting, so the objects of the other kinds are not blocked by a pending one
+        deadline = time.monotonic() + self.discovery_timeout
+        while resources is None or kind not in resources:
+            resources = self._discover(api_version)
+            if kind in resources:
+                with self._discovery_lock:
+                    self._discovery[api_version] = resources
+                break
+            if time.monotonic() > deadline:
+                raise ApplyError('Unknown kind "{}" in "{}"'.format(kind, api_version))
+            time.sleep(1)
+        return resources[kind]
+
+    def _object_path(self, obj: Dict[str, Any]) -> str:
+        plural, namespaced = self._resource(obj['apiVersion'], obj['kind'])
+        path = self._api_path(obj['apiVersion'])
+        if namespaced:
+            path += '/namespaces/{}'.format(obj['metadata'].get('namespace') or 'default')
+        return '{}/{}/{}'.format(path, plural, obj['metadata']['name'])
+
+    def apply_object(self, obj: Dict[str, Any]) -> str:
+        """
+        Applies a single object.
+
+        :param obj: the object to apply
+        :return: APPLY_APPLIED or APPLY_UNCHANGED
+        """
+        objhash = object_hash(obj)
+        path = self._object_path(obj)
+
+        if not self.force:
+            status, live = self._request('GET', path)
+            if status == 200 and ((live.get('metadata') or {}).get('annotations') or {}).get(HASH_ANNOTATION) == objhash:
+                return APPLY_UNCHANGED
+            if status not in [200, 404]:
+                raise ApplyError('Error reading {} "{}": {}'.format(obj['kind'], obj['metadata']['name'], live))
+
+        obj = copy.deepcopy(obj)
+        if obj['metadata'].get('annotations') is None:
+            obj['metadata']['annotations'] = {}
+        obj['metadata']['annotations'][HASH_ANNOTATION] = objhash
+
+        # JSON is valid YAML
+        status, result = self._request('PATCH', path, query=[('fieldManager', FIELD_MANAGER), ('force', 'true')],
+                                       content_type='application/apply-patch+yaml', body=json.dumps(obj))
+        if status not in [200, 201]:
+            raise ApplyError('Error applying {} "{}": {}'.format(obj['kind'], obj['metadata']['name'], result))
+        return APPLY_APPLIED
+
+    def apply(self, waves: Sequence[Sequence[Dict[str, Any]]]) -> List[Tuple[Dict[str, Any], str]]:
+        """
+        Applies the waves of objects in order.
+
+        :param waves: the waves of objects, as returned by :func:`project_waves`
+        :return: a list of (object, status) tuples
+        """
+        ret = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for wave in waves:
+                ret.extend(zip(wave, executor.map(self.apply_object, wave)))
+        return ret
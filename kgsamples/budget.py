@@ -0,0 +1,140 @@
+"""
+Reports the size of the generated Kubernetes objects, and checks it against budgets.
+
+The object sizes are of the compact JSON serialization, which is what the API server receives and stores, and the file
+sizes are of the YAML output files.
+"""
+import json
+import re
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+import yaml
+from kubragen import KubraGen
+from kubragen.output import OutputProject, OutputFile_Kubernetes, OutputDataDumperDefault
+
+# the budget names and their defaults, None is unlimited
+DEFAULT_BUDGETS: Dict[str, Optional[int]] = {
+    # a ConfigMap is limited to 1MiB by the API server
+    'object_bytes': 900 * 1024,
+    'file_bytes': None,
+    'total_bytes': None,
+    'total_objects': None,
+}
+
+# kinds whose largest objects are listed in the report
+LARGEST_KINDS = ['ConfigMap', 'Secret', 'CustomResourceDefinition']
+LARGEST_COUNT = 5
+
+_SIZE_UNITS = {
+    '': 1,
+    'k': 1000, 'm': 1000 ** 2,
+    'ki': 1024, 'mi': 1024 ** 2,
+}
+
+
+class BudgetError(Exception):
+    """Invalid budget."""
+    pass
+
+
+def parse_budget(value: str) -> Dict[str, Optional[int]]:
+    """
+    Parses a ```name=size``` budget, the size accepts the ```K```, ```M```, ```Ki``` and ```Mi``` suffixes, and
+    ```none``` removes the budget.
+
+    :raises BudgetError: on invalid budget
+    """
+    name, sep, size = value.partition('=')
+    if sep == '' or name not in DEFAULT_BUDGETS:
+        raise BudgetError('Invalid budget "{}", the names are {}'.format(value, ', '.join(DEFAULT_BUDGETS)))
+    if size.lower() == 'none':
+        return {name: None}
+    m = re.fullmatch(r'(\d+)\s*([a-z]*)', size.strip().lower())
+    if m is None or m.group(2) not in _SIZE_UNITS:
+        raise BudgetError('Invalid budget size "{}"'.format(size))
+    return {name: int(m.group(1)) * _SIZE_UNITS[m.group(2)]}
+
+
+def budgets(values: Optional[Sequence[str]] = None) -> Dict[str, Optional[int]]:
+    """
+    Returns the default budgets updated with the ```name=size``` values.
+    """
+    ret = dict(DEFAULT_BUDGETS)
+    for value in values if values is not None else []:
+        ret.update(parse_budget(value))
+    return ret
+
+
+def size_report(kg: KubraGen, out: OutputProject) -> Dict[str, Any]:
+    """
+    Returns the size report of the Kubernetes files of the project.
+
+    :param kg: the :class:`kubragen.kubragen.Kubragen` instance
+    :param out: the output project
+    :return: a JSON serializable report
+    """
+    dumper = OutputDataDumperDefault(kg, {})
+    files = []
+    objects = []
+    kinds: Dict[str, Dict[str, int]] = {}
+    for fidx, file in enumerate(out.out_sequence):
+        if not isinstance(file, OutputFile_Kubernetes):
+            continue
+        filename = file.output_filename(fidx)
+        contents = file.to_string(dumper)
+        file_objects = 0
+        for obj in yaml.safe_load_all(contents):
+            if obj is None:
+                continue
+            size = len(json.dumps(obj, separators=(',', ':')).encode('utf-8'))
+            metadata = obj.get('metadata') or {}
+            objects.append({
+                'file': filename,
+                'kind': obj.get('kind'),
+                'namespace': metadata.get('namespace'),
+                'name': metadata.get('name'),
+                'bytes': size,
+            })
+            kind = kinds.setdefault(obj.get('kind'), {'count': 0, 'bytes': 0})
+            kind['count'] += 1
+            kind['bytes'] += size
+            file_objects += 1
+        files.append({'name': filename, 'objects': file_objects, 'bytes': len(contents.encode('utf-8'))})
+
+    objects.sort(key=lambda o: o['bytes'], reverse=True)
+    return {
+        'total_objects': len(objects),
+        'total_bytes': sum(f['bytes'] for f in files),
+        'kinds': dict(sorted(kinds.items())),
+        'files': files,
+        'largest': {kind: [o for o in objects if o['kind'] == kind][:LARGEST_COUNT]
+                    for kind in LARGEST_KINDS if kind in kinds},
+        'objects': objects,
+    }
+
+
+def budget_violations(report: Mapping[str, Any], limits: Mapping[str, Optional[int]]) -> List[str]:
+    """
+    Returns the budgets exceeded by a report, as messages.
+
+    :param report: the report, as returned by :func:`size_report`
+    :param limits: the budgets, as returned by :func:`budgets`
+    """
+    ret = []
+    if limits.get('object_bytes') is not None:
+        for obj in report['objects']:
+            if obj['bytes'] > limits['object_bytes']:
+                ret.append('{} "{}" in {} has {} bytes, over the object budget of {}'.format(
+                    obj['kind'], obj['name'], obj['file'], obj['bytes'], limits['object_bytes']))
+    if limits.get('file_bytes') is not None:
+        for file in report['files']:
+            if file['bytes'] > limits['file_bytes']:
+                ret.append('{} has {} bytes, over the file budget of {}'.format(
+                    file['name'], file['bytes'], limits['file_bytes']))
+    if limits.get('total_bytes') is not None and report['total_bytes'] > limits['total_bytes']:
+        ret.append('The output has {} bytes, over the total budget of {}'.format(
+            report['total_bytes'], limits['total_bytes']))
+    if limits.get('total_objects') is not None and report['total_objects'] > limits['total_objects']:
+        ret.append('The output has {} objects, over the budget of {}'.format(
+            report['total_objects'], limits['total_objects']))
+    return ret
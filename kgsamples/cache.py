@@ -0,0 +1,251 @@
+"""
+Persistent cache of builder output.
+
+The key is a hash of the state of the builder, which includes its options, jsonpatches and the
+:class:`kubragen.kubragen.KubraGen` instance with the provider and the root options, and of the installed KubraGen
+package versions. The classes and functions defined by the samples, like configuration file extensions, are hashed
+with their source code, so changing them changes the key.
+
+The entries are unpickled, so the cache directory is created private to the user, and entries owned by other users are
+ignored.
+"""
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import tempfile
+import warnings
+from importlib import metadata
+from typing import Any, List, Optional, Sequence, Set
+
+from kubragen.builder import Builder
+from kubragen.object import ObjectItem
+from kubragen.types import TBuild
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+def default_cache_path(name: str = 'build') -> str:
+    """
+    Returns the default cache directory, inside ```$XDG_CACHE_HOME``` or ```~/.cache```.
+
+    :param name: the cache name
+    """
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                        'kgsamples', name)
+
+
+def package_versions() -> List[str]:
+    """
+    Returns the installed versions of kubragen and the kg_* packages, sorted.
+    """
+    ret = set()
+    for dist in metadata.distributions():
+        name = (dist.metadata['Name'] or '').lower().replace('_', '-')
+        if name == 'kubragen' or name.startswith('kg-') or name.startswith('kgpr-'):
+            ret.add('{}=={}'.format(name, dist.version))
+    return sorted(ret)
+
+
+# the modules of the versioned packages, whose classes are identified by name
+VERSIONED_MODULES = ('kubragen', 'kg_', 'kgpr_')
+
+_SCALARS = (bool, int, float, complex, type(None))
+
+
+@functools.lru_cache(maxsize=1024)
+def _code_id(value: Any) -> str:
+    """
+    Returns the identity of a class or function: its name, and its source code if it is not from a versioned package.
+    """
+    module = getattr(value, '__module__', None) or ''
+    name = getattr(value, '__qualname__', None) or repr(value)
+    if module.startswith(VERSIONED_MODULES) or module in ['builtins', 'typing']:
+        return '{}.{}'.format(module, name)
+    try:
+        source = inspect.getsource(value)
+    except (OSError, TypeError):
+        return '{}.{}'.format(module, name)
+    # the module name is not used, as it depends on how the sample was imported
+    return '{}:{}'.format(name, hashlib.sha256(source.encode('utf-8')).hexdigest())
+
+
+def _hash_state(value: Any, digest: Any, path: Set[int]) -> None:
+    """
+    Adds the state of a value to a hash, recursively. The order of the mappings is kept, as it is the order of the
+    output. ```path``` has the objects being hashed, to detect cycles.
+    """
+    if isinstance(value, _SCALARS):
+        digest.update('{}:{!r};'.format(type(value).__name__, value).encode('utf-8'))
+        return
+    if isinstance(value, (str, bytes)):
+        # the type is included, as str subclasses like LiteralStr are output differently
+        data = value.encode('utf-8') if isinstance(value, str) else value
+        digest.update('{}:{}:'.format(_code_id(type(value)), len(data)).encode('utf-8'))
+        digest.update(data)
+        return
+    if isinstance(value, type) or callable(value) and hasattr(value, '__code__'):
+        digest.update('code:{};'.format(_code_id(value)).encode('utf-8'))
+        return
+    if id(value) in path:
+        # the shared objects are hashed each time, as whether an object is shared can change between processes
+        digest.update(b'cycle;')
+        return
+    path.add(id(value))
+
+    digest.update('{}('.format(_code_id(type(value))).encode('utf-8'))
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _hash_state(key, digest, path)
+            _hash_state(item, digest, path)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _hash_state(item, digest, path)
+    elif isinstance(value, (set, frozenset)):
+        for item in sorted(value, key=repr):
+            _hash_state(item, digest, path)
+    elif hasattr(value, '__dict__') or hasattr(value, '__slots__'):
+        state = dict(getattr(value, '__dict__', {}))
+        for slot in getattr(type(value), '__slots__', ()):
+            if hasattr(value, slot):
+                state[slot] = getattr(value, slot)
+        _hash_state(state, digest, path)
+    else:
+        # objects without attributes, like compiled regular expressions
+        digest.update(repr(value).encode('utf-8'))
+    digest.update(b')')
+    path.remove(id(value))
+
+
+def state_hash(value: Any) -> str:
+    """
+    Returns a hash of the state of a value, like a builder: its attributes and items, recursively.
+    """
+    digest = hashlib.sha256()
+    _hash_state(value, digest, set())
+    return digest.hexdigest()
+
+
+def _owned(stat: os.stat_result) -> bool:
+    """
+    Returns whether a file is owned by the current user. Always True where there are no user ids.
+    """
+    return not hasattr(os, 'getuid') or stat.st_uid == os.getuid()
+
+
+class BuildCache:
+    """
+    Stores the output of builders on disk, and reuses it when a builder with the same options is built again.
+
+    The least recently used entries are removed when the cache grows over its maximum size. If the cache can't be
+    written, the builders are built without it. The builds whose output can't be stored are counted in
+    ```skipped``` and reported with a warning.
+
+    :param path: the cache directory, :func:`default_cache_path` if None
+    :param max_size: the maximum size of the cache in bytes
+    """
+    def __init__(self, path: Optional[str] = None, max_size: int = DEFAULT_MAX_SIZE):
+        self.path = path if path is not None else default_cache_path()
+        self.max_size = max_size
+        self.versions = package_versions()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def key(self, builder: Builder, buildnames: Sequence[TBuild]) -> str:
+        """
+        Returns the cache key of a build.
+        """
+        return state_hash((self.versions, builder, list(buildnames)))
+
+    def build(self, builder: Builder, *buildnames: TBuild) -> Sequence[ObjectItem]:
+        """
+        Builds the build names of the builder, using the cached output if available.
+
+        :param builder: the builder
+        :param buildnames: the build names
+        :return: the built objects
+        """
+        filename = os.path.join(self.path, '{}.pickle'.format(self.key(builder, buildnames)))
+        try:
+            with open(filename, 'rb') as f:
+                if not _owned(os.fstat(f.fileno())):
+                    raise PermissionError('Cache entry not owned by the current user')
+                ret = pickle.load(f)
+            # the modification time is used for the LRU eviction
+            os.utime(filename)
+            self.hits += 1
+            return ret
+        except Exception:
+            # missing or unreadable entry
+            pass
+
+        self.misses += 1
+        ret = builder.build(*buildnames)
+        self._store(filename, builder, ret)
+        return ret
+
+    def _store(self, filename: str, builder: Builder, items: Sequence[ObjectItem]) -> None:
+        try:
+            data = pickle.dumps(items, protocol=4)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            self.skipped += 1
+            warnings.warn('The output of {} is not cached: {}'.format(type(builder).__name__, e))
+            return
+        try:
+            os.makedirs(self.path, mode=0o700, exist_ok=True)
+            if not _owned(os.stat(self.path)):
+                return
+            fd, tmpname = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmpname, filename)
+            except OSError:
+                os.remove(tmpname)
+                raise
+            self._evict()
+        except OSError:
+            # read-only or full file system, the build result is used without caching it
+            pass
+
+    def _evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.pickle'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self) -> None:
+        """
+        Removes all entries of the cache.
+        """
+        if os.path.isdir(self.path):
+            for entry in os.scandir(self.path):
+                if entry.name.endswith('.pickle'):
+                    os.remove(entry.path)
+
+
+def cached_build(build_cache: Optional[BuildCache], builder: Builder, *buildnames: TBuild) -> Sequence[ObjectItem]:
+    """
+    Builds the builder, using the persistent build cache if enabled.
+
+    :param build_cache: the build cache, None if disabled
+    """
+    if build_cache is None:
+        return builder.build(*buildnames)
+    return build_cache.build(builder, *buildnames)
@@ -0,0 +1,217 @@
+"""
+Composes several samples into a single render for one cluster.
+
+The stacks share one Traefik, the namespaces and storage setup, and the Grafana of the Prometheus stack, with the
+Loki datasource when both are composed. Each stack is built by its own sample, the output files with the same name
+are merged, and the objects generated by more than one stack are output once.
+
+Usage::
+
+    $ python -m kgsamples.compose -p k3d --stacks prometheus loki efk --option size=small
+"""
+import argparse
+import datetime
+import os
+import sys
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import yaml
+from kubragen.exception import InvalidParamError
+from kubragen.output import OutputProject, OutputFile, OutputFile_Kubernetes, OutputFile_ShellScript, \
+    OD_FileTemplate, OutputDataDumperDefault, OutputDriver_Directory
+
+from .images import image_prepull_daemonset
+from .render import STACKS, RenderError, load_stack, stack_args
+from .sample import OptionError
+
+
+def compose_overrides(stacks: Sequence[str], options: Optional[Mapping[str, Any]] = None,
+                      stack_options: Optional[Mapping[str, Mapping[str, Any]]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the option overrides of each stack, adding the options that make Loki use the Grafana of the
+    Prometheus stack.
+
+    :param stacks: the stack names
+    :param options: the options of all the stacks
+    :param stack_options: the options of each stack, by stack name
+    """
+    ret = {}
+    for stack in stacks:
+        ret[stack] = dict(options if options is not None else {})
+        ret[stack].update((stack_options if stack_options is not None else {}).get(stack) or {})
+    if 'prometheus' in stacks and 'loki' in stacks:
+        ret['prometheus']['loki_datasource'] = True
+        ret['loki']['no_grafana'] = True
+    return ret
+
+
+def _object_key(obj: Mapping[str, Any]) -> Tuple[str, str, str]:
+    metadata = obj.get('metadata') or {}
+    return obj.get('kind'), metadata.get('namespace'), metadata.get('name')
+
+
+def compose(provider: str, stacks: Sequence[str],
+            overrides: Optional[Mapping[str, Mapping[str, Any]]] = None) -> Tuple[OutputProject, List[str]]:
+    """
+    Builds the stacks and merges their outputs.
+
+    Objects generated by more than one stack are output once. If their contents differ, the object of the first
+    stack, in :data:`kgsamples.render.STACKS` order, is used, and a warning is returned. The provider setup of the
+    shell script is the one of the first stack.
+
+    :param provider: the sample provider, like ```k3d```
+    :param stacks: the stack names
+    :param overrides: the sample options of each stack, see :func:`compose_overrides`
+    :return: a (output project, warnings) tuple
+    :raises RenderError: on invalid stack or options
+    """
+    stacks = [stack for stack in STACKS if stack in stacks]
+    if len(stacks) == 0:
+        raise RenderError('No stacks to compose')
+    overrides = overrides if overrides is not None else compose_overrides(stacks)
+
+    builds = []
+    for stack in stacks:
+        module = load_stack(stack)
+        try:
+            kg, out = module.build(stack_args(stack, provider, overrides.get(stack)))
+        except OptionError as e:
+            raise RenderError('{}: {}'.format(stack, e)) from e
+        builds.append((stack, module, kg, out))
+
+    # merge the files with the same name, keeping the order of each stack
+    files: 'OrderedDict[str, List[Dict[str, Any]]]' = OrderedDict()
+    seen: Dict[Tuple[str, str, str], Tuple[str, Dict[str, Any]]] = {}
+    warnings = []
+    images = set()
+    for stack, module, kg, out in builds:
+        dumper = OutputDataDumperDefault(kg, {})
+        filenames = [file.filename for file in out.out_sequence if isinstance(file, OutputFile_Kubernetes)]
+        for file in out.out_sequence:
+            if not isinstance(file, OutputFile_Kubernetes):
+                continue
+            if file.filename not in files:
+                # before the next file of the stack already merged, or at the end
+                files[file.filename] = []
+                following = [name for name in filenames[filenames.index(file.filename) + 1:] if name in files]
+                if len(following) > 0:
+                    names = list(files)
+                    for name in names[names.index(following[0]):]:
+                        if name != file.filename:
+                            files.move_to_end(name)
+            if file.filename == 'prepull.yaml':
+                # built below with the images of all the stacks
+                continue
+            for obj in yaml.safe_load_all(file.to_string(dumper)):
+                if obj is None:
+                    continue
+                key = _object_key(obj)
+                if key in seen:
+                    if seen[key][1] != obj:
+                        warnings.append('{} "{}" of {} differs from the one of {}, using the one of {}'.format(
+                            key[0], key[2], stack, seen[key][0], seen[key][0]))
+                    continue
+                seen[key] = (stack, obj)
+                files[file.filename].append(obj)
+        for file in out.out_single:
+            if file.filename == 'images.txt':
+                images.update(image for data in file.data for image in str(data).split('\n') if image != '')
+
+    first_stack, first_module, first_kg, first_out = builds[0]
+    ret = OutputProject(first_kg)
+
+    for file in first_out.out_single:
+        if isinstance(file, OutputFile_ShellScript):
+            # the provider setup of the first stack, the files are applied below
+            shell_script = OutputFile_ShellScript(file.filename)
+            for data in file.data:
+                if not (isinstance(data, OD_FileTemplate) and data.startswith('kubectl apply -f ')):
+                    shell_script.append(data)
+            ret.append(shell_script)
+        elif file.filename == 'images.txt':
+            # the images of all the stacks
+            images_file = OutputFile(file.filename, is_sequence=False)
+            images_file.fileid = file.fileid
+            images_file.append('\n'.join(sorted(images) + ['']))
+            ret.append(images_file)
+        else:
+            ret.append(file)
+
+    if 'prepull.yaml' in files:
+        files['prepull.yaml'] = [image_prepull_daemonset(sorted(images))]
+
+    for filename, objects in files.items():
+        if len(objects) == 0:
+            continue
+        file = OutputFile_Kubernetes(filename)
+        file.append(objects)
+        ret.append(file)
+        shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+
+    return ret, warnings
+
+
+def _option(value: str) -> Tuple[str, Any]:
+    name, sep, item = value.partition('=')
+    if sep == '':
+        return name, True
+    return name, {'true': True, 'false': False}.get(item, item)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render several samples into a single cluster')
+    parser.add_argument('-p', '--provider', help='provider', required=True)
+    parser.add_argument('-o', '--output-path', help='output path', default='output')
+    parser.add_argument('--stacks', help='stacks to compose', nargs='+', default=list(STACKS), choices=list(STACKS))
+    parser.add_argument('--option', help='option of all the stacks, as name=value', action='append', default=[])
+    parser.add_argument('--stack-option', help='option of a stack, as stack:name=value', action='append',
+                        default=[])
+    parser.add_argument('--validate', help='validate the objects against the Kubernetes schemas', action='store_true')
+    args = parser.parse_args()
+
+    def add_option(options, value):
+        name, item = _option(value)
+        if name in options:
+            options[name] = (options[name] if isinstance(options[name], list) else [options[name]]) + [item]
+        else:
+            options[name] = item
+
+    options = {}
+    for value in args.option:
+        add_option(options, value)
+    stack_options = {}
+    for value in args.stack_option:
+        stack, sep, option = value.partition(':')
+        if sep == '' or stack not in STACKS:
+            parser.error('Invalid stack option "{}"'.format(value))
+        add_option(stack_options.setdefault(stack, {}), option)
+
+    try:
+        out, warnings = compose(args.provider, args.stacks, compose_overrides(args.stacks, options, stack_options))
+    except RenderError as e:
+        parser.error(str(e))
+    except InvalidParamError as e:
+        # raised by the builders, like when a dashboard download fails
+        print('Error building the samples: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+    for warning in warnings:
+        print('Warning: {}'.format(warning), file=sys.stderr)
+
+    if args.validate:
+        from .validate import validate_project
+
+        errors = validate_project(out.kg, out)
+        if len(errors) > 0:
+            for error in errors:
+                print('Invalid object: {}'.format(error), file=sys.stderr)
+            sys.exit(1)
+
+    output_path = os.path.join(args.output_path, '{}-{}'.format(
+        args.provider, datetime.datetime.today().strftime("%Y%m%d-%H%M%S")))
+    print('Saving files to {}'.format(output_path))
+    out.output(OutputDriver_Directory(output_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Container images used by the generated objects, and their pre-pull on the cluster nodes.
+"""
+from collections.abc import Mapping
+from typing import Any, Dict, List, Sequence
+
+from kubragen.data import DataGetValue
+from kubragen.output import OutputProject, OutputFile_Kubernetes
+
+
+def container_images(out: OutputProject) -> List[str]:
+    """
+    Returns the container images used by the Kubernetes objects of the output project, sorted.
+    """
+    images = set()
+
+    def walk(data):
+        data = DataGetValue(data)
+        if isinstance(data, Mapping):
+            for key, value in data.items():
+                if key in ['containers', 'initContainers']:
+                    for container in DataGetValue(value):
+                        image = DataGetValue(DataGetValue(container).get('image'))
+                        if image is not None:
+                            images.add(str(image))
+                else:
+                    walk(value)
+        elif isinstance(data, list):
+            for item in data:
+                walk(item)
+
+    for file in out.out_sequence + out.out_single:
+        if isinstance(file, OutputFile_Kubernetes):
+            walk(file.data)
+    return sorted(images)
+
+
+def image_prepull_daemonset(images: Sequence[str]) -> Dict[str, Any]:
+    """
+    DaemonSet that pulls the images on all nodes. Each image runs a copy of the static busybox binary as an init
+    container, so images without a shell are also pulled.
+    """
+    return {
+        'apiVersion': 'apps/v1',
+        'kind': 'DaemonSet',
+        'metadata': {
+            'name': 'image-prepull',
+            'namespace': 'monitoring',
+        },
+        'spec': {
+            'selector': {
+                'matchLabels': {
+                    'app': 'image-prepull',
+                }
+            },
+            'template': {
+                'metadata': {
+                    'labels': {
+                        'app': 'image-prepull',
+                    }
+                },
+                'spec': {
+                    'initContainers': [{
+                        'name': 'busybox',
+                        'image': 'busybox:1.32',
+                        'command': ['cp', '/bin/busybox', '/prepull/busybox'],
+                        'volumeMounts': [{
+                            'name': 'prepull',
+                            'mountPath': '/prepull',
+                        }],
+                    }] + [{
+                        'name': 'image-{}'.format(idx),
+                        'image': image,
+                        'command': ['/prepull/busybox', 'true'],
+                        'volumeMounts': [{
+                            'name': 'prepull',
+                            'mountPath': '/prepull',
+                        }],
+                    } for idx, image in enumerate(images)],
+                    'containers': [{
+                        'name': 'pause',
+                        'image': 'k8s.gcr.io/pause:3.2',
+                    }],
+                    'tolerations': [{
+                        'operator': 'Exists',
+                    }],
+                    'volumes': [{
+                        'name': 'prepull',
+                        'emptyDir': {},
+                    }],
+                }
+            }
+        }
+    }
@@ -0,0 +1,216 @@
+"""
+Renders the samples for a fleet of clusters described in an inventory file.
+
+The jobs run in a pool of worker processes, as the samples change module-level state while building. Each worker
+imports the samples once and renders several jobs, and the build cache on disk is shared by all of them.
+
+Inventory example::
+
+    defaults:
+      prometheus:
+        size: small
+    clusters:
+    - name: eu-1
+      provider: amazon-eks
+      stacks:
+        prometheus:
+          size: large
+          load: light
+        loki: {}
+
+Usage::
+
+    $ python -m kgsamples.inventory inventory.yaml -o output --workers 4
+"""
+import argparse
+import os
+import re
+import signal
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional
+
+import yaml
+from kubragen.exception import InvalidParamError
+
+from .render import STACKS, RenderError, load_stack, stack_args
+
+
+class InventoryError(Exception):
+    """Invalid inventory file."""
+    pass
+
+
+class JobTimeout(Exception):
+    """A job took longer than its timeout."""
+    pass
+
+
+# the cluster names are used as output directory names
+CLUSTER_NAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+
+# seconds a job may take, by default
+DEFAULT_JOB_TIMEOUT = 300.0
+
+
+class InventoryJob(NamedTuple):
+    """A stack to render for a cluster."""
+    cluster: str
+    stack: str
+    provider: str
+    overrides: Dict[str, Any]
+
+
+class JobResult(NamedTuple):
+    """The result of an :class:`InventoryJob`, *error* is None on success."""
+    job: InventoryJob
+    seconds: float
+    error: Optional[str]
+
+
+def inventory_jobs(inventory: Mapping[str, Any]) -> List[InventoryJob]:
+    """
+    Returns the jobs of a loaded inventory file.
+
+    The overrides of each stack are merged over the ```defaults``` of the stack, and are the sample command line
+    options, like in :func:`kgsamples.render.overrides_argv`.
+
+    :raises InventoryError: on invalid inventory
+    """
+    defaults = inventory.get('defaults') or {}
+    clusters = inventory.get('clusters')
+    if not isinstance(clusters, list):
+        raise InventoryError('The inventory must have a "clusters" list')
+
+    ret = []
+    names = set()
+    for cluster in clusters:
+        if not isinstance(cluster, Mapping) or 'name' not in cluster or 'provider' not in cluster:
+            raise InventoryError('Each cluster must have a "name" and a "provider"')
+        name = str(cluster['name'])
+        if CLUSTER_NAME_RE.match(name) is None:
+            raise InventoryError('Invalid cluster name "{}", only letters, digits, ".", "_" and "-" are '
+                                 'allowed'.format(name))
+        if name in names:
+            raise InventoryError('Duplicated cluster "{}"'.format(name))
+        names.add(name)
+        for stack, overrides in (cluster.get('stacks') or {}).items():
+            if stack not in STACKS:
+                raise InventoryError('Unknown stack "{}" in cluster "{}"'.format(stack, name))
+            merged = dict(defaults.get(stack) or {})
+            merged.update(overrides or {})
+            ret.append(InventoryJob(cluster=name, stack=stack, provider=str(cluster['provider']), overrides=merged))
+    return ret
+
+
+def load_inventory(filename: str) -> List[InventoryJob]:
+    """
+    Loads the jobs of an inventory file.
+
+    :raises InventoryError: on invalid inventory
+    """
+    with open(filename, 'r') as f:
+        inventory = yaml.safe_load(f)
+    if not isinstance(inventory, Mapping):
+        raise InventoryError('The inventory must be a mapping')
+    return inventory_jobs(inventory)
+
+
+def _init_worker() -> None:
+    for stack in STACKS:
+        load_stack(stack)
+
+
+def _job_timeout(signum, frame):
+    raise JobTimeout()
+
+
+def render_job(job: InventoryJob, output_path: str, timeout: Optional[float] = None) -> JobResult:
+    """
+    Renders a job to ```<output_path>/<cluster>/<stack>```. Errors are returned in the result instead of raised, so
+    a failing job does not stop the others.
+
+    :param timeout: seconds the job may take, interrupted with ```SIGALRM```. Only used in the main thread of a
+        process on the platforms that have it, like in the worker processes of :func:`render_inventory`
+    """
+    from kubragen.output import OutputDriver_Directory
+
+    alarm = timeout is not None and hasattr(signal, 'setitimer') and \
+        threading.current_thread() is threading.main_thread()
+    start = time.monotonic()
+    try:
+        if alarm:
+            signal.signal(signal.SIGALRM, _job_timeout)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        kg, out = load_stack(job.stack).build(stack_args(job.stack, job.provider, job.overrides))
+        job_path = os.path.join(output_path, job.cluster, job.stack)
+        os.makedirs(job_path, exist_ok=True)
+        out.output(OutputDriver_Directory(job_path))
+    except (RenderError, InvalidParamError) as e:
+        return JobResult(job=job, seconds=time.monotonic() - start, error=str(e))
+    except JobTimeout:
+        return JobResult(job=job, seconds=time.monotonic() - start, error='Timed out after {}s'.format(timeout))
+    except Exception:
+        return JobResult(job=job, seconds=time.monotonic() - start, error=traceback.format_exc())
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return JobResult(job=job, seconds=time.monotonic() - start, error=None)
+
+
+def render_inventory(jobs: List[InventoryJob], output_path: str, workers: Optional[int] = None,
+                     timeout: Optional[float] = DEFAULT_JOB_TIMEOUT) -> List[JobResult]:
+    """
+    Renders the jobs in a pool of worker processes.
+
+    :param jobs: the jobs, as returned by :func:`load_inventory`
+    :param output_path: the output directory
+    :param workers: the number of worker processes, the number of CPUs if None
+    :param timeout: seconds each job may take, no limit if None
+    :return: the results, in completion order
+    """
+    ret = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {executor.submit(render_job, job, output_path, timeout): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                ret.append(future.result())
+            except Exception as e:
+                # the worker process died
+                ret.append(JobResult(job=futures[future], seconds=0, error='Worker failed: {}'.format(e)))
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the samples for an inventory of clusters')
+    parser.add_argument('inventory', help='inventory file')
+    parser.add_argument('-o', '--output-path', help='output path', default='output')
+    parser.add_argument('-w', '--workers', help='number of worker processes', type=int, default=None)
+    parser.add_argument('--timeout', help='seconds each job may take', type=float, default=DEFAULT_JOB_TIMEOUT)
+    args = parser.parse_args()
+
+    try:
+        jobs = load_inventory(args.inventory)
+    except InventoryError as e:
+        parser.error(str(e))
+
+    start = time.monotonic()
+    results = render_inventory(jobs, args.output_path, workers=args.workers, timeout=args.timeout)
+    failed = 0
+    for result in results:
+        print('{:<40} {:<8} {:6.2f}s'.format('{}/{}'.format(result.job.cluster, result.job.stack),
+                                             'ok' if result.error is None else 'FAILED', result.seconds))
+        if result.error is not None:
+            failed += 1
+            print('    ' + result.error.rstrip().replace('\n', '\n    '))
+    print('Rendered {} jobs to {} in {:.2f}s, {} failed'.format(len(results), args.output_path,
+                                                               time.monotonic() - start, failed))
+    if failed > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
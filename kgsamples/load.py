@@ -0,0 +1,167 @@
+"""
+Workloads that generate load to benchmark the stacks, and the Grafana dashboards that show it.
+"""
+import json
+from typing import Any, Dict, Mapping, Sequence, Tuple
+
+from kubragen.helper import QuotedStr
+
+
+def metrics_generator_deployment(namespace: str, metrics: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Deployment that exports a fixed number of metric series per replica, scraped through its prometheus.io annotations.
+    The series are not cycled, so the number of series is stable during the benchmark.
+    """
+    return {
+        'apiVersion': 'apps/v1',
+        'kind': 'Deployment',
+        'metadata': {
+            'name': 'metrics-generator',
+            'namespace': namespace,
+            'labels': {
+                'app': 'metrics-generator',
+            },
+        },
+        'spec': {
+            'replicas': metrics['replicas'],
+            'selector': {
+                'matchLabels': {
+                    'app': 'metrics-generator',
+                },
+            },
+            'template': {
+                'metadata': {
+                    'labels': {
+                        'app': 'metrics-generator',
+                    },
+                    'annotations': {
+                        'prometheus.io/scrape': QuotedStr('true'),
+                        'prometheus.io/port': QuotedStr('9001'),
+                    },
+                },
+                'spec': {
+                    'containers': [{
+                        'name': 'metrics-generator',
+                        'image': 'quay.io/freshtracks.io/avalanche',
+                        'args': [
+                            '--metric-count={}'.format(metrics['metric_count']),
+                            '--series-count={}'.format(metrics['series_count']),
+                            '--series-interval=86400',
+                            '--metric-interval=86400',
+                            '--port=9001',
+                        ],
+                        'ports': [{
+                            'containerPort': 9001,
+                        }],
+                    }],
+                },
+            },
+        },
+    }
+
+
+def log_generator_deployment(namespace: str, logs: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Deployment that writes log lines of a fixed size at a fixed rate per replica. Each second the lines are written in a
+    single burst, using only shell builtins.
+    """
+    script = 'n=0; while true; do i=0; while [ $i -lt {} ]; do i=$((i+1)); n=$((n+1)); ' \
+             'echo "level=info seq=$n pod=$HOSTNAME msg={}"; done; sleep 1; done'.format(
+                logs['rate'], 'x' * logs['message_size'])
+    return {
+        'apiVersion': 'apps/v1',
+        'kind': 'Deployment',
+        'metadata': {
+            'name': 'log-generator',
+            'namespace': namespace,
+            'labels': {
+                'app': 'log-generator',
+            },
+        },
+        'spec': {
+            'replicas': logs['replicas'],
+            'selector': {
+                'matchLabels': {
+                    'app': 'log-generator',
+                },
+            },
+            'template': {
+                'metadata': {
+                    'labels': {
+                        'app': 'log-generator',
+                    },
+                },
+                'spec': {
+                    'containers': [{
+                        'name': 'log-generator',
+                        'image': 'busybox:1.32',
+                        'command': ['sh', '-c', script],
+                    }],
+                },
+            },
+        },
+    }
+
+
+def http_load_job(namespace: str, url: str, http: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Job that sends requests at a fixed rate to an url for the duration of the benchmark.
+    """
+    return {
+        'apiVersion': 'batch/v1',
+        'kind': 'Job',
+        'metadata': {
+            'name': 'http-load',
+            'namespace': namespace,
+            'labels': {
+                'app': 'http-load',
+            },
+        },
+        'spec': {
+            'backoffLimit': 0,
+            'template': {
+                'metadata': {
+                    'labels': {
+                        'app': 'http-load',
+                    },
+                },
+                'spec': {
+                    'restartPolicy': 'Never',
+                    'containers': [{
+                        'name': 'http-load',
+                        'image': 'williamyeh/hey',
+                        # the rate is per worker
+                        'args': ['-z', http['duration'], '-c', str(http['concurrency']),
+                                 '-q', str(max(1, http['rps'] // http['concurrency'])), url],
+                    }],
+                },
+            },
+        },
+    }
+
+
+def graph_dashboard(title: str, uid: str, datasource: str, panels: Sequence[Tuple[str, str]]) -> str:
+    """
+    Returns the source of a Grafana dashboard with a graph for each (title, query) panel.
+    """
+    return json.dumps({
+        'title': title,
+        'uid': uid,
+        'schemaVersion': 26,
+        'refresh': '10s',
+        'time': {
+            'from': 'now-30m',
+            'to': 'now',
+        },
+        'panels': [{
+            'id': idx + 1,
+            'type': 'graph',
+            'title': title,
+            'datasource': datasource,
+            'gridPos': {'x': (idx % 2) * 12, 'y': (idx // 2) * 8, 'w': 12, 'h': 8},
+            'targets': [{
+                'refId': 'A',
+                'expr': expr,
+            }],
+        } for idx, (title, expr) in enumerate(panels)],
+    }, indent=2)
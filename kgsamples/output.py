@@ -0,0 +1,168 @@
+"""
+Output drivers that stream the generated files instead of writing them to a directory.
+
+The stdout drivers write only the Kubernetes objects, so they can be piped to ``kubectl apply -f -``, and the archive
+drivers write all the files, to a file or to stdout. The changed files driver rewrites only the files whose contents
+changed, used by the watch mode.
+"""
+import io
+import json
+import os
+import stat
+import sys
+import tarfile
+import time
+import zipfile
+from typing import Any, BinaryIO, List, Optional, TextIO
+
+import yaml
+from kubragen.output import OutputDriver, OutputFile, OutputFile_Kubernetes
+
+OUTPUT_FORMATS = ['directory', 'yaml', 'ndjson', 'tar', 'tgz', 'zip']
+
+ARCHIVE_EXTENSIONS = {
+    'tar': 'tar',
+    'tgz': 'tar.gz',
+    'zip': 'zip',
+}
+
+
+class OutputDriver_Stdout(OutputDriver):
+    """
+    An :class:`kubragen.output.OutputDriver` that writes the Kubernetes objects to a stream, as multi-document YAML
+    or as one JSON object per line. The other files are skipped.
+
+    :param stream: the output stream, stdout if None
+    :param output_format: ```yaml``` or ```ndjson```
+    """
+    def __init__(self, stream: Optional[TextIO] = None, output_format: str = 'yaml'):
+        if output_format not in ['yaml', 'ndjson']:
+            raise ValueError('Unknown format "{}"'.format(output_format))
+        self.stream = stream if stream is not None else sys.stdout
+        self.output_format = output_format
+        self._first = True
+
+    def write_file(self, file: OutputFile, filename: str, filecontents: Any) -> None:
+        if not isinstance(file, OutputFile_Kubernetes) or not filecontents.strip():
+            return
+        if self.output_format == 'ndjson':
+            for obj in yaml.safe_load_all(filecontents):
+                if obj is not None:
+                    self.stream.write(json.dumps(obj, separators=(',', ':')) + '\n')
+        else:
+            if not self._first:
+                self.stream.write('---\n')
+            self.stream.write(filecontents if filecontents.endswith('\n') else filecontents + '\n')
+            self._first = False
+        self.stream.flush()
+
+    def close(self) -> None:
+        pass
+
+
+class OutputDriver_Tar(OutputDriver):
+    """
+    An :class:`kubragen.output.OutputDriver` that streams the files to a tar archive, optionally gzipped.
+
+    :param fileobj: the binary output stream, which doesn't need to be seekable
+    :param prefix: the directory of the files inside the archive
+    :param compress: whether to gzip the archive
+    """
+    def __init__(self, fileobj: BinaryIO, prefix: str = '', compress: bool = False):
+        self.prefix = prefix
+        self.tar = tarfile.open(fileobj=fileobj, mode='w|gz' if compress else 'w|')
+
+    def write_file(self, file: OutputFile, filename: str, filecontents: Any) -> None:
+        data = filecontents.encode(file.file_encoding())
+        info = tarfile.TarInfo(self.prefix + filename)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o755 if file.file_executable() else 0o644
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def close(self) -> None:
+        self.tar.close()
+
+
+class OutputDriver_Zip(OutputDriver):
+    """
+    An :class:`kubragen.output.OutputDriver` that streams the files to a zip archive.
+
+    :param fileobj: the binary output stream, which doesn't need to be seekable
+    :param prefix: the directory of the files inside the archive
+    """
+    def __init__(self, fileobj: BinaryIO, prefix: str = ''):
+        self.prefix = prefix
+        self.zip = zipfile.ZipFile(fileobj, mode='w', compression=zipfile.ZIP_DEFLATED)
+
+    def write_file(self, file: OutputFile, filename: str, filecontents: Any) -> None:
+        info = zipfile.ZipInfo(self.prefix + filename, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = (0o755 if file.file_executable() else 0o644) << 16
+        self.zip.writestr(info, filecontents.encode(file.file_encoding()))
+
+    def close(self) -> None:
+        self.zip.close()
+
+
+class OutputDriver_Changed(OutputDriver):
+    """
+    An :class:`kubragen.output.OutputDriver` that writes files to a directory only if their contents changed.
+
+    :param path: the output directory
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.filenames: List[str] = []
+        self.changed: List[str] = []
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def write_file(self, file: OutputFile, filename: str, filecontents: Any) -> None:
+        self.filenames.append(filename)
+        outfilename = os.path.join(self.path, filename)
+        try:
+            with open(outfilename, 'r', newline=file.file_newline(), encoding=file.file_encoding()) as fl:
+                if fl.read() == filecontents:
+                    return
+        except OSError:
+            pass
+        with open(outfilename, 'w', newline=file.file_newline(), encoding=file.file_encoding()) as fl:
+            fl.write(filecontents)
+        if file.file_executable():
+            st = os.stat(outfilename)
+            os.chmod(outfilename, st.st_mode | stat.S_IEXEC)
+        self.changed.append(filename)
+
+    def remove_stale(self) -> List[str]:
+        """
+        Removes the files of the directory that were not written, like the ones of a previous output with different
+        sequence numbers.
+
+        :return: the removed file names
+        """
+        ret = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and entry.name not in self.filenames:
+                os.remove(entry.path)
+                ret.append(entry.name)
+        return sorted(ret)
+
+
+def stream_driver(output_format: str, fileobj: Optional[BinaryIO] = None, prefix: str = '') -> OutputDriver:
+    """
+    Returns the streaming driver of an output format other than ```directory```.
+
+    :param output_format: one of :data:`OUTPUT_FORMATS`
+    :param fileobj: the binary output stream of the archive formats, stdout if None
+    :param prefix: the directory of the files inside the archives
+    """
+    if output_format in ['yaml', 'ndjson']:
+        return OutputDriver_Stdout(output_format=output_format)
+    if fileobj is None:
+        fileobj = sys.stdout.buffer
+    if output_format in ['tar', 'tgz']:
+        return OutputDriver_Tar(fileobj, prefix=prefix, compress=output_format == 'tgz')
+    if output_format == 'zip':
+        return OutputDriver_Zip(fileobj, prefix=prefix)
+    raise ValueError('Unknown output format "{}"'.format(output_format))
@@ -0,0 +1,275 @@
+"""
+Profiles and presets shared by the samples: the Traefik edge router, storage tiers, rollout, node pool placement and the
+k3d registry caches.
+"""
+from typing import Any, Dict, List, Mapping
+
+from kubragen.consts import PROVIDER_K3D, PROVIDER_GOOGLE, PROVIDER_DIGITALOCEAN, PROVIDER_AMAZON
+from kubragen.helper import QuotedStr
+
+
+#
+# Traefik profiles: replicas, resources, autoscaling and disruption budget of the edge router
+#
+TRAEFIK_PROFILES = {
+    'default': {
+        'image': 'traefik:v2.2',
+        'replicas': None,
+        'resources': None,
+        'autoscaling': None,
+        'disruption_budget': None,
+        'transport': None,
+        'entrypoint': None,
+    },
+    'throughput': {
+        # ServersTransport requires Traefik 2.4
+        'image': 'traefik:v2.4',
+        'replicas': 3,
+        'resources': {
+            'requests': {
+                'cpu': '500m',
+                'memory': '128Mi',
+            },
+            'limits': {
+                'cpu': '2',
+                'memory': '512Mi',
+            },
+        },
+        'autoscaling': {
+            'min_replicas': 3,
+            'max_replicas': 10,
+            'cpu_utilization': 70,
+        },
+        'disruption_budget': {
+            'max_unavailable': 1,
+        },
+        # ServersTransport spec
+        'transport': {
+            'maxIdleConnsPerHost': 200,
+            'forwardingTimeouts': {
+                'dialTimeout': '5s',
+                'responseHeaderTimeout': '30s',
+                'idleConnTimeout': '90s',
+            },
+        },
+        'entrypoint': {
+            'read_timeout': '30s',
+            'write_timeout': '30s',
+            'idle_timeout': '180s',
+            'accesslog_buffering_size': 100,
+        },
+    },
+}
+
+
+def guaranteed_resources(cpu: str, memory: str) -> Dict[str, Any]:
+    """
+    Kubernetes container resources with requests equal to limits, so the pod gets the *Guaranteed* QoS class.
+    """
+    return {
+        'requests': {
+            'cpu': cpu,
+            'memory': memory,
+        },
+        'limits': {
+            'cpu': cpu,
+            'memory': memory,
+        },
+    }
+
+
+#
+# Storage tiers: storage class used for the stack volume on each provider. The default tier uses a statically
+# provisioned PersistentVolume.
+#
+STORAGE_TIERS = {
+    'default': None,
+    'balanced': {
+        PROVIDER_AMAZON: {
+            'storageclass': 'gp3-balanced',
+            'provisioner': 'ebs.csi.aws.com',
+            'parameters': {
+                'type': 'gp3',
+                'fsType': 'ext4',
+            },
+        },
+        PROVIDER_GOOGLE: {
+            'storageclass': 'pd-balanced',
+            'provisioner': 'pd.csi.storage.gke.io',
+            'parameters': {
+                'type': 'pd-balanced',
+            },
+        },
+        PROVIDER_DIGITALOCEAN: {
+            # installed by default, DigitalOcean has a single block storage type
+            'storageclass': 'do-block-storage',
+        },
+        PROVIDER_K3D: {
+            # installed by default by k3s
+            'storageclass': 'local-path',
+        },
+    },
+    'fast': {
+        PROVIDER_AMAZON: {
+            'storageclass': 'gp3-fast',
+            'provisioner': 'ebs.csi.aws.com',
+            'parameters': {
+                'type': 'gp3',
+                'iops': QuotedStr('10000'),
+                'throughput': QuotedStr('500'),
+                'fsType': 'ext4',
+            },
+        },
+        PROVIDER_GOOGLE: {
+            'storageclass': 'pd-ssd',
+            'provisioner': 'pd.csi.storage.gke.io',
+            'parameters': {
+                'type': 'pd-ssd',
+            },
+        },
+        PROVIDER_DIGITALOCEAN: {
+            'storageclass': 'do-block-storage',
+        },
+        PROVIDER_K3D: {
+            # tmpfs volume for benchmarking, data is lost when the pod restarts
+            'memory': True,
+        },
+    },
+}
+
+
+#
+# k3d pull-through registry caches, shared by all samples and kept between runs
+#
+K3D_NETWORK = 'kgsample'
+K3D_REGISTRY_MIRRORS = {
+    'docker.io': {
+        'name': 'kgsample-mirror-docker-io',
+        'remote': 'https://registry-1.docker.io',
+    },
+    'quay.io': {
+        'name': 'kgsample-mirror-quay-io',
+        'remote': 'https://quay.io',
+    },
+    'docker.elastic.co': {
+        'name': 'kgsample-mirror-docker-elastic-co',
+        'remote': 'https://docker.elastic.co',
+    },
+    'k8s.gcr.io': {
+        'name': 'kgsample-mirror-k8s-gcr-io',
+        'remote': 'https://k8s.gcr.io',
+    },
+}
+
+
+#
+# Rollout profiles: how fast the stack pods are created and marked ready
+#
+ROLLOUT_PROFILES = {
+    'default': {
+        'parallel': False,
+        'startup': None,
+        'readiness': None,
+    },
+    'fast': {
+        # the startup probe allows up to 5 minutes for the first start, so the readiness probe can check often
+        # without an initial delay
+        'parallel': True,
+        'startup': {
+            'periodSeconds': 5,
+            'timeoutSeconds': 5,
+            'failureThreshold': 60,
+        },
+        'readiness': {
+            'initialDelaySeconds': 0,
+            'periodSeconds': 5,
+            'timeoutSeconds': 5,
+        },
+    },
+}
+
+
+def rollout_probe_patches(rollout_profile: Mapping[str, Any], http_get: Mapping[str, Any]) -> List[Dict[str, Any]]:
+    """
+    JSON patches setting the startup and readiness probes of the first container for a rollout profile.
+    """
+    return [
+        {'op': 'add', 'path': '/spec/template/spec/containers/0/startupProbe', 'value': {
+            'httpGet': http_get,
+            **rollout_profile['startup'],
+        }},
+        {'op': 'add', 'path': '/spec/template/spec/containers/0/readinessProbe', 'value': {
+            'httpGet': http_get,
+            **rollout_profile['readiness'],
+        }},
+    ]
+
+
+#
+# Placement profiles: the node pools the stack pods are scheduled on, and their priority.
+# The pools must exist with the node label of the provider, and be tainted with "dedicated=<pool>:NoSchedule".
+#
+NODE_POOL_LABELS = {
+    PROVIDER_K3D: 'kgsample/pool',
+    PROVIDER_GOOGLE: 'cloud.google.com/gke-nodepool',
+    PROVIDER_DIGITALOCEAN: 'doks.digitalocean.com/node-pool',
+    PROVIDER_AMAZON: 'eks.amazonaws.com/nodegroup',
+}
+
+# the private range the DigitalOcean VPC networks are allocated from, trusted to send the PROXY protocol header by
+# default, as the VPC of the cluster is not known when generating
+DIGITALOCEAN_VPC_CIDR = '10.0.0.0/8'
+
+PLACEMENT_PROFILES = {
+    'default': None,
+    # Traefik and the observability stack each on their own pool, the applications on the untainted nodes
+    'dedicated': {
+        'edge': {'pool': 'edge', 'priority_class': 'kgsample-edge', 'priority': 1000000},
+        'monitoring': {'pool': 'monitoring', 'priority_class': 'kgsample-monitoring', 'priority': 100000},
+    },
+    # only the observability stack on its own pool
+    'monitoring-pool': {
+        'edge': {'pool': None, 'priority_class': 'kgsample-edge', 'priority': 1000000},
+        'monitoring': {'pool': 'monitoring', 'priority_class': 'kgsample-monitoring', 'priority': 100000},
+    },
+}
+
+
+def placement_toleration(pool: str) -> Dict[str, Any]:
+    """
+    Toleration of the taint of a node pool.
+    """
+    return {'key': 'dedicated', 'operator': 'Equal', 'value': pool, 'effect': 'NoSchedule'}
+
+
+def placement_patches(placement: Mapping[str, Any], role: str, pool_label: str,
+                      daemonset: bool = False) -> List[Dict[str, Any]]:
+    """
+    JSON patches setting the priority class of a pod template and scheduling it on the node pool of a placement role.
+    DaemonSets tolerate all the pools instead, as they must run on every node.
+    """
+    spec = {'priorityClassName': placement[role]['priority_class']}
+    if daemonset:
+        pools = [item['pool'] for item in placement.values() if item['pool'] is not None]
+        if len(pools) > 0:
+            spec['tolerations'] = [placement_toleration(pool) for pool in pools]
+    elif placement[role]['pool'] is not None:
+        spec['nodeSelector'] = {pool_label: placement[role]['pool']}
+        spec['tolerations'] = [placement_toleration(placement[role]['pool'])]
+    return [{'op': 'merge', 'path': '/spec/template/spec', 'value': spec}]
+
+
+def priority_classes(placement: Mapping[str, Any]) -> List[Dict[str, Any]]:
+    """
+    PriorityClasses of a placement profile.
+    """
+    return [{
+        'apiVersion': 'scheduling.k8s.io/v1',
+        'kind': 'PriorityClass',
+        'metadata': {
+            'name': item['priority_class'],
+        },
+        'value': item['priority'],
+        'globalDefault': False,
+        'description': 'kgsample {} pods'.format(role),
+    } for role, item in placement.items()]
@@ -0,0 +1,270 @@
+"""
+Renders the samples in-process, and serves the rendered objects over HTTP.
+
+The server keeps KubraGen and the builders imported, and caches the rendered objects, so a repeated request does not
+pay the import and build cost of running ```generate.py```.
+
+Usage::
+
+    $ python -m kgsamples.render --port 8000
+    $ curl 'http://localhost:8000/render/prometheus/k3d?size=small&format=json'
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+from urllib.parse import urlparse, parse_qs
+
+import yaml
+
+from .apply import project_waves
+from .sample import OptionError
+
+STACKS = {
+    'prometheus': 'prometheus_stack',
+    'loki': 'loki_stack',
+    'efk': 'efk_stack',
+}
+
+# options that don't change the rendered objects
+IGNORED_OPTIONS = ['output_path', 'output_format', 'apply', 'kube_context', 'size_report', 'budget',
+                   'validate']
+
+_stack_modules: Dict[str, Any] = {}
+_stack_modules_lock = threading.Lock()
+
+# the samples change module-level state while building, so only one build runs at a time
+_build_lock = threading.Lock()
+
+
+class RenderError(Exception):
+    """Invalid render request."""
+    pass
+
+
+def stack_filename(stack: str) -> str:
+    """
+    Returns the path of the ```generate.py``` file of a sample.
+    """
+    return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, STACKS[stack],
+                                         'generate.py'))
+
+
+def load_stack(stack: str, reload: bool = False) -> Any:
+    """
+    Imports the ```generate.py``` module of a sample.
+
+    :param stack: the stack name, one of :data:`STACKS`
+    :param reload: whether to import the module again, even if already imported
+    :return: the module
+    """
+    if stack not in STACKS:
+        raise RenderError('Unknown stack "{}"'.format(stack))
+    with _stack_modules_lock:
+        if reload or stack not in _stack_modules:
+            spec = importlib.util.spec_from_file_location('kgsamples_{}'.format(STACKS[stack]),
+                                                          stack_filename(stack))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            _stack_modules[stack] = module
+        return _stack_modules[stack]
+
+
+def overrides_argv(overrides: Mapping[str, Any]) -> List[str]:
+    """
+    Converts option overrides to command line arguments of the sample.
+
+    The keys are the option names with or without the dashes (```size``` or ```es-topology```). True adds a flag,
+    False or None omits the option, and a list repeats it.
+    """
+    ret = []
+    for name, value in overrides.items():
+        option = '--{}'.format(name.replace('_', '-'))
+        for item in value if isinstance(value, (list, tuple)) else [value]:
+            if item is True:
+                ret.append(option)
+            elif item is not False and item is not None:
+                ret.extend([option, str(item)])
+    return ret
+
+
+def stack_args(stack: str, provider: str, overrides: Optional[Mapping[str, Any]] = None) -> argparse.Namespace:
+    """
+    Returns the parsed command line arguments of a sample.
+
+    :raises RenderError: on invalid options
+    """
+    parser = load_stack(stack).arg_parser()
+
+    def error(message):
+        raise RenderError(message)
+
+    def exit(status=0, message=None):
+        # like for --help, which has no meaning here
+        raise RenderError(message.strip() if message else 'Invalid options')
+    parser.error = error
+    parser.exit = exit
+
+    args = parser.parse_args(['-p', provider] + overrides_argv(overrides if overrides is not None else {}))
+    for name in IGNORED_OPTIONS:
+        setattr(args, name, parser.get_default(name))
+    return args
+
+
+def args_hash(args: argparse.Namespace) -> str:
+    """
+    Returns a hash of the parsed arguments, used as the cache key.
+    """
+    return hashlib.sha256(json.dumps(vars(args), sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def render(stack: str, provider: str, overrides: Optional[Mapping[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Renders a sample, returning its Kubernetes objects in apply order.
+
+    :param stack: the stack name, one of :data:`STACKS`
+    :param provider: the sample provider, like ```k3d```
+    :param overrides: the sample options, see :func:`overrides_argv`
+    :return: the list of objects
+    :raises RenderError: on invalid stack or options
+    """
+    return _render_args(stack, stack_args(stack, provider, overrides))
+
+
+def _render_args(stack: str, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    with _build_lock:
+        try:
+            kg, out = load_stack(stack).build(args)
+        except OptionError as e:
+            # the other errors of the builders, like a failed download, are not caused by the request
+            raise RenderError(str(e)) from e
+        return [obj for wave in project_waves(kg, out) for obj in wave]
+
+
+class RenderCache:
+    """
+    LRU cache of rendered samples, keyed by (stack, provider, options hash).
+
+    :param maxsize: the maximum number of cached renders
+    """
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._items: 'OrderedDict[Tuple[str, str, str], Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, stack: str, provider: str, overrides: Optional[Mapping[str, Any]] = None,
+            output_format: str = 'yaml') -> Tuple[str, bool]:
+        """
+        Returns a rendered sample serialized as YAML or JSON.
+
+        :return: a (text, cache hit) tuple
+        :raises RenderError: on invalid stack, options or format
+        """
+        if output_format not in ['yaml', 'json']:
+            raise RenderError('Unknown format "{}"'.format(output_format))
+        args = stack_args(stack, provider, overrides)
+        key = (stack, provider, args_hash(args))
+
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+        hit = entry is not None
+        if entry is None:
+            entry = {'objects': _render_args(stack, args)}
+            with self._lock:
+                self._items[key] = entry
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+
+        with self._lock:
+            text = entry.get(output_format)
+        if text is None:
+            if output_format == 'json':
+                text = json.dumps(entry['objects'])
+            else:
+                text = yaml.safe_dump_all(entry['objects'], sort_keys=False)
+            # serialized outside the lock, the first of concurrent requests wins
+            with self._lock:
+                text = entry.setdefault(output_format, text)
+        return text, hit
+
+
+def _request_overrides(query: Mapping[str, Sequence[str]]) -> Dict[str, Any]:
+    ret = {}
+    for name, values in query.items():
+        values = [{'true': True, 'false': False}.get(value, value) for value in values]
+        ret[name] = values if len(values) > 1 else values[0]
+    return ret
+
+
+def render_handler(cache: RenderCache):
+    """
+    Returns a request handler class that serves ```GET /render/<stack>/<provider>?<options>```.
+
+    The ```format``` query parameter selects ```yaml``` (the default) or ```json```, the other parameters are the
+    sample options.
+    """
+    class RenderHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = url.path.strip('/').split('/')
+            if len(parts) != 3 or parts[0] != 'render':
+                self._send(404, 'text/plain', 'Not found\n')
+                return
+            overrides = _request_overrides(parse_qs(url.query, keep_blank_values=True))
+            output_format = overrides.pop('format', 'yaml')
+            try:
+                text, hit = cache.get(parts[1], parts[2], overrides, output_format=output_format)
+            except RenderError as e:
+                self._send(400, 'text/plain', '{}\n'.format(e))
+                return
+            except SystemExit as e:
+                # the option errors are raised as RenderError, so this is an exit of the build itself
+                self._send(500, 'text/plain', 'Error rendering: exited with status {}\n'.format(e.code))
+                return
+            except Exception as e:
+                # a failing build, like a failed dashboard download
+                self._send(500, 'text/plain', 'Error rendering: {}\n'.format(e if str(e) else type(e).__name__))
+                return
+            self._send(200, 'application/json' if output_format == 'json' else 'application/yaml', text,
+                       {'X-Render-Cache': 'hit' if hit else 'miss'})
+
+        def _send(self, status: int, content_type: str, text: str, headers: Optional[Mapping[str, str]] = None):
+            body = text.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers if headers is not None else {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+    return RenderHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sample render server')
+    parser.add_argument('--host', help='listen address', default='127.0.0.1')
+    parser.add_argument('--port', help='listen port', type=int, default=8000)
+    parser.add_argument('--cache-size', help='maximum number of cached renders', type=int, default=64)
+    args = parser.parse_args()
+
+    for stack in STACKS:
+        load_stack(stack)
+
+    server = ThreadingHTTPServer((args.host, args.port), render_handler(RenderCache(maxsize=args.cache_size)))
+    print('Serving on http://{}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
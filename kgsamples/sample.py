@@ -0,0 +1,623 @@
+"""
+The parts of the samples that don't depend on the stack: the command line, the provider and cluster setup, the
+namespace, the image pre-pull, the echo application, the ingress, and the main function that validates, saves and
+applies the output.
+
+Each sample ```generate.py``` adds its own command line options and builds its stack.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+from typing import Any, Callable, Mapping, Optional, Tuple
+
+from kg_traefik2 import Traefik2Builder
+from kgpr_core.amazon.eks.kresource import KRPersistentVolumeProfile_AWSElasticBlockStore
+from kgpr_core.amazon.eks.provider import ProviderAmazonEKS
+from kgpr_core.digitalocean.kubernetes.kresource import KRPersistentVolumeProfile_CSI_DOBS
+from kgpr_core.digitalocean.kubernetes.provider import ProviderDigitalOceanKubernetes
+from kgpr_core.google.gke.kresource import KRPersistentVolumeProfile_GCEPersistentDisk
+from kgpr_core.google.gke.provider import ProviderGoogleGKE
+from kgpr_core.k3d.generic.provider import ProviderK3DGeneric
+from kubragen import KubraGen
+from kubragen.consts import PROVIDER_K3D, PROVIDER_GOOGLE, PROVIDER_DIGITALOCEAN, PROVIDER_AMAZON
+from kubragen.data import ValueData
+from kubragen.exception import InvalidParamError
+from kubragen.helper import QuotedStr
+from kubragen.jsonpatch import FilterJSONPatches_Apply, FilterJSONPatch
+from kubragen.kresource import KRPersistentVolumeProfile_HostPath, KRPersistentVolumeClaimProfile_Basic, \
+    KRStorageClass_Default
+from kubragen.object import Object
+from kubragen.output import OutputProject, OutputFile, OutputFile_ShellScript, OutputFile_Kubernetes, \
+    OutputFile_Yaml, OD_FileTemplate, OutputDriver_Directory
+from kubragen.provider import Provider
+
+from .budget import BudgetError, budgets, size_report, budget_violations
+from .images import container_images, image_prepull_daemonset
+from .output import OUTPUT_FORMATS, ARCHIVE_EXTENSIONS, stream_driver
+from .profiles import TRAEFIK_PROFILES, STORAGE_TIERS, ROLLOUT_PROFILES, PLACEMENT_PROFILES, NODE_POOL_LABELS, \
+    K3D_NETWORK, K3D_REGISTRY_MIRRORS, DIGITALOCEAN_VPC_CIDR, priority_classes
+
+PROVIDERS = [
+    'google-gke',
+    'amazon-eks',
+    'digitalocean-kubernetes',
+    'k3d',
+]
+
+
+class OptionError(InvalidParamError):
+    """
+    Invalid combination of sample options, reported as a command line error. The builders raise
+    :class:`kubragen.exception.InvalidParamError` for other errors, like a failed download.
+    """
+    pass
+
+
+def arg_parser(size_presets: Mapping[str, Any], load_profiles: Mapping[str, Any]) -> argparse.ArgumentParser:
+    """
+    Returns the command line parser with the options shared by the samples, the samples add their own.
+
+    :param size_presets: the cluster size presets of the sample
+    :param load_profiles: the load generator profiles of the sample
+    """
+    parser = argparse.ArgumentParser(description='Kube Creator')
+    parser.add_argument('-p', '--provider', help='provider', required=True, choices=PROVIDERS)
+    parser.add_argument('-o', '--output-path', help='output path', default='output')
+    parser.add_argument('--output-format', help='output format, the archives are written to stdout if the output '
+                        'path is "-"', default='directory', choices=OUTPUT_FORMATS)
+    parser.add_argument('--traefik-profile', help='traefik profile', default='default',
+                        choices=list(TRAEFIK_PROFILES))
+    parser.add_argument('--loadbalancer', help='load balancer mode', default='default',
+                        choices=['default', 'direct'])
+    parser.add_argument('--vpc-cidr', help='CIDR of the cluster VPC, the only addresses trusted to send the client '
+                        'address with the PROXY protocol in the "direct" load balancer mode on digitalocean-kubernetes',
+                        default=DIGITALOCEAN_VPC_CIDR)
+    parser.add_argument('--size', help='cluster size', default='default', choices=list(size_presets))
+    parser.add_argument('--storage-tier', help='storage tier', default='default',
+                        choices=list(STORAGE_TIERS))
+    parser.add_argument('--storage-disk', help='ID of the pre-created disk of a volume of the default storage tier on '
+                        'the cloud providers, as volume=id, like prometheus=vol-0123', action='append', default=[])
+    parser.add_argument('--rollout', help='rollout profile', default='default',
+                        choices=list(ROLLOUT_PROFILES))
+    parser.add_argument('--placement', help='node pool placement profile', default='default',
+                        choices=list(PLACEMENT_PROFILES))
+    parser.add_argument('--prepull', help='pre-pull container images', action='store_true')
+    parser.add_argument('--k3d-create', help='create the k3d cluster with registry caches', action='store_true')
+    parser.add_argument('--apply', help='apply the generated objects to the cluster', action='store_true')
+    parser.add_argument('--kube-context', help='kubeconfig context used by --apply')
+    parser.add_argument('--no-cache', help='do not use the persistent build cache', action='store_true')
+    parser.add_argument('--size-report', help='write the object size report to this JSON file')
+    parser.add_argument('--budget', help='size budget as name=size, like object_bytes=512Ki', action='append')
+    parser.add_argument('--validate', help='validate the objects against the Kubernetes schemas', action='store_true')
+    parser.add_argument('--load', help='load generator profile', default='default', choices=list(load_profiles))
+    return parser
+
+
+def kubragen_provider(provider: str) -> Provider:
+    """
+    Returns the KubraGen provider of a command line provider name.
+    """
+    if provider == 'k3d':
+        return ProviderK3DGeneric()
+    elif provider == 'google-gke':
+        return ProviderGoogleGKE()
+    elif provider == 'digitalocean-kubernetes':
+        return ProviderDigitalOceanKubernetes()
+    elif provider == 'amazon-eks':
+        return ProviderAmazonEKS()
+    else:
+        raise Exception('Unknown target')
+
+
+def storage_profiles(kg: KubraGen) -> None:
+    """
+    Adds the default PersistentVolume and PersistentVolumeClaim profiles of the provider.
+    """
+    kgprovider = kg.provider
+    if kgprovider.provider == PROVIDER_K3D:
+        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_HostPath())
+    elif kgprovider.provider == PROVIDER_GOOGLE:
+        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_GCEPersistentDisk())
+    elif kgprovider.provider == PROVIDER_DIGITALOCEAN:
+        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_CSI_DOBS())
+    elif kgprovider.provider == PROVIDER_AMAZON:
+        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_AWSElasticBlockStore())
+
+    if kgprovider.provider == PROVIDER_K3D:
+        kg.resources().persistentvolumeclaimprofile_add('default', KRPersistentVolumeClaimProfile_Basic(allow_selector=False))
+    else:
+        kg.resources().persistentvolumeclaimprofile_add('default', KRPersistentVolumeClaimProfile_Basic())
+
+
+def storage_class_add(kg: KubraGen, storage_tier: Mapping[str, Any]) -> None:
+    """
+    Adds the StorageClass of a storage tier of the provider, if it is not installed by default.
+    """
+    if storage_tier.get('provisioner') is not None:
+        kg.resources().storageclass_add(storage_tier['storageclass'], KRStorageClass_Default(), merge_config={
+            'provisioner': storage_tier['provisioner'],
+            'parameters': storage_tier['parameters'],
+            'reclaimPolicy': 'Retain',
+            'volumeBindingMode': 'WaitForFirstConsumer',
+            'allowVolumeExpansion': True,
+        })
+
+
+def storage_disk(args: argparse.Namespace, name: str) -> Optional[str]:
+    """
+    Returns the ID of the pre-created disk of a stack volume, from the ```--storage-disk``` options, or None.
+
+    :param name: the volume name, like ```prometheus```
+    :raises OptionError: on invalid option
+    """
+    for value in args.storage_disk:
+        volume, sep, disk = value.partition('=')
+        if sep == '' or volume == '' or disk == '':
+            raise OptionError('Invalid storage disk "{}", expected volume=id'.format(value))
+        if volume == name:
+            return disk
+    return None
+
+
+def storage_claim_add(kg: KubraGen, name: str, storage_tier: Optional[Mapping[str, Any]], storage: str,
+                      disk: Optional[str] = None) -> None:
+    """
+    Adds the ```<name>-storage-claim``` PersistentVolumeClaim of the stack volume in the ```monitoring``` namespace.
+
+    On the default tier, k3d binds it to a hostPath PersistentVolume labeled with ```pv.role: <name>```, and the cloud
+    providers to a PersistentVolume of the pre-created disk if its ID is given, or else to a volume provisioned by the
+    default StorageClass of the cluster. The other tiers use the StorageClass of the tier, and the memory tiers don't
+    use a claim.
+
+    :param name: the volume name, like ```prometheus```
+    :param storage_tier: the storage tier of the provider, None for the default tier
+    :param storage: the volume size
+    :param disk: the ID of the pre-created disk on the cloud providers, see :func:`storage_disk`
+    :raises OptionError: if a disk is given for a tier other than the default
+    """
+    if disk is not None and storage_tier is not None:
+        raise OptionError('The disk of the "{}" volume can only be used with the default storage tier'.format(name))
+
+    if storage_tier is None and disk is None and kg.provider.provider != PROVIDER_K3D:
+        kg.resources().persistentvolumeclaim_add('{}-storage-claim'.format(name), 'default', {
+            'namespace': 'monitoring',
+        }, {
+            'spec': {
+                'accessModes': ['ReadWriteOnce'],
+                'resources': {
+                    'requests': {
+                        'storage': storage,
+                    },
+                },
+            },
+        })
+    elif storage_tier is None:
+        kg.resources().persistentvolume_add('{}-storage'.format(name), 'default', {
+            'hostPath': {
+                'path': '/var/storage/{}'.format(name)
+            },
+            'csi': {
+                'volumeHandle': disk,
+                'fsType': 'ext4',
+            },
+        }, {
+            'metadata': {
+                'labels': {
+                    'pv.role': name,
+                },
+            },
+            'spec': {
+                'persistentVolumeReclaimPolicy': 'Retain',
+                'capacity': {
+                    'storage': storage,
+                },
+                'accessModes': ['ReadWriteOnce'],
+            },
+        })
+
+        kg.resources().persistentvolumeclaim_add('{}-storage-claim'.format(name), 'default', {
+            'namespace': 'monitoring',
+            'persistentVolume': '{}-storage'.format(name),
+        }, {
+            'spec': {
+                'selector': {
+                    'matchLabels': {
+                        'pv.role': name,
+                    }
+                },
+            }
+        })
+    elif not storage_tier.get('memory'):
+        kg.resources().persistentvolumeclaim_add('{}-storage-claim'.format(name), 'default', {
+            'namespace': 'monitoring',
+        }, {
+            'spec': {
+                'storageClassName': storage_tier['storageclass'],
+                'accessModes': ['ReadWriteOnce'],
+                'resources': {
+                    'requests': {
+                        'storage': storage,
+                    },
+                },
+            },
+        })
+
+
+def storage_volume(name: str, storage_tier: Optional[Mapping[str, Any]], storage: str) -> Mapping[str, Any]:
+    """
+    Returns the pod volume source of the stack volume added by :func:`storage_claim_add`.
+    """
+    if storage_tier is None or not storage_tier.get('memory'):
+        return {
+            'persistentVolumeClaim': {
+                'claimName': '{}-storage-claim'.format(name)
+            }
+        }
+    return {
+        'emptyDir': {
+            'medium': 'Memory',
+            'sizeLimit': storage,
+        }
+    }
+
+
+def storage_file(kg: KubraGen, out: OutputProject, shell_script: OutputFile_ShellScript) -> None:
+    """
+    Adds ```storage.yaml```, with the StorageClasses, PersistentVolumes and PersistentVolumeClaims added to the
+    KubraGen resources, if there are any.
+    """
+    storage_objects = [kg.storageclass_build(), kg.persistentvolume_build(), kg.persistentvolumeclaim_build()]
+    if any(storage_objects):
+        file = OutputFile_Kubernetes('storage.yaml')
+        for objects in storage_objects:
+            if objects:
+                file.append(objects)
+
+        out.append(file)
+        shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+
+
+def cluster_setup(kg: KubraGen, out: OutputProject, shell_script: OutputFile_ShellScript, args: argparse.Namespace,
+                  cluster_name: str, placement: Optional[Mapping[str, Any]]) -> None:
+    """
+    Adds the provider setup to the shell script: the k3d cluster creation, and the node pools expected by the
+    placement profile.
+
+    :param cluster_name: the k3d cluster name
+    :param placement: the placement profile, None for the default placement
+    """
+    kgprovider = kg.provider
+    if kgprovider.provider == PROVIDER_K3D:
+        storage_directory = os.path.join(os.getcwd(), 'output', 'storage')
+        if not os.path.exists(storage_directory):
+            os.makedirs(storage_directory)
+        k3d_cluster_create = f'k3d cluster create {cluster_name} --port 5051:80@loadbalancer --port 5052:443@loadbalancer -v {storage_directory}:/var/storage'
+        if args.k3d_create:
+            registries_file = OutputFile_Yaml('registries.yaml', is_sequence=False)
+            registries_file.append({
+                'mirrors': {
+                    registry: {
+                        'endpoint': ['http://{}:5000'.format(mirror['name'])],
+                    } for registry, mirror in K3D_REGISTRY_MIRRORS.items()
+                },
+            })
+            out.append(registries_file)
+
+            shell_script.append(f'docker network inspect {K3D_NETWORK} >/dev/null 2>&1 || docker network create {K3D_NETWORK}')
+            for mirror in K3D_REGISTRY_MIRRORS.values():
+                shell_script.append(f'docker container inspect {mirror["name"]} >/dev/null 2>&1 || '
+                                    f'docker run -d --name {mirror["name"]} --network {K3D_NETWORK} --restart always '
+                                    f'-v {mirror["name"]}:/var/lib/registry -e REGISTRY_PROXY_REMOTEURL={mirror["remote"]} '
+                                    f'registry:2')
+            shell_script.append(OD_FileTemplate(f'k3d cluster list {cluster_name} >/dev/null 2>&1 || '
+                                                f'{k3d_cluster_create} --network {K3D_NETWORK} '
+                                                f'--registry-config ${{FILE_{registries_file.fileid}}}'))
+            shell_script.append(f'kubectl config use-context k3d-{cluster_name}')
+            shell_script.append('kubectl wait --for=condition=Ready nodes --all --timeout=300s')
+        else:
+            shell_script.append(f'# {k3d_cluster_create}')
+
+    if placement is not None:
+        for item in placement.values():
+            if item['pool'] is not None:
+                shell_script.append(f'# node pool "{item["pool"]}": label {NODE_POOL_LABELS[kgprovider.provider]}='
+                                    f'{item["pool"]}, taint dedicated={item["pool"]}:NoSchedule')
+
+
+def namespace_file(out: OutputProject, shell_script: OutputFile_ShellScript,
+                   placement: Optional[Mapping[str, Any]]) -> None:
+    """
+    Adds ```namespace.yaml```, with the stack namespace and the PriorityClasses of the placement profile.
+    """
+    file = OutputFile_Kubernetes('namespace.yaml')
+    file.append([{
+        'apiVersion': 'v1',
+        'kind': 'Namespace',
+        'metadata': {
+            'name': 'monitoring',
+        },
+    }])
+    if placement is not None:
+        file.append(priority_classes(placement))
+    out.append(file)
+    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+
+
+def image_prepull_files(kg: KubraGen, out: OutputProject, shell_script: OutputFile_ShellScript,
+                        cluster_name: str) -> Tuple[OutputFile, Optional[OutputFile_Kubernetes]]:
+    """
+    Adds ```images.txt``` and, except on k3d, where the images are imported in the cluster by the shell script,
+    ```prepull.yaml```. Both are filled by :func:`image_prepull_fill` after all other files are added.
+
+    :param cluster_name: the k3d cluster name
+    :return: a (images file, pre-pull file) tuple, the pre-pull file is None on k3d
+    """
+    images_file = OutputFile('images.txt', is_sequence=False)
+    out.append(images_file)
+    prepull_file = None
+    if kg.provider.provider == PROVIDER_K3D:
+        shell_script.append(OD_FileTemplate(f'xargs -n 1 docker pull < ${{FILE_{images_file.fileid}}}'))
+        shell_script.append(OD_FileTemplate(f'k3d image import -c {cluster_name} $$(cat ${{FILE_{images_file.fileid}}})'))
+    else:
+        prepull_file = OutputFile_Kubernetes('prepull.yaml')
+        out.append(prepull_file)
+        shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{prepull_file.fileid}}}'))
+    return images_file, prepull_file
+
+
+def image_prepull_fill(out: OutputProject, images_file: OutputFile,
+                       prepull_file: Optional[OutputFile_Kubernetes]) -> None:
+    """
+    Fills the files added by :func:`image_prepull_files` with the images used by the output project.
+    """
+    images = container_images(out)
+    images_file.append('\n'.join(images + ['']))
+    if prepull_file is not None:
+        prepull_file.append([image_prepull_daemonset(images)])
+
+
+def http_echo_file(kg: KubraGen, out: OutputProject, shell_script: OutputFile_ShellScript,
+                   size_preset: Mapping[str, Any], traefik_transport_name: Optional[str]) -> None:
+    """
+    Adds ```http-echo.yaml```, with the echo application routed by Traefik.
+
+    :param size_preset: the sample size preset, with the ```echo``` replicas and resources
+    :param traefik_transport_name: the Traefik ServersTransport name, or None
+    """
+    file = OutputFile_Kubernetes('http-echo.yaml')
+    out.append(file)
+
+    file.append([{
+        'apiVersion': 'apps/v1',
+        'kind': 'Deployment',
+        'metadata': {
+            'name': 'echo-deployment',
+            'namespace': kg.option_get('namespaces.default'),
+            'labels': {
+                'app': 'echo'
+            }
+        },
+        'spec': {
+            'replicas': size_preset['echo']['replicas'],
+            'selector': {
+                'matchLabels': {
+                    'app': 'echo'
+                }
+            },
+            'template': {
+                'metadata': {
+                    'labels': {
+                        'app': 'echo'
+                    }
+                },
+                'spec': {
+                    'containers': [{
+                        'name': 'echo',
+                        'image': 'mendhak/http-https-echo',
+                        'ports': [{
+                            'containerPort': 80
+                        },
+                        {
+                            'containerPort': 443
+                        }],
+                        'resources': ValueData(value=size_preset['echo']['resources'], disabled_if_none=True),
+                    }]
+                }
+            }
+        }
+    },
+    {
+        'apiVersion': 'v1',
+        'kind': 'Service',
+        'metadata': {
+            'name': 'echo-service',
+            'namespace': kg.option_get('namespaces.default'),
+        },
+        'spec': {
+            'selector': {
+                'app': 'echo'
+            },
+            'ports': [{
+                'name': 'http',
+                'port': 80,
+                'targetPort': 80,
+                'protocol': 'TCP'
+            }]
+        }
+    }, {
+        'apiVersion': 'traefik.containo.us/v1alpha1',
+        'kind': 'IngressRoute',
+        'metadata': {
+            'name': 'http-echo',
+            'namespace': kg.option_get('namespaces.default'),
+        },
+        'spec': {
+            'entryPoints': ['web'],
+            'routes': [{
+                # 'match': f'Host(`http-echo.localdomain`)',
+                'match': f'PathPrefix(`/`)',
+                'kind': 'Rule',
+                'services': [{
+                    'name': 'echo-service',
+                    'port': 80,
+                    'serversTransport': ValueData(value=traefik_transport_name, disabled_if_none=True),
+                }],
+            }]
+        }
+    }])
+
+    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+
+
+def ingress_file(kg: KubraGen, out: OutputProject, shell_script: OutputFile_ShellScript, args: argparse.Namespace,
+                 traefik2_config: Traefik2Builder) -> None:
+    """
+    Adds ```ingress.yaml```, with the Ingress of the provider load balancer that sends the requests to Traefik.
+
+    :param args: the sample command line arguments, for the load balancer mode
+    """
+    kgprovider = kg.provider
+    file = OutputFile_Kubernetes('ingress.yaml')
+    http_path = '/'
+    if kgprovider.provider == PROVIDER_GOOGLE or kgprovider.provider == PROVIDER_AMAZON:
+        http_path = '/*'
+
+    file_data = [
+        Object({
+            'apiVersion': 'extensions/v1beta1',
+            'kind': 'Ingress',
+            'metadata': {
+                'name': 'ingress',
+                'namespace': kg.option_get('namespaces.default'),
+            },
+            'spec': {
+                'rules': [{
+                    'http': {
+                        'paths': [{
+                            'path': http_path,
+                            'backend': {
+                                'serviceName': traefik2_config.object_name('service'),
+                                'servicePort': 80,
+                            }
+                        }]
+                    }
+                }]
+            }
+        }, name='ingress', source='app', instance='ingress')
+    ]
+
+    if kgprovider.provider == PROVIDER_AMAZON:
+        FilterJSONPatches_Apply(file_data, jsonpatches=[
+            FilterJSONPatch(filters={'names': ['ingress']}, patches=[
+                {'op': 'merge', 'path': '/metadata', 'value': {'annotations': {
+                    'kubernetes.io/ingress.class': 'alb',
+                    'alb.ingress.kubernetes.io/scheme': 'internet-facing',
+                    'alb.ingress.kubernetes.io/listen-ports': QuotedStr('[{"HTTP": 80}]'),
+                }}}
+            ])
+        ])
+        if args.loadbalancer == 'direct':
+            # the ALB sends requests directly to the pods
+            FilterJSONPatches_Apply(file_data, jsonpatches=[
+                FilterJSONPatch(filters={'names': ['ingress']}, patches=[
+                    {'op': 'merge', 'path': '/metadata', 'value': {'annotations': {
+                        'alb.ingress.kubernetes.io/target-type': 'ip',
+                    }}}
+                ])
+            ])
+
+    file.append(file_data)
+    out.append(file)
+    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+
+
+def main(parser: argparse.ArgumentParser,
+         build: Callable[[argparse.Namespace], Tuple[KubraGen, OutputProject]]) -> None:
+    """
+    Runs a sample: parses the command line, builds the sample, and validates, checks the size budgets, saves and
+    applies the output as requested by the command line options.
+
+    :param parser: the sample command line parser, see :func:`arg_parser`
+    :param build: the sample build function, returning a (KubraGen, OutputProject) tuple
+    """
+    args = parser.parse_args()
+
+    try:
+        size_budgets = budgets(args.budget)
+    except BudgetError as e:
+        parser.error(str(e))
+
+    try:
+        kg, out = build(args)
+    except OptionError as e:
+        parser.error(str(e))
+    except InvalidParamError as e:
+        # raised by the builders, like when a dashboard download fails
+        print('Error building the sample: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+
+    if args.validate:
+        # only required when validating
+        from .validate import validate_project
+
+        errors = validate_project(kg, out)
+        if len(errors) > 0:
+            for error in errors:
+                print('Invalid object: {}'.format(error), file=sys.stderr)
+            sys.exit(1)
+
+    #
+    # SIZE BUDGETS
+    #
+    report = size_report(kg, out)
+    if args.size_report is not None:
+        with open(args.size_report, 'w') as f:
+            json.dump(report, f, indent=2)
+    violations = budget_violations(report, size_budgets)
+    if len(violations) > 0:
+        for violation in violations:
+            print('Size budget exceeded: {}'.format(violation), file=sys.stderr)
+        sys.exit(1)
+
+    #
+    # OUTPUT
+    #
+    output_name = '{}-{}'.format(args.provider, datetime.datetime.today().strftime("%Y%m%d-%H%M%S"))
+    # keep stdout clean when streaming to it
+    messages = sys.stdout
+    if args.output_format == 'directory':
+        output_path = os.path.join(args.output_path, output_name)
+        print('Saving files to {}'.format(output_path))
+        if not os.path.exists(output_path):
+            os.makedirs(output_path)
+
+        out.output(OutputDriver_Directory(output_path))
+    else:
+        fileobj = None
+        if args.output_format in ARCHIVE_EXTENSIONS and args.output_path != '-':
+            if not os.path.exists(args.output_path):
+                os.makedirs(args.output_path)
+            output_path = os.path.join(args.output_path, '{}.{}'.format(
+                output_name, ARCHIVE_EXTENSIONS[args.output_format]))
+            print('Saving files to {}'.format(output_path))
+            fileobj = open(output_path, 'wb')
+        else:
+            messages = sys.stderr
+
+        driver = stream_driver(args.output_format, fileobj=fileobj, prefix='{}/'.format(output_name))
+        out.output(driver)
+        driver.close()
+        if fileobj is not None:
+            fileobj.close()
+
+    if args.apply:
+        # only required when applying, needs the kubernetes package
+        from .apply import KubernetesApplier, project_waves, APPLY_UNCHANGED
+
+        print('Applying to {}'.format(args.kube_context if args.kube_context is not None else 'current context'),
+              file=messages)
+        results = KubernetesApplier(context=args.kube_context).apply(project_waves(kg, out))
+        unchanged = len([status for obj, status in results if status == APPLY_UNCHANGED])
+        print('Applied {} objects, {} unchanged'.format(len(results) - unchanged, unchanged), file=messages)
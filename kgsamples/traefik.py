@@ -0,0 +1,377 @@
+"""
+The Traefik 2 edge router shared by the samples.
+"""
+import argparse
+import ipaddress
+from typing import Any, Mapping, Optional, Tuple
+
+from kg_traefik2 import Traefik2Builder, Traefik2Options, Traefik2OptionsPort
+from kubragen import KubraGen
+from kubragen.consts import PROVIDER_K3D, PROVIDER_GOOGLE, PROVIDER_DIGITALOCEAN, PROVIDER_AMAZON
+from kubragen.data import ValueData
+from kubragen.helper import QuotedStr
+from kubragen.jsonpatch import FilterJSONPatch
+from kubragen.option import OptionRoot
+from kubragen.output import OutputProject, OutputFile_ShellScript, OutputFile_Kubernetes, OD_FileTemplate
+
+from .cache import BuildCache, cached_build
+from .profiles import TRAEFIK_PROFILES, NODE_POOL_LABELS, placement_patches
+from .sample import OptionError
+
+
+#
+# CustomResourceDefinition of the Traefik 2.4 ServersTransport, which the Traefik2Builder CRDs don't include
+#
+SERVERSTRANSPORT_CRD = {
+    'apiVersion': 'apiextensions.k8s.io/v1',
+    'kind': 'CustomResourceDefinition',
+    'metadata': {
+        'name': 'serverstransports.traefik.containo.us',
+    },
+    'spec': {
+        'group': 'traefik.containo.us',
+        'names': {
+            'kind': 'ServersTransport',
+            'listKind': 'ServersTransportList',
+            'plural': 'serverstransports',
+            'singular': 'serverstransport',
+        },
+        'scope': 'Namespaced',
+        'versions': [{
+            'name': 'v1alpha1',
+            'served': True,
+            'storage': True,
+            'schema': {
+                # the spec is validated by Traefik
+                'openAPIV3Schema': {
+                    'type': 'object',
+                    'properties': {
+                        'spec': {
+                            'type': 'object',
+                            'x-kubernetes-preserve-unknown-fields': True,
+                        },
+                    },
+                },
+            },
+        }],
+    },
+}
+
+
+def traefik_files(kg: KubraGen, out: OutputProject, shell_script: OutputFile_ShellScript, args: argparse.Namespace,
+                  size_preset: Mapping[str, Any], placement: Optional[Mapping[str, Any]],
+                  build_cache: Optional[BuildCache]) -> Tuple[Traefik2Builder, Optional[str]]:
+    """
+    Adds the Traefik files to the output project, ```traefik-config-crd.yaml```, ```traefik-config.yaml``` and
+    ```traefik.yaml```, applied by the shell script. Traefik watches the ```default``` and ```monitoring```
+    namespaces, and exposes its Prometheus metrics entrypoint, scraped through the prometheus.io annotations.
+
+    :param args: the sample command line arguments, for the Traefik profile and the load balancer mode
+    :param size_preset: the sample size preset, with the ```traefik``` resources
+    :param placement: the placement profile, None for the default placement
+    :param build_cache: the persistent build cache, None if disabled
+    :return: a (builder, ServersTransport name) tuple, the ServersTransport name is None if the Traefik profile
+        doesn't have one
+    """
+    kgprovider = kg.provider
+    if args.loadbalancer == 'direct' and kgprovider.provider == PROVIDER_K3D:
+        raise OptionError('The "direct" load balancer mode is not supported on k3d')
+    traefik_profile = TRAEFIK_PROFILES[args.traefik_profile]
+
+    traefik_args = [
+        '--api.dashboard=true',
+        '--api.insecure=false',
+        '--entrypoints.web.Address=:80',
+        '--entrypoints.api.Address=:8080',
+        '--entryPoints.metrics.address=:9090',
+        '--metrics.prometheus=true',
+        '--metrics.prometheus.entryPoint=metrics',
+        '--metrics.prometheus.addEntryPointsLabels=true',
+        '--providers.kubernetescrd',
+        f'--providers.kubernetescrd.namespaces=default,monitoring',
+    ]
+    if traefik_profile['entrypoint'] is not None:
+        traefik_args.extend([
+            '--entrypoints.web.transport.respondingTimeouts.readTimeout={}'.format(
+                traefik_profile['entrypoint']['read_timeout']),
+            '--entrypoints.web.transport.respondingTimeouts.writeTimeout={}'.format(
+                traefik_profile['entrypoint']['write_timeout']),
+            '--entrypoints.web.transport.respondingTimeouts.idleTimeout={}'.format(
+                traefik_profile['entrypoint']['idle_timeout']),
+            '--accesslog=true',
+            '--accesslog.bufferingsize={}'.format(traefik_profile['entrypoint']['accesslog_buffering_size']),
+        ])
+    if args.loadbalancer == 'direct' and kgprovider.provider == PROVIDER_DIGITALOCEAN:
+        # the DigitalOcean load balancer sends the client address using the PROXY protocol, from inside the VPC
+        try:
+            vpc_cidr = ipaddress.ip_network(args.vpc_cidr)
+        except ValueError as e:
+            raise OptionError('Invalid VPC CIDR "{}": {}'.format(args.vpc_cidr, e)) from e
+        traefik_args.append('--entrypoints.web.proxyProtocol.trustedIPs={}'.format(vpc_cidr))
+
+    traefik2_config = Traefik2Builder(kubragen=kg, options=Traefik2Options({
+            'namespace': OptionRoot('namespaces.default'),
+            'config': {
+                'traefik_args': traefik_args,
+                'ports': [
+                    Traefik2OptionsPort(name='web', port_container=80, port_service=80),
+                    Traefik2OptionsPort(name='api', port_container=8080, port_service=8080),
+                    Traefik2OptionsPort(name='metrics', port_container=9090, in_service=False),
+                ],
+                'create_traefik_crd': True,
+                'prometheus_port': 9090,
+                'prometheus_annotation': True,
+            },
+            'container': {
+                'traefik2': traefik_profile['image'],
+            },
+            'kubernetes': {
+                'resources': {
+                    # the size preset takes precedence over the Traefik profile
+                    'deployment': size_preset['traefik']['resources'] if size_preset['traefik']['resources'] is not None
+                    else traefik_profile['resources'],
+                },
+            },
+        })
+    )
+
+    traefik2_jsonpatches = []
+    if traefik_profile['replicas'] is not None or traefik_profile['autoscaling'] is not None:
+        # spread the replicas across nodes and zones. With autoscaling the replica count is owned by the
+        # HorizontalPodAutoscaler, setting it in the Deployment would scale it back on every apply.
+        traefik2_jsonpatches.append(FilterJSONPatch(filters={'names': [traefik2_config.BUILDITEM_DEPLOYMENT]}, patches=[
+            {'op': 'merge', 'path': '/spec', 'value': {
+                'replicas': ValueData(value=traefik_profile['replicas'] if traefik_profile['autoscaling'] is None
+                                      else None, disabled_if_none=True),
+                'template': {
+                    'spec': {
+                        'affinity': {
+                            'podAntiAffinity': {
+                                'preferredDuringSchedulingIgnoredDuringExecution': [{
+                                    'weight': 100,
+                                    'podAffinityTerm': {
+                                        'labelSelector': {
+                                            'matchLabels': {
+                                                'app': traefik2_config.object_name('pod-label-app'),
+                                            },
+                                        },
+                                        'topologyKey': 'kubernetes.io/hostname',
+                                    },
+                                }],
+                            },
+                        },
+                        'topologySpreadConstraints': [{
+                            'maxSkew': 1,
+                            'topologyKey': 'topology.kubernetes.io/zone',
+                            'whenUnsatisfiable': 'ScheduleAnyway',
+                            'labelSelector': {
+                                'matchLabels': {
+                                    'app': traefik2_config.object_name('pod-label-app'),
+                                },
+                            },
+                        }],
+                    },
+                },
+            }},
+        ]))
+    if traefik_profile['transport'] is not None:
+        # allow Traefik to read the ServersTransport resources
+        traefik2_jsonpatches.append(FilterJSONPatch(filters={'names': [traefik2_config.BUILDITEM_CLUSTER_ROLE]}, patches=[
+            {'op': 'add', 'path': '/rules/-', 'value': {
+                'apiGroups': ['traefik.containo.us'],
+                'resources': ['serverstransports'],
+                'verbs': ['get', 'list', 'watch'],
+            }},
+        ]))
+    if args.loadbalancer == 'direct':
+        if kgprovider.provider == PROVIDER_GOOGLE:
+            # container-native load balancing, the ingress sends requests directly to the pods
+            traefik2_jsonpatches.append(FilterJSONPatch(filters={'names': [traefik2_config.BUILDITEM_SERVICE]}, patches=[
+                {'op': 'merge', 'path': '/metadata', 'value': {'annotations': {
+                    'cloud.google.com/neg': QuotedStr('{"ingress": true}'),
+                }}},
+            ]))
+        if kgprovider.provider in [PROVIDER_GOOGLE, PROVIDER_AMAZON]:
+            # externalTrafficPolicy is only allowed on NodePort services. The node ports only receive traffic if the
+            # load balancer falls back to node targets, and then only on the nodes running Traefik, keeping the
+            # client address.
+            traefik2_jsonpatches.append(FilterJSONPatch(filters={'names': [traefik2_config.BUILDITEM_SERVICE]}, patches=[
+                {'op': 'merge', 'path': '/spec', 'value': {
+                    'type': 'NodePort',
+                    'externalTrafficPolicy': 'Local',
+                }},
+            ]))
+    if placement is not None:
+        traefik2_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [traefik2_config.BUILDITEM_DEPLOYMENT]},
+            patches=placement_patches(placement, 'edge', NODE_POOL_LABELS[kgprovider.provider])))
+    traefik2_config.jsonpatches(traefik2_jsonpatches)
+
+    traefik_transport_name = 'backend' if traefik_profile['transport'] is not None else None
+
+    traefik2_config.ensure_build_names(traefik2_config.BUILD_CRD, traefik2_config.BUILD_ACCESSCONTROL,
+                                       traefik2_config.BUILD_SERVICE)
+
+    #
+    # OUTPUTFILE: traefik-config-crd.yaml
+    #
+    file = OutputFile_Kubernetes('traefik-config-crd.yaml')
+
+    file.append(cached_build(build_cache, traefik2_config, traefik2_config.BUILD_CRD))
+
+    if traefik_profile['transport'] is not None:
+        file.append(SERVERSTRANSPORT_CRD)
+
+    out.append(file)
+    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+
+    #
+    # OUTPUTFILE: traefik-config.yaml
+    #
+    file = OutputFile_Kubernetes('traefik-config.yaml')
+
+    file.append(cached_build(build_cache, traefik2_config, traefik2_config.BUILD_ACCESSCONTROL))
+
+    if traefik_profile['transport'] is not None:
+        # the ServersTransport must be on the same namespace as the service it is used for
+        for transport_namespace in [kg.option_get('namespaces.default'), kg.option_get('namespaces.mon')]:
+            file.append({
+                'apiVersion': 'traefik.containo.us/v1alpha1',
+                'kind': 'ServersTransport',
+                'metadata': {
+                    'name': traefik_transport_name,
+                    'namespace': transport_namespace,
+                },
+                'spec': traefik_profile['transport'],
+            })
+
+    file.append([{
+        'apiVersion': 'traefik.containo.us/v1alpha1',
+        'kind': 'IngressRoute',
+        'metadata': {
+            'name': 'traefik-api',
+            'namespace': kg.option_get('namespaces.default'),
+        },
+        'spec': {
+            'entryPoints': ['api'],
+            'routes': [{
+                'match': 'Method(`GET`)',
+                'kind': 'Rule',
+                'services': [{
+                    'name': 'api@internal',
+                    'kind': 'TraefikService'
+                }]
+            }]
+        }
+    }])
+
+    out.append(file)
+    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+
+    #
+    # OUTPUTFILE: traefik.yaml
+    #
+    file = OutputFile_Kubernetes('traefik.yaml')
+
+    file.append(cached_build(build_cache, traefik2_config, traefik2_config.BUILDITEM_SERVICE))
+
+    if traefik_profile['autoscaling'] is not None:
+        file.append({
+            'apiVersion': 'autoscaling/v2beta2',
+            'kind': 'HorizontalPodAutoscaler',
+            'metadata': {
+                'name': traefik2_config.object_name('deployment'),
+                'namespace': traefik2_config.namespace(),
+            },
+            'spec': {
+                'scaleTargetRef': {
+                    'apiVersion': 'apps/v1',
+                    'kind': 'Deployment',
+                    'name': traefik2_config.object_name('deployment'),
+                },
+                'minReplicas': traefik_profile['autoscaling']['min_replicas'],
+                'maxReplicas': traefik_profile['autoscaling']['max_replicas'],
+                'metrics': [{
+                    'type': 'Resource',
+                    'resource': {
+                        'name': 'cpu',
+                        'target': {
+                            'type': 'Utilization',
+                            'averageUtilization': traefik_profile['autoscaling']['cpu_utilization'],
+                        },
+                    },
+                }],
+            },
+        })
+
+    if traefik_profile['disruption_budget'] is not None:
+        file.append({
+            'apiVersion': 'policy/v1beta1',
+            'kind': 'PodDisruptionBudget',
+            'metadata': {
+                'name': traefik2_config.object_name('deployment'),
+                'namespace': traefik2_config.namespace(),
+            },
+            'spec': {
+                'maxUnavailable': traefik_profile['disruption_budget']['max_unavailable'],
+                'selector': {
+                    'matchLabels': {
+                        'app': traefik2_config.object_name('pod-label-app'),
+                    },
+                },
+            },
+        })
+
+    if args.loadbalancer == 'direct' and kgprovider.provider == PROVIDER_DIGITALOCEAN:
+        # expose only the web entrypoint on a load balancer, sending traffic only to the nodes running Traefik
+        file.append({
+            'apiVersion': 'v1',
+            'kind': 'Service',
+            'metadata': {
+                'name': traefik2_config.object_name('service') + '-lb',
+                'namespace': traefik2_config.namespace(),
+                'annotations': {
+                    'service.beta.kubernetes.io/do-loadbalancer-enable-proxy-protocol': QuotedStr('true'),
+                    'service.beta.kubernetes.io/do-loadbalancer-enable-backend-keepalive': QuotedStr('true'),
+                },
+            },
+            'spec': {
+                'type': 'LoadBalancer',
+                'externalTrafficPolicy': 'Local',
+                'selector': {
+                    'app': traefik2_config.object_name('pod-label-app'),
+                },
+                'ports': [{
+                    'name': 'web',
+                    'protocol': 'TCP',
+                    'port': 80,
+                    'targetPort': 'web',
+                }],
+            },
+        })
+
+    file.append({
+        'apiVersion': 'traefik.containo.us/v1alpha1',
+        'kind': 'IngressRoute',
+        'metadata': {
+            'name': 'admin-traefik',
+            'namespace': kg.option_get('namespaces.default'),
+        },
+        'spec': {
+            'entryPoints': ['web'],
+            'routes': [{
+                'match': f'Host(`admin-traefik.localdomain`)',
+                'kind': 'Rule',
+                'services': [{
+                    'name': traefik2_config.object_name('service'),
+                    'port': 8080,
+                    'serversTransport': ValueData(value=traefik_transport_name, disabled_if_none=True),
+                }],
+            }]
+        }
+    })
+
+    out.append(file)
+    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+
+    return traefik2_config, traefik_transport_name
@@ -0,0 +1,244 @@
+"""
+Validates the generated Kubernetes objects offline, without a cluster.
+
+The schemas of the Kubernetes APIs are compiled from the models of the ``kubernetes`` package, once per package version,
+and cached on disk. The APIs removed from the package, like the ```extensions/v1beta1``` Ingress, and the Traefik
+custom resources are described in the bundled ```schemas/bundled.json``` file.
+
+Each object is checked for unknown fields, missing required fields and values of the wrong type.
+"""
+import functools
+import json
+import os
+import re
+import tempfile
+from importlib import metadata
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Set, Tuple
+
+from kubragen import KubraGen
+from kubragen.output import OutputProject
+
+from .apply import project_waves
+from .cache import default_cache_path
+
+BUNDLED_SCHEMAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schemas', 'bundled.json')
+
+# fields that the API server accepts as numbers, although the models declare them as strings
+QUANTITY_FIELDS = {
+    ('V1ResourceRequirements', 'limits'): 'Dict[str, quantity]',
+    ('V1ResourceRequirements', 'requests'): 'Dict[str, quantity]',
+    ('V1VolumeResourceRequirements', 'limits'): 'Dict[str, quantity]',
+    ('V1VolumeResourceRequirements', 'requests'): 'Dict[str, quantity]',
+    ('V1PersistentVolumeSpec', 'capacity'): 'Dict[str, quantity]',
+    ('V1EmptyDirVolumeSource', 'sizeLimit'): 'quantity',
+    ('V1ResourceQuotaSpec', 'hard'): 'Dict[str, quantity]',
+}
+
+_PRIMITIVES = {
+    'str': lambda value: isinstance(value, str),
+    'datetime': lambda value: isinstance(value, str),
+    'bytes': lambda value: isinstance(value, str),
+    'int': lambda value: isinstance(value, int) and not isinstance(value, bool),
+    'float': lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    'bool': lambda value: isinstance(value, bool),
+    'quantity': lambda value: isinstance(value, (str, int, float)) and not isinstance(value, bool),
+    'object': lambda value: True,
+}
+
+
+def compile_kubernetes_schemas() -> Dict[str, Any]:
+    """
+    Compiles the schemas of the models of the ``kubernetes`` package.
+
+    The kinds are keyed by ```<version>/<kind>```, as the model names don't include the API group. The required
+    fields are only known for the package versions based on pydantic.
+    """
+    try:
+        from kubernetes.client import models
+    except ImportError as e:
+        raise ImportError('The kubernetes package is required to validate, install it with '
+                          '"pip install kubernetes"') from e
+
+    types = {}
+    kinds = {}
+    for name in dir(models):
+        model = getattr(models, name)
+        if not isinstance(model, type) or not isinstance(getattr(model, 'openapi_types', None), dict):
+            continue
+        model_fields = getattr(model, 'model_fields', None)
+        fields = {}
+        required = []
+        for attr, attr_type in model.openapi_types.items():
+            key = model.attribute_map[attr]
+            fields[key] = QUANTITY_FIELDS.get((name, key), attr_type)
+            if isinstance(model_fields, Mapping) and attr in model_fields and model_fields[attr].is_required():
+                required.append(key)
+        types[name] = {'fields': fields, 'required': required}
+
+        m = re.fullmatch(r'(V\d+(?:alpha\d+|beta\d+)?)([A-Z]\w*)', name)
+        if m is not None and not name.endswith('List') and {'apiVersion', 'kind', 'metadata'} <= set(fields):
+            kinds.setdefault('{}/{}'.format(m.group(1).lower(), m.group(2)), name)
+    return {'kinds': kinds, 'types': types}
+
+
+def load_schemas(cache_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Returns the Kubernetes schemas merged with the bundled ones, compiling the Kubernetes schemas only if they are not
+    cached yet for the installed ``kubernetes`` package version.
+
+    :param cache_path: the cache directory, ```schemas``` inside the default cache directory if None
+    """
+    try:
+        # the package itself is imported only when compiling, as importing all the models is slow
+        version = metadata.version('kubernetes')
+    except metadata.PackageNotFoundError as e:
+        raise ImportError('The kubernetes package is required to validate, install it with '
+                          '"pip install kubernetes"') from e
+
+    if cache_path is None:
+        cache_path = default_cache_path('schemas')
+    filename = os.path.join(cache_path, 'kubernetes-{}.json'.format(version))
+    try:
+        with open(filename, 'r') as f:
+            schemas = json.load(f)
+    except (OSError, ValueError):
+        schemas = compile_kubernetes_schemas()
+        try:
+            os.makedirs(cache_path, exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(dir=cache_path, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(schemas, f, separators=(',', ':'))
+                os.replace(tmpname, filename)
+            except OSError:
+                os.remove(tmpname)
+                raise
+        except OSError:
+            # read-only or full file system, the schemas are used without caching them
+            pass
+
+    with open(BUNDLED_SCHEMAS, 'r') as f:
+        bundled = json.load(f)
+    schemas['kinds'].update(bundled['kinds'])
+    schemas['types'].update(bundled['types'])
+    return schemas
+
+
+@functools.lru_cache(maxsize=None)
+def default_validator() -> 'SchemaValidator':
+    """
+    Returns a validator with the default schemas, loaded once per process.
+    """
+    return SchemaValidator(load_schemas())
+
+
+def _is_kubernetes_group(api_version: str) -> bool:
+    group = api_version.rpartition('/')[0]
+    return group == '' or '.' not in group or group.endswith('.k8s.io')
+
+
+class SchemaValidator:
+    """
+    Validates objects against compiled schemas.
+
+    :param schemas: the schemas, as returned by :func:`load_schemas`
+    """
+    def __init__(self, schemas: Mapping[str, Any]):
+        self.kinds = schemas['kinds']
+        self.types = schemas['types']
+
+    def object_type(self, api_version: str, kind: str) -> Optional[str]:
+        """
+        Returns the schema type name of an API version and kind, or None if unknown.
+        """
+        ret = self.kinds.get('{}/{}'.format(api_version, kind))
+        if ret is None and _is_kubernetes_group(api_version):
+            ret = self.kinds.get('{}/{}'.format(api_version.rpartition('/')[2], kind))
+        return ret
+
+    def validate_object(self, obj: Mapping[str, Any]) -> List[str]:
+        """
+        Validates an object.
+
+        :return: the errors, with the path of the invalid field
+        """
+        object_type = self.object_type(obj.get('apiVersion'), obj.get('kind'))
+        if object_type is None:
+            return ['unknown kind in {}'.format(obj.get('apiVersion'))]
+        errors: List[str] = []
+        self._check(obj, object_type, '', errors)
+        return errors
+
+    def _check(self, value: Any, value_type: str, path: str, errors: List[str]) -> None:
+        if value is None:
+            # a null field is the same as a missing one
+            return
+        if value_type.startswith('List['):
+            if not isinstance(value, list):
+                errors.append('{}: expected a list'.format(path))
+                return
+            for idx, item in enumerate(value):
+                self._check(item, value_type[5:-1], '{}[{}]'.format(path, idx), errors)
+        elif value_type.startswith('Dict[str, '):
+            if not isinstance(value, Mapping):
+                errors.append('{}: expected a mapping'.format(path))
+                return
+            for key, item in value.items():
+                self._check(item, value_type[10:-1], '{}.{}'.format(path, key), errors)
+        elif value_type in _PRIMITIVES:
+            if not _PRIMITIVES[value_type](value):
+                errors.append('{}: expected {}, got {} {!r}'.format(
+                    path, value_type, type(value).__name__, value))
+        elif value_type in self.types:
+            if not isinstance(value, Mapping):
+                errors.append('{}: expected a mapping'.format(path))
+                return
+            schema = self.types[value_type]
+            for key, item in value.items():
+                field_path = '{}.{}'.format(path, key) if path else key
+                if key not in schema['fields']:
+                    errors.append('{}: unknown field'.format(field_path))
+                else:
+                    self._check(item, schema['fields'][key], field_path, errors)
+            for key in schema['required']:
+                if value.get(key) is None:
+                    errors.append('{}: missing required field'.format('{}.{}'.format(path, key) if path else key))
+
+    def validate(self, objects: Sequence[Mapping[str, Any]]) -> List[str]:
+        """
+        Validates a list of objects. The custom resources defined by a CustomResourceDefinition in the list, but without
+        a schema, are not validated.
+
+        :return: the errors, prefixed with the object kind and name
+        """
+        defined: Set[Tuple[str, str]] = set()
+        for obj in objects:
+            if obj.get('kind') == 'CustomResourceDefinition':
+                spec = obj.get('spec') or {}
+                versions = [version.get('name') for version in spec.get('versions') or []] + [spec.get('version')]
+                for version in versions:
+                    if version is not None:
+                        defined.add(('{}/{}'.format(spec.get('group'), version), (spec.get('names') or {}).get('kind')))
+
+        ret = []
+        for obj in objects:
+            name = '{} "{}"'.format(obj.get('kind'), (obj.get('metadata') or {}).get('name'))
+            if self.object_type(obj.get('apiVersion'), obj.get('kind')) is None and \
+                    (obj.get('apiVersion'), obj.get('kind')) in defined:
+                continue
+            ret.extend('{}: {}'.format(name, error) for error in self.validate_object(obj))
+        return ret
+
+
+def validate_project(kg: KubraGen, out: OutputProject, validator: Optional[SchemaValidator] = None) -> List[str]:
+    """
+    Validates the objects of the Kubernetes files of the project.
+
+    :param kg: the :class:`kubragen.kubragen.Kubragen` instance
+    :param out: the output project
+    :param validator: the validator, :func:`default_validator` if None
+    :return: the errors
+    """
+    if validator is None:
+        validator = default_validator()
+    return validator.validate([obj for wave in project_waves(kg, out) for obj in wave])
@@ -0,0 +1,152 @@
+"""
+Renders a sample again every time its ```generate.py``` or one of the shared :mod:`kgsamples` modules it uses
+changes, keeping the process and KubraGen warm.
+
+The builders whose inputs didn't change are reused from the build cache, and only the output files whose contents
+changed are written, to a fixed ```<output path>/<provider>-watch``` directory.
+
+The shared modules are imported again in place, in the order of :data:`SAMPLE_MODULES`, before the sample. The
+modules of the tools themselves, like :mod:`kgsamples.render` and this one, are not watched, and a change to them
+needs a restart.
+
+Usage::
+
+    $ python -m kgsamples.watch prometheus -p k3d --size small
+"""
+import argparse
+import importlib
+import os
+import sys
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+from . import output
+from .render import STACKS, load_stack, stack_filename
+
+# the shared modules used by the samples, each after the modules it imports
+SAMPLE_MODULES = [
+    'kgsamples.profiles',
+    'kgsamples.images',
+    'kgsamples.budget',
+    'kgsamples.output',
+    'kgsamples.load',
+    'kgsamples.cache',
+    'kgsamples.sample',
+    'kgsamples.traefik',
+]
+
+
+class StackWatcher:
+    """
+    Renders a sample when its ```generate.py``` or one of the :data:`SAMPLE_MODULES` changes.
+
+    :param stack: the stack name, one of :data:`kgsamples.render.STACKS`
+    :param argv: the sample command line arguments
+    :param interval: seconds between checks for changes
+    """
+    def __init__(self, stack: str, argv: List[str], interval: float = 0.5):
+        self.stack = stack
+        self.argv = argv
+        self.interval = interval
+        self.filename = stack_filename(stack)
+        self.module: Optional[Any] = None
+
+    def filenames(self) -> List[str]:
+        """
+        Returns the files checked for changes, the sample and the imported shared modules.
+        """
+        filenames = [self.filename]
+        for name in SAMPLE_MODULES:
+            module = sys.modules.get(name)
+            if module is not None and getattr(module, '__file__', None):
+                filenames.append(module.__file__)
+        return filenames
+
+    def mtimes(self, previous: Dict[str, int]) -> Dict[str, int]:
+        """
+        Returns the modification time of each of the :meth:`filenames`.
+
+        :param previous: the previous modification times, used for the files that can't be read
+        """
+        mtimes = {}
+        for filename in self.filenames():
+            try:
+                mtimes[filename] = os.stat(filename).st_mtime_ns
+            except OSError:
+                # the file may be briefly missing while an editor saves it
+                if filename in previous:
+                    mtimes[filename] = previous[filename]
+        return mtimes
+
+    def _load(self, reload_modules: bool = False) -> Any:
+        if reload_modules:
+            for name in SAMPLE_MODULES:
+                if name in sys.modules:
+                    importlib.reload(sys.modules[name])
+        self.module = load_stack(self.stack, reload=True)
+        return self.module
+
+    def render(self, reload_modules: bool = False) -> None:
+        """
+        Imports the sample again, renders it and writes the changed files.
+
+        :param reload_modules: whether to import the :data:`SAMPLE_MODULES` again first
+        """
+        start = time.monotonic()
+        try:
+            module = self._load(reload_modules)
+            args = module.arg_parser().parse_args(self.argv)
+            kg, out = module.build(args)
+            if getattr(args, 'validate', False):
+                from .validate import validate_project
+                for error in validate_project(kg, out):
+                    print('Invalid object: {}'.format(error))
+            driver = output.OutputDriver_Changed(os.path.join(args.output_path, '{}-watch'.format(args.provider)))
+            out.output(driver)
+            removed = driver.remove_stale()
+        except SystemExit:
+            # invalid command line arguments, already reported by the parser
+            return
+        except Exception:
+            traceback.print_exc()
+            return
+
+        print('Rendered to {} in {:.2f}s, {} changed{}'.format(
+            driver.path, time.monotonic() - start,
+            ', '.join(driver.changed) if len(driver.changed) > 0 else 'nothing',
+            ', {} removed'.format(', '.join(removed)) if len(removed) > 0 else ''))
+
+    def run(self) -> None:
+        """
+        Renders the sample, and again on every change, until interrupted.
+        """
+        mtimes = self.mtimes({})
+        self.render()
+        while True:
+            time.sleep(self.interval)
+            current = self.mtimes(mtimes)
+            # the modules imported by the last render are only compared from the next check
+            changed = [filename for filename, mtime in current.items()
+                       if filename in mtimes and mtimes[filename] != mtime]
+            mtimes = current
+            if len(changed) > 0:
+                self.render(any(filename != self.filename for filename in changed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render a sample again on every change')
+    parser.add_argument('--interval', help='seconds between checks for changes', type=float, default=0.5)
+    parser.add_argument('stack', help='stack name', choices=list(STACKS))
+    parser.add_argument('args', help='the sample command line arguments', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    print('Watching {}'.format(stack_filename(args.stack)))
+    try:
+        StackWatcher(args.stack, args.args, interval=args.interval).run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
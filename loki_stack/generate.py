@@ -1,49 +1,267 @@
-import argparse
-import datetime
 import os
+import posixpath
+import sys
 
+from kg_loki import LokiConfigFile, LokiConfigFileOptions
 from kg_lokistack import LokiStackBuilder, LokiStackOptions
-from kg_traefik2 import Traefik2Builder, Traefik2Options, Traefik2OptionsPort
-from kgpr_core.amazon.eks.kresource import KRPersistentVolumeProfile_AWSElasticBlockStore
-from kgpr_core.amazon.eks.provider import ProviderAmazonEKS
-from kgpr_core.digitalocean.kubernetes.kresource import KRPersistentVolumeProfile_CSI_DOBS
-from kgpr_core.digitalocean.kubernetes.provider import ProviderDigitalOceanKubernetes
-from kgpr_core.google.gke.kresource import KRPersistentVolumeProfile_GCEPersistentDisk
-from kgpr_core.google.gke.provider import ProviderGoogleGKE
-from kgpr_core.k3d.generic.provider import ProviderK3DGeneric
+from kg_promtail import PromtailConfigFile, PromtailConfigFileOptions, PromtailConfigFileExt_Kubernetes
 from kubragen import KubraGen
-from kubragen.consts import PROVIDER_K3D, PROVIDER_GOOGLE, PROVIDER_DIGITALOCEAN, PROVIDER_AMAZON
-from kubragen.helper import QuotedStr
-from kubragen.jsonpatch import FilterJSONPatches_Apply, FilterJSONPatch
-from kubragen.kresource import KRPersistentVolumeProfile_HostPath, KRPersistentVolumeClaimProfile_Basic
-from kubragen.object import Object
+from kubragen.configfile import ConfigFile, ConfigFileExtension, ConfigFileExtensionData
+from kubragen.data import ValueData
+from kubragen.helper import QuotedStr, LiteralStr
+from kubragen.jsonpatch import FilterJSONPatch
 from kubragen.option import OptionRoot
-from kubragen.options import Options
-from kubragen.output import OutputProject, OutputFile_ShellScript, OutputFile_Kubernetes, OD_FileTemplate, \
-    OutputDriver_Directory
+from kubragen.options import Options, OptionGetter
+from kubragen.output import OutputProject, OutputFile_ShellScript, OutputFile_Kubernetes, OD_FileTemplate
+
+# the tools shared by the samples
+kgsamples_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+if kgsamples_path not in sys.path:
+    sys.path.insert(0, kgsamples_path)
+
+from kgsamples import sample
+from kgsamples.cache import BuildCache, cached_build
+from kgsamples.load import log_generator_deployment, http_load_job, graph_dashboard
+from kgsamples.profiles import guaranteed_resources, STORAGE_TIERS, ROLLOUT_PROFILES, PLACEMENT_PROFILES, \
+    NODE_POOL_LABELS, rollout_probe_patches, placement_patches
+from kgsamples.traefik import traefik_files
+
+
+#
+# Log path profiles: promtail batching, Loki ingestion limits (applied per tenant), and filtering
+# of log lines before they are shipped
+#
+LOG_PROFILES = {
+    'default': {
+        'promtail': {
+            'batchwait': '1s',
+            'batchsize': 1048576,
+        },
+        'loki': {
+            'ingestion_rate_mb': 4,
+            'ingestion_burst_size_mb': 6,
+        },
+        'drop_namespaces': [],
+        'drop_expressions': [],
+    },
+    'low-latency': {
+        'promtail': {
+            'batchwait': '200ms',
+            'batchsize': 262144,
+        },
+        'loki': {
+            'ingestion_rate_mb': 4,
+            'ingestion_burst_size_mb': 8,
+        },
+        'drop_namespaces': [],
+        'drop_expressions': [],
+    },
+    'high-volume': {
+        'promtail': {
+            'batchwait': '5s',
+            'batchsize': 4194304,
+        },
+        'loki': {
+            'ingestion_rate_mb': 16,
+            'ingestion_burst_size_mb': 32,
+        },
+        'drop_namespaces': ['kube-system'],
+        'drop_expressions': [
+            '(?i).*level=debug.*',
+            '(?i).*"level":\\s*"debug".*',
+        ],
+    },
+}
+
+
+class PromtailConfigFileExt_Filter(ConfigFileExtension):
+    """
+    Promtail configuration extension that filters logs before they are shipped to Loki.
+
+    Namespaces are dropped using relabeling, so their files are never tailed, and lines are dropped
+    using a *drop* pipeline stage.
+
+    :param drop_namespaces: namespaces whose logs should not be collected
+    :param drop_expressions: regular expressions of log lines to drop
+    """
+    def __init__(self, drop_namespaces=None, drop_expressions=None):
+        self.drop_namespaces = drop_namespaces if drop_namespaces is not None else []
+        self.drop_expressions = drop_expressions if drop_expressions is not None else []
+
+    def process(self, configfile: ConfigFile, data: ConfigFileExtensionData, options: OptionGetter) -> None:
+        for scrape_config in data.data['scrape_configs']:
+            if len(self.drop_namespaces) > 0:
+                scrape_config['relabel_configs'].insert(0, {
+                    'action': 'drop',
+                    'regex': '|'.join(self.drop_namespaces),
+                    'source_labels': ['__meta_kubernetes_namespace'],
+                })
+            for expression in self.drop_expressions:
+                scrape_config['pipeline_stages'].append({
+                    'drop': {
+                        'expression': expression,
+                    },
+                })
+
+
+#
+# Cluster size presets: replicas, resources, retention, cache and storage of each component
+#
+SIZE_PRESETS = {
+    'default': {
+        'traefik': {
+            'resources': None,
+        },
+        'echo': {
+            'replicas': 1,
+            'resources': None,
+        },
+        'loki': {
+            'resources': None,
+            'retention': None,
+            'chunk_cache_size': None,
+            'storage': '50Gi',
+        },
+        'promtail': {
+            'resources': None,
+        },
+        'grafana': {
+            'resources': None,
+        },
+    },
+    'small': {
+        'traefik': {
+            'resources': guaranteed_resources('250m', '128Mi'),
+        },
+        'echo': {
+            'replicas': 1,
+            'resources': guaranteed_resources('50m', '64Mi'),
+        },
+        'loki': {
+            'resources': guaranteed_resources('500m', '1Gi'),
+            'retention': '168h',
+            'chunk_cache_size': '128MB',
+            'storage': '20Gi',
+        },
+        'promtail': {
+            'resources': guaranteed_resources('100m', '128Mi'),
+        },
+        'grafana': {
+            'resources': guaranteed_resources('100m', '128Mi'),
+        },
+    },
+    'medium': {
+        'traefik': {
+            'resources': guaranteed_resources('500m', '256Mi'),
+        },
+        'echo': {
+            'replicas': 2,
+            'resources': guaranteed_resources('100m', '64Mi'),
+        },
+        'loki': {
+            'resources': guaranteed_resources('1', '4Gi'),
+            'retention': '336h',
+            'chunk_cache_size': '1GB',
+            'storage': '50Gi',
+        },
+        'promtail': {
+            'resources': guaranteed_resources('200m', '128Mi'),
+        },
+        'grafana': {
+            'resources': guaranteed_resources('250m', '256Mi'),
+        },
+    },
+    'large': {
+        'traefik': {
+            'resources': guaranteed_resources('1', '512Mi'),
+        },
+        'echo': {
+            'replicas': 3,
+            'resources': guaranteed_resources('200m', '128Mi'),
+        },
+        'loki': {
+            'resources': guaranteed_resources('4', '16Gi'),
+            'retention': '720h',
+            'chunk_cache_size': '4GB',
+            'storage': '200Gi',
+        },
+        'promtail': {
+            'resources': guaranteed_resources('500m', '256Mi'),
+        },
+        'grafana': {
+            'resources': guaranteed_resources('500m', '512Mi'),
+        },
+    },
+}
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Kube Creator')
-    parser.add_argument('-p', '--provider', help='provider', required=True, choices=[
-        'google-gke',
-        'amazon-eks',
-        'digitalocean-kubernetes',
-        'k3d',
-    ])
-    parser.add_argument('-o', '--output-path', help='output path', default='output')
-    args = parser.parse_args()
-
-    if args.provider == 'k3d':
-        kgprovider = ProviderK3DGeneric()
-    elif args.provider == 'google-gke':
-        kgprovider = ProviderGoogleGKE()
-    elif args.provider == 'digitalocean-kubernetes':
-        kgprovider = ProviderDigitalOceanKubernetes()
-    elif args.provider == 'amazon-eks':
-        kgprovider = ProviderAmazonEKS()
-    else:
-        raise Exception('Unknown target')
+#
+# Load generator profiles, used to benchmark the stack
+#
+LOAD_PROFILES = {
+    'default': None,
+    'light': {
+        'logs': {
+            'replicas': 1,
+            # lines per second per replica
+            'rate': 100,
+            'message_size': 200,
+        },
+        'http': {
+            'rps': 50,
+            'concurrency': 5,
+            'duration': '5m',
+        },
+    },
+    'heavy': {
+        'logs': {
+            'replicas': 4,
+            # lines per second per replica
+            'rate': 2500,
+            'message_size': 500,
+        },
+        'http': {
+            'rps': 1000,
+            'concurrency': 50,
+            'duration': '10m',
+        },
+    },
+}
+
+
+def arg_parser():
+    """
+    Returns the command line parser of the sample.
+    """
+    parser = sample.arg_parser(SIZE_PRESETS, LOAD_PROFILES)
+    parser.add_argument('--self-monitoring', help='expose the pipeline metrics to Prometheus', action='store_true')
+    parser.add_argument('--no-grafana', help='do not deploy Grafana, when sharing the one of the Prometheus stack',
+                        action='store_true')
+    parser.add_argument('--log-profile', help='log path profile', default='default', choices=list(LOG_PROFILES))
+    return parser
+
+
+def build(args):
+    """
+    Builds the sample from the parsed command line arguments, without saving it.
+
+    :return: a (KubraGen, OutputProject) tuple
+    """
+    kgprovider = sample.kubragen_provider(args.provider)
+
+    size_preset = SIZE_PRESETS[args.size]
+    rollout_profile = ROLLOUT_PROFILES[args.rollout]
+    placement = PLACEMENT_PROFILES[args.placement]
+    load_profile = LOAD_PROFILES[args.load]
+    storage_tier = STORAGE_TIERS[args.storage_tier]
+    if storage_tier is not None:
+        storage_tier = storage_tier[kgprovider.provider]
+
+    build_cache = None
+    if not args.no_cache:
+        build_cache = BuildCache()
+
+    log_profile = LOG_PROFILES[args.log_profile]
 
     kg = KubraGen(provider=kgprovider, options=Options({
         'namespaces': {
@@ -52,54 +270,11 @@ def main():
         },
     }))
 
-    if kgprovider.provider == PROVIDER_K3D:
-        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_HostPath())
-    elif kgprovider.provider == PROVIDER_GOOGLE:
-        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_GCEPersistentDisk())
-    elif kgprovider.provider == PROVIDER_DIGITALOCEAN:
-        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_CSI_DOBS())
-    elif kgprovider.provider == PROVIDER_AMAZON:
-        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_AWSElasticBlockStore())
-
-    if kgprovider.provider == PROVIDER_K3D:
-        kg.resources().persistentvolumeclaimprofile_add('default', KRPersistentVolumeClaimProfile_Basic(allow_selector=False))
-    else:
-        kg.resources().persistentvolumeclaimprofile_add('default', KRPersistentVolumeClaimProfile_Basic())
-
-    kg.resources().persistentvolume_add('loki-storage', 'default', {
-        'hostPath': {
-            'path': '/var/storage/loki'
-        },
-        'csi': {
-            'fsType': 'ext4',
-        },
-    }, {
-        'metadata': {
-            'labels': {
-                'pv.role': 'loki',
-            },
-        },
-        'spec': {
-            'persistentVolumeReclaimPolicy': 'Retain',
-            'capacity': {
-                'storage': '50Gi'
-            },
-            'accessModes': ['ReadWriteOnce'],
-        },
-    })
-
-    kg.resources().persistentvolumeclaim_add('loki-storage-claim', 'default', {
-        'namespace': 'monitoring',
-        'persistentVolume': 'loki-storage',
-    }, {
-        'spec': {
-            'selector': {
-                'matchLabels': {
-                    'pv.role': 'loki',
-                }
-            },
-        }
-    })
+    sample.storage_profiles(kg)
+    if storage_tier is not None:
+        sample.storage_class_add(kg, storage_tier)
+    sample.storage_claim_add(kg, 'loki', storage_tier, size_preset['loki']['storage'],
+                             sample.storage_disk(args, 'loki'))
 
     out = OutputProject(kg)
 
@@ -111,141 +286,78 @@ def main():
     #
     # Provider setup
     #
-    if kgprovider.provider == PROVIDER_K3D:
-        storage_directory = os.path.join(os.getcwd(), 'output', 'storage')
-        if not os.path.exists(storage_directory):
-            os.makedirs(storage_directory)
-        shell_script.append(f'# k3d cluster create kgsample-loki-stack --port 5051:80@loadbalancer --port 5052:443@loadbalancer -v {storage_directory}:/var/storage')
+    sample.cluster_setup(kg, out, shell_script, args, 'kgsample-loki-stack', placement)
 
     #
     # OUTPUTFILE: namespace.yaml
     #
-    file = OutputFile_Kubernetes('namespace.yaml')
-    file.append([{
-        'apiVersion': 'v1',
-        'kind': 'Namespace',
-        'metadata': {
-            'name': 'monitoring',
-        },
-    }])
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+    sample.namespace_file(out, shell_script, placement)
 
     #
-    # OUTPUTFILE: storage.yaml
+    # OUTPUTFILE: prepull.yaml
     #
-    file = OutputFile_Kubernetes('storage.yaml')
-
-    file.append(kg.persistentvolume_build())
-    file.append(kg.persistentvolumeclaim_build())
-
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+    images_file = None
+    prepull_file = None
+    if args.prepull:
+        # filled after all other files, with the images they use
+        images_file, prepull_file = sample.image_prepull_files(kg, out, shell_script, 'kgsample-loki-stack')
 
     #
-    # SETUP: Traefik 2
+    # OUTPUTFILE: storage.yaml
     #
-    traefik2_config = Traefik2Builder(kubragen=kg, options=Traefik2Options({
-            'namespace': OptionRoot('namespaces.default'),
-            'config': {
-                'traefik_args': [
-                    '--api.dashboard=true',
-                    '--api.insecure=false',
-                    '--entrypoints.web.Address=:80',
-                    '--entrypoints.api.Address=:8080',
-                    '--providers.kubernetescrd',
-                    f'--providers.kubernetescrd.namespaces=default,monitoring'
-                ],
-                'ports': [
-                    Traefik2OptionsPort(name='web', port_container=80, port_service=80),
-                    Traefik2OptionsPort(name='api', port_container=8080, port_service=8080),
-                ],
-                'create_traefik_crd': True,
-            },
-        })
-    )
-
-    traefik2_config.ensure_build_names(traefik2_config.BUILD_CRD, traefik2_config.BUILD_ACCESSCONTROL,
-                                       traefik2_config.BUILD_SERVICE)
+    sample.storage_file(kg, out, shell_script)
 
     #
-    # OUTPUTFILE: traefik-config-crd.yaml
+    # SETUP: Traefik 2
     #
-    file = OutputFile_Kubernetes('traefik-config-crd.yaml')
-
-    file.append(traefik2_config.build(traefik2_config.BUILD_CRD))
-
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+    traefik2_config, traefik_transport_name = traefik_files(kg, out, shell_script, args, size_preset, placement,
+                                                            build_cache)
 
     #
-    # OUTPUTFILE: traefik-config.yaml
+    # SETUP: lokistack
     #
-    file = OutputFile_Kubernetes('traefik-config.yaml')
-
-    file.append(traefik2_config.build(traefik2_config.BUILD_ACCESSCONTROL))
-
-    file.append([{
-        'apiVersion': 'traefik.containo.us/v1alpha1',
-        'kind': 'IngressRoute',
-        'metadata': {
-            'name': 'traefik-api',
-            'namespace': kg.option_get('namespaces.default'),
-        },
-        'spec': {
-            'entryPoints': ['api'],
-            'routes': [{
-                'match': 'Method(`GET`)',
-                'kind': 'Rule',
-                'services': [{
-                    'name': 'api@internal',
-                    'kind': 'TraefikService'
-                }]
-            }]
+    loki_merge_config = {
+        'limits_config': log_profile['loki'],
+    }
+    if size_preset['loki']['retention'] is not None:
+        loki_merge_config['table_manager'] = {
+            'retention_deletes_enabled': True,
+            'retention_period': size_preset['loki']['retention'],
         }
-    }])
-
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
-
-    #
-    # OUTPUTFILE: traefik.yaml
-    #
-    file = OutputFile_Kubernetes('traefik.yaml')
-
-    file.append(traefik2_config.build(traefik2_config.BUILDITEM_SERVICE))
-
-    file.append({
-        'apiVersion': 'traefik.containo.us/v1alpha1',
-        'kind': 'IngressRoute',
-        'metadata': {
-            'name': 'admin-traefik',
-            'namespace': kg.option_get('namespaces.default'),
-        },
-        'spec': {
-            'entryPoints': ['web'],
-            'routes': [{
-                'match': f'Host(`admin-traefik.localdomain`)',
-                'kind': 'Rule',
-                'services': [{
-                    'name': traefik2_config.object_name('service'),
-                    'port': 8080
-                }],
-            }]
+    if size_preset['loki']['chunk_cache_size'] is not None:
+        loki_merge_config['chunk_store_config'] = {
+            'chunk_cache_config': {
+                'enable_fifocache': True,
+                'fifocache': {
+                    'max_size_bytes': size_preset['loki']['chunk_cache_size'],
+                },
+            },
         }
-    })
 
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
-
-    #
-    # SETUP: lokistack
-    #
     lokistack_config = LokiStackBuilder(kubragen=kg, options=LokiStackOptions({
         'namespace': OptionRoot('namespaces.mon'),
         'config': {
+            'prometheus_annotation': args.self_monitoring,
             'loki': {
                 'service_port': 80,
+                'loki_config': LokiConfigFile(options=LokiConfigFileOptions({
+                    'config': {
+                        'merge_config': loki_merge_config,
+                    },
+                })),
+            },
+            'promtail': {
+                'promtail_config': PromtailConfigFile(options=PromtailConfigFileOptions({
+                    'config': {
+                        'merge_config': {
+                            'client': log_profile['promtail'],
+                        },
+                    },
+                }), extensions=[
+                    PromtailConfigFileExt_Kubernetes(),
+                    PromtailConfigFileExt_Filter(drop_namespaces=log_profile['drop_namespaces'],
+                                                 drop_expressions=log_profile['drop_expressions']),
+                ]),
             },
             'grafana': {
                 'service_port': 80,
@@ -255,26 +367,77 @@ def main():
                         'type': 'loki',
                         'access': 'proxy',
                         'url': 'http://{}:{}'.format('loki', 80),
-                    }]
+                    }],
+                    'dashboards': [{
+                        'name': 'load',
+                        'type': 'file',
+                    }] if load_profile is not None else None,
                 },
             },
         },
         'enable': {
-            'grafana': True,
+            'grafana': not args.no_grafana,
         },
         'kubernetes': {
             'volumes': {
-                'loki-data': {
-                    'persistentVolumeClaim': {
-                        'claimName': 'loki-storage-claim'
-                    }
-                }
+                'loki-data': sample.storage_volume('loki', storage_tier, size_preset['loki']['storage']),
+            },
+            'resources': {
+                'loki-statefulset': size_preset['loki']['resources'],
+                'promtail-daemonset': size_preset['promtail']['resources'],
+                'grafana-deployment': size_preset['grafana']['resources'],
             },
         },
     })).object_names_change({
         'loki-service': 'loki',
     })
 
+    lokistack_jsonpatches = []
+    if rollout_profile['parallel']:
+        lokistack_jsonpatches.append(FilterJSONPatch(filters={'names': [lokistack_config.BUILDITEM_LOKI_STATEFULSET]}, patches=[
+            {'op': 'replace', 'path': '/spec/podManagementPolicy', 'value': 'Parallel'},
+        ]))
+    if rollout_profile['startup'] is not None:
+        lokistack_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [lokistack_config.BUILDITEM_LOKI_STATEFULSET]},
+            patches=rollout_probe_patches(rollout_profile, {'path': '/ready', 'port': 'http-metrics'})))
+        lokistack_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [lokistack_config.BUILDITEM_GRAFANA_DEPLOYMENT]},
+            patches=rollout_probe_patches(rollout_profile, {'path': '/api/health', 'port': 3000})))
+    if args.self_monitoring:
+        # the Prometheus pod scrape configuration only accepts numeric ports
+        lokistack_jsonpatches.append(FilterJSONPatch(filters={'names': [lokistack_config.BUILDITEM_LOKI_STATEFULSET]}, patches=[
+            {'op': 'replace', 'path': '/spec/template/metadata/annotations/prometheus.io~1port', 'value': QuotedStr('3100')},
+        ]))
+        lokistack_jsonpatches.append(FilterJSONPatch(filters={'names': [lokistack_config.BUILDITEM_PROMTAIL_DAEMONSET]}, patches=[
+            {'op': 'replace', 'path': '/spec/template/metadata/annotations/prometheus.io~1port', 'value': QuotedStr('3101')},
+        ]))
+    if load_profile is not None and not args.no_grafana:
+        # the Loki stack builder does not create dashboard ConfigMaps, mount it directly
+        lokistack_jsonpatches.append(FilterJSONPatch(filters={'names': [lokistack_config.BUILDITEM_GRAFANA_DEPLOYMENT]}, patches=[
+            {'op': 'add', 'path': '/spec/template/spec/volumes/-', 'value': {
+                'name': 'dashboard-load',
+                'configMap': {
+                    'name': lokistack_config.object_name('grafana-deployment') + '-dashboard-load',
+                },
+            }},
+            {'op': 'add', 'path': '/spec/template/spec/containers/0/volumeMounts/-', 'value': {
+                'name': 'dashboard-load',
+                'mountPath': posixpath.join(lokistack_config.option_get('config.grafana.dashboards_path'), 'load'),
+            }},
+        ]))
+    if placement is not None:
+        lokistack_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [lokistack_config.BUILDITEM_LOKI_STATEFULSET]},
+            patches=placement_patches(placement, 'monitoring', NODE_POOL_LABELS[kgprovider.provider])))
+        lokistack_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [lokistack_config.BUILDITEM_GRAFANA_DEPLOYMENT]},
+            patches=placement_patches(placement, 'monitoring', NODE_POOL_LABELS[kgprovider.provider])))
+        lokistack_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [lokistack_config.BUILDITEM_PROMTAIL_DAEMONSET]},
+            patches=placement_patches(placement, 'monitoring', NODE_POOL_LABELS[kgprovider.provider], daemonset=True)))
+    lokistack_config.jsonpatches(lokistack_jsonpatches)
+
     lokistack_config.ensure_build_names(lokistack_config.BUILD_ACCESSCONTROL, lokistack_config.BUILD_CONFIG,
                                      lokistack_config.BUILD_SERVICE)
 
@@ -284,7 +447,27 @@ def main():
     file = OutputFile_Kubernetes('lokistack-config.yaml')
     out.append(file)
 
-    file.append(lokistack_config.build(lokistack_config.BUILD_ACCESSCONTROL, lokistack_config.BUILD_CONFIG))
+    file.append(cached_build(build_cache, lokistack_config, lokistack_config.BUILD_ACCESSCONTROL,
+                             lokistack_config.BUILD_CONFIG))
+
+    if load_profile is not None and not args.no_grafana:
+        file.append([{
+            'apiVersion': 'v1',
+            'kind': 'ConfigMap',
+            'metadata': {
+                'name': lokistack_config.object_name('grafana-deployment') + '-dashboard-load',
+                'namespace': lokistack_config.namespace(),
+            },
+            'data': {
+                'load.json': LiteralStr(graph_dashboard('Load generators', 'kgsample-load', 'Loki', [
+                    ('Log lines/s', 'sum(rate({app="log-generator"}[1m]))'),
+                    ('Log bytes/s', 'sum(bytes_rate({app="log-generator"}[1m]))'),
+                    ('Log lines/s by pod', 'sum(rate({app="log-generator"}[1m])) by (pod)'),
+                    ('Traefik access log lines/s', 'sum(rate({{app="{}"}}[1m]))'.format(
+                        traefik2_config.object_name('pod-label-app'))),
+                ])),
+            },
+        }])
 
     shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
 
@@ -294,173 +477,67 @@ def main():
     file = OutputFile_Kubernetes('lokistack.yaml')
     out.append(file)
 
-    file.append(lokistack_config.build(lokistack_config.BUILD_SERVICE))
-
-    file.append([{
-        'apiVersion': 'traefik.containo.us/v1alpha1',
-        'kind': 'IngressRoute',
-        'metadata': {
-            'name': 'admin-grafana',
-            'namespace': kg.option_get('namespaces.mon'),
-        },
-        'spec': {
-            'entryPoints': ['web'],
-            'routes': [{
-                'match': f'Host(`admin-grafana.localdomain`)',
-                'kind': 'Rule',
-                'services': [{
-                    'name': lokistack_config.object_name('grafana-service'),
-                    'namespace': lokistack_config.namespace(),
-                    'port': lokistack_config.option_get('config.grafana.service_port'),
-                }],
-            }]
-        }
-    }])
+    file.append(cached_build(build_cache, lokistack_config, lokistack_config.BUILD_SERVICE))
+
+    if not args.no_grafana:
+        file.append([{
+            'apiVersion': 'traefik.containo.us/v1alpha1',
+            'kind': 'IngressRoute',
+            'metadata': {
+                'name': 'admin-grafana',
+                'namespace': kg.option_get('namespaces.mon'),
+            },
+            'spec': {
+                'entryPoints': ['web'],
+                'routes': [{
+                    'match': f'Host(`admin-grafana.localdomain`)',
+                    'kind': 'Rule',
+                    'services': [{
+                        'name': lokistack_config.object_name('grafana-service'),
+                        'namespace': lokistack_config.namespace(),
+                        'port': lokistack_config.option_get('config.grafana.service_port'),
+                        'serversTransport': ValueData(value=traefik_transport_name, disabled_if_none=True),
+                    }],
+                }]
+            }
+        }])
 
     shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
 
     #
     # OUTPUTFILE: http-echo.yaml
     #
-    file = OutputFile_Kubernetes('http-echo.yaml')
-    out.append(file)
-
-    file.append([{
-        'apiVersion': 'apps/v1',
-        'kind': 'Deployment',
-        'metadata': {
-            'name': 'echo-deployment',
-            'namespace': kg.option_get('namespaces.default'),
-            'labels': {
-                'app': 'echo'
-            }
-        },
-        'spec': {
-            'replicas': 1,
-            'selector': {
-                'matchLabels': {
-                    'app': 'echo'
-                }
-            },
-            'template': {
-                'metadata': {
-                    'labels': {
-                        'app': 'echo'
-                    }
-                },
-                'spec': {
-                    'containers': [{
-                        'name': 'echo',
-                        'image': 'mendhak/http-https-echo',
-                        'ports': [{
-                            'containerPort': 80
-                        },
-                        {
-                            'containerPort': 443
-                        }],
-                    }]
-                }
-            }
-        }
-    },
-    {
-        'apiVersion': 'v1',
-        'kind': 'Service',
-        'metadata': {
-            'name': 'echo-service',
-            'namespace': kg.option_get('namespaces.default'),
-        },
-        'spec': {
-            'selector': {
-                'app': 'echo'
-            },
-            'ports': [{
-                'name': 'http',
-                'port': 80,
-                'targetPort': 80,
-                'protocol': 'TCP'
-            }]
-        }
-    }, {
-        'apiVersion': 'traefik.containo.us/v1alpha1',
-        'kind': 'IngressRoute',
-        'metadata': {
-            'name': 'http-echo',
-            'namespace': kg.option_get('namespaces.default'),
-        },
-        'spec': {
-            'entryPoints': ['web'],
-            'routes': [{
-                # 'match': f'Host(`http-echo.localdomain`)',
-                'match': f'PathPrefix(`/`)',
-                'kind': 'Rule',
-                'services': [{
-                    'name': 'echo-service',
-                    'port': 80,
-                }],
-            }]
-        }
-    }])
-
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+    sample.http_echo_file(kg, out, shell_script, size_preset, traefik_transport_name)
 
     #
     # OUTPUTFILE: ingress.yaml
     #
-    file = OutputFile_Kubernetes('ingress.yaml')
-    http_path = '/'
-    if kgprovider.provider == PROVIDER_GOOGLE or kgprovider.provider == PROVIDER_AMAZON:
-        http_path = '/*'
-
-    file_data = [
-        Object({
-            'apiVersion': 'extensions/v1beta1',
-            'kind': 'Ingress',
-            'metadata': {
-                'name': 'ingress',
-                'namespace': kg.option_get('namespaces.default'),
-            },
-            'spec': {
-                'rules': [{
-                    'http': {
-                        'paths': [{
-                            'path': http_path,
-                            'backend': {
-                                'serviceName': traefik2_config.object_name('service'),
-                                'servicePort': 80,
-                            }
-                        }]
-                    }
-                }]
-            }
-        }, name='ingress', source='app', instance='ingress')
-    ]
-
-    if kgprovider.provider == PROVIDER_AMAZON:
-        FilterJSONPatches_Apply(file_data, jsonpatches=[
-            FilterJSONPatch(filters={'names': ['ingress']}, patches=[
-                {'op': 'merge', 'path': '/metadata', 'value': {'annotations': {
-                    'kubernetes.io/ingress.class': 'alb',
-                    'alb.ingress.kubernetes.io/scheme': 'internet-facing',
-                    'alb.ingress.kubernetes.io/listen-ports': QuotedStr('[{"HTTP": 80}]'),
-                }}}
-            ])
-        ])
-
-    file.append(file_data)
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+    sample.ingress_file(kg, out, shell_script, args, traefik2_config)
 
     #
-    # OUTPUT
+    # OUTPUTFILE: load.yaml
     #
-    output_path = os.path.join(args.output_path, '{}-{}'.format(
-        args.provider, datetime.datetime.today().strftime("%Y%m%d-%H%M%S")))
-    print('Saving files to {}'.format(output_path))
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
+    if load_profile is not None:
+        file = OutputFile_Kubernetes('load.yaml')
+        out.append(file)
+
+        file.append([
+            log_generator_deployment(kg.option_get('namespaces.default'), load_profile['logs']),
+            # the requests go through the Traefik web entrypoint to the echo service
+            http_load_job(kg.option_get('namespaces.default'), 'http://{}.{}.svc/'.format(
+                traefik2_config.object_name('service'), traefik2_config.namespace()), load_profile['http']),
+        ])
+
+        shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
 
-    out.output(OutputDriver_Directory(output_path))
+    if images_file is not None:
+        sample.image_prepull_fill(out, images_file, prepull_file)
+
+    return kg, out
+
+
+def main():
+    sample.main(arg_parser(), build)
 
 
 if __name__ == "__main__":
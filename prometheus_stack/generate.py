@@ -1,255 +1,509 @@
-import argparse
-import datetime
+import base64
+import copy
+import gzip
+import json
 import os
+import re
+import sys
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
-from kg_grafana import GrafanaDashboardSource_GNet, GrafanaDashboardSource_Url
+from kg_grafana import GrafanaDashboardSource, GrafanaDashboardSource_GNet, \
+    GrafanaDashboardSource_Url, GrafanaDashboardSource_Str
 from kg_prometheus import PrometheusConfigFile, PrometheusConfigFileOptions, PrometheusConfigFileExt_Kubernetes
 from kg_prometheusstack import PrometheusStackBuilder, PrometheusStackOptions
-from kg_traefik2 import Traefik2Builder, Traefik2Options, Traefik2OptionsPort
-from kgpr_core.amazon.eks.kresource import KRPersistentVolumeProfile_AWSElasticBlockStore
-from kgpr_core.amazon.eks.provider import ProviderAmazonEKS
-from kgpr_core.digitalocean.kubernetes.kresource import KRPersistentVolumeProfile_CSI_DOBS
-from kgpr_core.digitalocean.kubernetes.provider import ProviderDigitalOceanKubernetes
-from kgpr_core.google.gke.kresource import KRPersistentVolumeProfile_GCEPersistentDisk
-from kgpr_core.google.gke.provider import ProviderGoogleGKE
-from kgpr_core.k3d.generic.provider import ProviderK3DGeneric
 from kubragen import KubraGen
-from kubragen.consts import PROVIDER_K3D, PROVIDER_GOOGLE, PROVIDER_DIGITALOCEAN, PROVIDER_AMAZON
+from kubragen.consts import PROVIDER_K3D
+from kubragen.data import ValueData, DataGetValue
+from kubragen.exception import InvalidParamError
 from kubragen.helper import QuotedStr
-from kubragen.jsonpatch import FilterJSONPatches_Apply, FilterJSONPatch
-from kubragen.kresource import KRPersistentVolumeProfile_HostPath, KRPersistentVolumeClaimProfile_Basic
-from kubragen.object import Object
+from kubragen.jsonpatch import FilterJSONPatch
 from kubragen.option import OptionRoot
 from kubragen.options import Options
-from kubragen.output import OutputProject, OutputFile_ShellScript, OutputFile_Kubernetes, OD_FileTemplate, \
-    OutputDriver_Directory
-
-
-def main():
-    parser = argparse.ArgumentParser(description='Kube Creator')
-    parser.add_argument('-p', '--provider', help='provider', required=True, choices=[
-        'google-gke',
-        'amazon-eks',
-        'digitalocean-kubernetes',
-        'k3d',
-    ])
-    parser.add_argument('-o', '--output-path', help='output path', default='output')
-    args = parser.parse_args()
-
-    if args.provider == 'k3d':
-        kgprovider = ProviderK3DGeneric()
-    elif args.provider == 'google-gke':
-        kgprovider = ProviderGoogleGKE()
-    elif args.provider == 'digitalocean-kubernetes':
-        kgprovider = ProviderDigitalOceanKubernetes()
-    elif args.provider == 'amazon-eks':
-        kgprovider = ProviderAmazonEKS()
-    else:
-        raise Exception('Unknown target')
-
-    kg = KubraGen(provider=kgprovider, options=Options({
-        'namespaces': {
-            'default': 'default',
-            'mon': 'monitoring',
+from kubragen.output import OutputProject, OutputFile_ShellScript, OutputFile_Kubernetes, OD_FileTemplate
+
+# the tools shared by the samples
+kgsamples_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+if kgsamples_path not in sys.path:
+    sys.path.insert(0, kgsamples_path)
+
+from kgsamples import sample
+from kgsamples.cache import BuildCache, cached_build
+from kgsamples.load import metrics_generator_deployment, http_load_job, graph_dashboard
+from kgsamples.profiles import guaranteed_resources, STORAGE_TIERS, ROLLOUT_PROFILES, PLACEMENT_PROFILES, \
+    NODE_POOL_LABELS, rollout_probe_patches, placement_patches
+from kgsamples.traefik import traefik_files
+
+
+#
+# Cluster size presets: replicas, resources, retention and storage of each component
+#
+SIZE_PRESETS = {
+    'default': {
+        'traefik': {
+            'resources': None,
         },
-    }))
-
-    if kgprovider.provider == PROVIDER_K3D:
-        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_HostPath())
-    elif kgprovider.provider == PROVIDER_GOOGLE:
-        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_GCEPersistentDisk())
-    elif kgprovider.provider == PROVIDER_DIGITALOCEAN:
-        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_CSI_DOBS())
-    elif kgprovider.provider == PROVIDER_AMAZON:
-        kg.resources().persistentvolumeprofile_add('default', KRPersistentVolumeProfile_AWSElasticBlockStore())
-
-    if kgprovider.provider == PROVIDER_K3D:
-        kg.resources().persistentvolumeclaimprofile_add('default', KRPersistentVolumeClaimProfile_Basic(allow_selector=False))
-    else:
-        kg.resources().persistentvolumeclaimprofile_add('default', KRPersistentVolumeClaimProfile_Basic())
-
-    kg.resources().persistentvolume_add('prometheus-storage', 'default', {
-        'hostPath': {
-            'path': '/var/storage/prometheus'
+        'echo': {
+            'replicas': 1,
+            'resources': None,
         },
-        'csi': {
-            'fsType': 'ext4',
+        'prometheus': {
+            'resources': None,
+            'retention': None,
+            'storage': '50Gi',
         },
-    }, {
-        'metadata': {
-            'labels': {
-                'pv.role': 'prometheus',
-            },
+        'grafana': {
+            'resources': None,
         },
-        'spec': {
-            'persistentVolumeReclaimPolicy': 'Retain',
-            'capacity': {
-                'storage': '50Gi'
-            },
-            'accessModes': ['ReadWriteOnce'],
+        'kube-state-metrics': {
+            'resources': None,
+            'shards': 1,
         },
-    })
+        'node-exporter': {
+            'resources': None,
+        },
+    },
+    'small': {
+        'traefik': {
+            'resources': guaranteed_resources('250m', '128Mi'),
+        },
+        'echo': {
+            'replicas': 1,
+            'resources': guaranteed_resources('50m', '64Mi'),
+        },
+        'prometheus': {
+            'resources': guaranteed_resources('500m', '1Gi'),
+            'retention': '7d',
+            'storage': '20Gi',
+        },
+        'grafana': {
+            'resources': guaranteed_resources('100m', '128Mi'),
+        },
+        'kube-state-metrics': {
+            'resources': guaranteed_resources('100m', '128Mi'),
+            'shards': 1,
+        },
+        'node-exporter': {
+            'resources': guaranteed_resources('50m', '64Mi'),
+        },
+    },
+    'medium': {
+        'traefik': {
+            'resources': guaranteed_resources('500m', '256Mi'),
+        },
+        'echo': {
+            'replicas': 2,
+            'resources': guaranteed_resources('100m', '64Mi'),
+        },
+        'prometheus': {
+            'resources': guaranteed_resources('1', '4Gi'),
+            'retention': '15d',
+            'storage': '50Gi',
+        },
+        'grafana': {
+            'resources': guaranteed_resources('250m', '256Mi'),
+        },
+        'kube-state-metrics': {
+            'resources': guaranteed_resources('200m', '256Mi'),
+            'shards': 1,
+        },
+        'node-exporter': {
+            'resources': guaranteed_resources('100m', '64Mi'),
+        },
+    },
+    'large': {
+        'traefik': {
+            'resources': guaranteed_resources('1', '512Mi'),
+        },
+        'echo': {
+            'replicas': 3,
+            'resources': guaranteed_resources('200m', '128Mi'),
+        },
+        'prometheus': {
+            'resources': guaranteed_resources('4', '16Gi'),
+            'retention': '30d',
+            'storage': '200Gi',
+        },
+        'grafana': {
+            'resources': guaranteed_resources('500m', '512Mi'),
+        },
+        'kube-state-metrics': {
+            'resources': guaranteed_resources('500m', '1Gi'),
+            'shards': 3,
+        },
+        'node-exporter': {
+            'resources': guaranteed_resources('200m', '128Mi'),
+        },
+    },
+}
+
+
+#
+# Node exporter collector sets. The default set uses the node exporter default collectors.
+#
+NODE_EXPORTER_COLLECTORS = {
+    'default': None,
+    'minimal': {
+        # --collector.disable-defaults needs node exporter 1.1
+        'image': 'prom/node-exporter:v1.1.2',
+        # collectors used by the usual node dashboards
+        'collectors': ['cpu', 'diskstats', 'filesystem', 'loadavg', 'meminfo', 'netdev', 'stat', 'time', 'uname',
+                       'vmstat'],
+    },
+}
+
+
+def kube_state_metrics_shard(deployment, shard, total_shards):
+    """
+    Creates the Deployment of a kube-state-metrics shard from the one built by PrometheusStackBuilder.
+    """
+    ret = copy.deepcopy(deployment)
+    ret['metadata']['name'] = '{}-shard-{}'.format(deployment['metadata']['name'], shard)
+    ret['spec']['selector']['matchLabels']['shard'] = QuotedStr(str(shard))
+    ret['spec']['template']['metadata']['labels']['shard'] = QuotedStr(str(shard))
+    container = ret['spec']['template']['spec']['containers'][0]
+    container['args'] = list(DataGetValue(container.get('args')) or []) + [
+        '--shard={}'.format(shard),
+        '--total-shards={}'.format(total_shards),
+    ]
+    return ret
+
+
+#
+# Grafana dashboard packing: how the provisioned dashboards are stored in ConfigMaps
+#
+DASHBOARD_PACKINGS = {
+    'default': None,
+    'minify': {
+        'gzip': False,
+        # the "kubectl apply" last-applied annotation is limited to 256KiB
+        'max_size': 250000,
+    },
+    'gzip': {
+        'gzip': True,
+        'max_size': 250000,
+    },
+}
+
+
+def grafana_dashboard_configmaps(configmap, packing):
+    """
+    Minifies the dashboards of a ConfigMap built by PrometheusStackBuilder, optionally compressing them to
+    ```binaryData```, and splits them in ConfigMaps below the packing size budget.
+    """
+    items = {}
+    for key, value in configmap['data'].items():
+        dashboard = json.dumps(json.loads(value), separators=(',', ':'))
+        if packing['gzip']:
+            items['{}.gz'.format(key)] = base64.b64encode(
+                gzip.compress(dashboard.encode('utf-8'), mtime=0)).decode('ascii')
+        else:
+            items[key] = dashboard
+
+    parts = [{}]
+    for key, value in items.items():
+        if len(parts[-1]) > 0 and sum(len(v) for v in parts[-1].values()) + len(value) > packing['max_size']:
+            parts.append({})
+        parts[-1][key] = value
+
+    ret = []
+    for idx, part in enumerate(parts):
+        part_configmap = copy.deepcopy(configmap)
+        if idx > 0:
+            part_configmap['metadata']['name'] = '{}-{}'.format(configmap['metadata']['name'], idx)
+        del part_configmap['data']
+        part_configmap['binaryData' if packing['gzip'] else 'data'] = part
+        ret.append(part_configmap)
+    return ret
+
+
+def grafana_dashboard_deployment(deployment, dashboard_configmaps, packing):
+    """
+    Mounts the ConfigMaps created by grafana_dashboard_configmaps in the Grafana Deployment built by
+    PrometheusStackBuilder, as a projected volume. Compressed dashboards are decompressed by an init container.
+    """
+    ret = copy.deepcopy(deployment)
+    podspec = ret['spec']['template']['spec']
+    container = podspec['containers'][0]
+
+    volumes = []
+    for volume in podspec['volumes']:
+        volume = DataGetValue(volume)
+        if 'configMap' not in volume or volume['configMap']['name'] not in dashboard_configmaps:
+            volumes.append(volume)
+            continue
+
+        paths = {item['key']: item['path'] for item in volume['configMap']['items']}
+        sources = []
+        for configmap in dashboard_configmaps[volume['configMap']['name']]:
+            sources.append({
+                'configMap': {
+                    'name': configmap['metadata']['name'],
+                    'items': [{
+                        'key': key,
+                        'path': '{}.gz'.format(paths[key[:-3]]) if packing['gzip'] else paths[key],
+                    } for key in configmap['binaryData' if packing['gzip'] else 'data']],
+                },
+            })
 
-    kg.resources().persistentvolumeclaim_add('prometheus-storage-claim', 'default', {
-        'namespace': 'monitoring',
-        'persistentVolume': 'prometheus-storage',
-    }, {
-        'spec': {
-            'selector': {
-                'matchLabels': {
-                    'pv.role': 'prometheus',
-                }
+        if not packing['gzip']:
+            volumes.append({
+                'name': volume['name'],
+                'projected': {
+                    'sources': sources,
+                },
+            })
+            continue
+
+        mount_path = next(DataGetValue(mount)['mountPath'] for mount in container['volumeMounts']
+                          if DataGetValue(mount)['name'] == volume['name'])
+        volumes.extend([{
+            'name': volume['name'],
+            'emptyDir': {},
+        }, {
+            'name': '{}-gz'.format(volume['name']),
+            'projected': {
+                'sources': sources,
             },
+        }])
+        init_container = {
+            'name': '{}-gunzip'.format(volume['name']),
+            'image': 'busybox:1.32',
+            'command': ['sh', '-c', 'for f in /gz/*.gz; do gunzip -c "$f" > "{}/$(basename "$f" .gz)"; done'.format(
+                mount_path)],
+            'volumeMounts': [{
+                'name': '{}-gz'.format(volume['name']),
+                'mountPath': '/gz',
+            }, {
+                'name': volume['name'],
+                'mountPath': mount_path,
+            }],
         }
-    })
-
-    out = OutputProject(kg)
-
-    shell_script = OutputFile_ShellScript('create_{}.sh'.format(args.provider))
-    out.append(shell_script)
-
-    shell_script.append('set -e')
-
-    #
-    # Provider setup
-    #
-    if kgprovider.provider == PROVIDER_K3D:
-        storage_directory = os.path.join(os.getcwd(), 'output', 'storage')
-        if not os.path.exists(storage_directory):
-            os.makedirs(storage_directory)
-        shell_script.append(f'# k3d cluster create kgsample-prometheus-stack --port 5051:80@loadbalancer --port 5052:443@loadbalancer -v {storage_directory}:/var/storage')
-
-    #
-    # OUTPUTFILE: namespace.yaml
-    #
-    file = OutputFile_Kubernetes('namespace.yaml')
-    file.append([{
-        'apiVersion': 'v1',
-        'kind': 'Namespace',
-        'metadata': {
-            'name': 'monitoring',
+        if DataGetValue(container.get('resources')) is not None:
+            # init containers must also have resources for the pod to have the Guaranteed QoS class
+            init_container['resources'] = container['resources']
+        podspec['initContainers'] = podspec.get('initContainers', []) + [init_container]
+
+    podspec['volumes'] = volumes
+    return ret
+
+
+def fetch_dashboard(dashboard: GrafanaDashboardSource) -> GrafanaDashboardSource_Str:
+    """
+    Downloads a Grafana dashboard source from an URL or grafana.com, like the GrafanaBuilder, returning it as a
+    GrafanaDashboardSource_Str, so it can be downloaded while the other objects are built.
+    """
+    if isinstance(dashboard, GrafanaDashboardSource_GNet):
+        url = 'https://grafana.com/api/dashboards/{}/revisions/{}/download'.format(dashboard.gnetId, dashboard.revision)
+    elif isinstance(dashboard, GrafanaDashboardSource_Url):
+        url = dashboard.url
+    else:
+        raise InvalidParamError('Unsupported dashboard source: "{}"'.format(repr(dashboard)))
+    try:
+        with urllib.request.urlopen(url) as u:
+            source = u.read().decode('utf-8')
+    except Exception as e:
+        raise InvalidParamError('Error downloading url: {}'.format(str(e))) from e
+    if isinstance(dashboard, GrafanaDashboardSource_GNet) and dashboard.datasource is not None:
+        source = re.sub(r'"datasource":.*,', '"datasource": "{}",'.format(dashboard.datasource), source)
+    return GrafanaDashboardSource_Str(provider=dashboard.provider, name=dashboard.name, source=source)
+
+
+#
+# Load generator profiles, used to benchmark the stack
+#
+LOAD_PROFILES = {
+    'default': None,
+    'light': {
+        'metrics': {
+            'replicas': 1,
+            # series per replica: metric_count * series_count
+            'metric_count': 100,
+            'series_count': 100,
         },
-    }])
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
-
-    #
-    # OUTPUTFILE: storage.yaml
-    #
-    file = OutputFile_Kubernetes('storage.yaml')
-
-    file.append(kg.persistentvolume_build())
-    file.append(kg.persistentvolumeclaim_build())
-
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
-
-    #
-    # SETUP: Traefik 2
-    #
-    traefik2_config = Traefik2Builder(kubragen=kg, options=Traefik2Options({
-            'namespace': OptionRoot('namespaces.default'),
-            'config': {
-                'traefik_args': [
-                    '--api.dashboard=true',
-                    '--api.insecure=false',
-                    '--entrypoints.web.Address=:80',
-                    '--entrypoints.api.Address=:8080',
-                    '--entryPoints.metrics.address=:9090',
-                    '--metrics.prometheus=true',
-                    '--metrics.prometheus.entryPoint=metrics',
-                    '--metrics.prometheus.addEntryPointsLabels=true',
-                    '--providers.kubernetescrd',
-                    f'--providers.kubernetescrd.namespaces=default,monitoring'
-                ],
-                'ports': [
-                    Traefik2OptionsPort(name='web', port_container=80, port_service=80),
-                    Traefik2OptionsPort(name='api', port_container=8080, port_service=8080),
-                    Traefik2OptionsPort(name='metrics', port_container=9090, in_service=False),
-                ],
-                'create_traefik_crd': True,
-                'prometheus_port': 9090,
-                'prometheus_annotation': True,
-            },
-        })
-    )
-
-    traefik2_config.ensure_build_names(traefik2_config.BUILD_CRD, traefik2_config.BUILD_ACCESSCONTROL,
-                                       traefik2_config.BUILD_SERVICE)
-
-    #
-    # OUTPUTFILE: traefik-config-crd.yaml
-    #
-    file = OutputFile_Kubernetes('traefik-config-crd.yaml')
-
-    file.append(traefik2_config.build(traefik2_config.BUILD_CRD))
-
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
-
-    #
-    # OUTPUTFILE: traefik-config.yaml
-    #
-    file = OutputFile_Kubernetes('traefik-config.yaml')
-
-    file.append(traefik2_config.build(traefik2_config.BUILD_ACCESSCONTROL))
-
-    file.append([{
-        'apiVersion': 'traefik.containo.us/v1alpha1',
-        'kind': 'IngressRoute',
-        'metadata': {
-            'name': 'traefik-api',
-            'namespace': kg.option_get('namespaces.default'),
+        'http': {
+            'rps': 50,
+            'concurrency': 5,
+            'duration': '5m',
         },
-        'spec': {
-            'entryPoints': ['api'],
-            'routes': [{
-                'match': 'Method(`GET`)',
-                'kind': 'Rule',
-                'services': [{
-                    'name': 'api@internal',
-                    'kind': 'TraefikService'
-                }]
-            }]
-        }
-    }])
-
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
-
-    #
-    # OUTPUTFILE: traefik.yaml
-    #
-    file = OutputFile_Kubernetes('traefik.yaml')
-
-    file.append(traefik2_config.build(traefik2_config.BUILDITEM_SERVICE))
+    },
+    'heavy': {
+        'metrics': {
+            'replicas': 4,
+            # series per replica: metric_count * series_count
+            'metric_count': 500,
+            'series_count': 200,
+        },
+        'http': {
+            'rps': 1000,
+            'concurrency': 50,
+            'duration': '10m',
+        },
+    },
+}
+
+
+#
+# Dashboards of the log pipelines of the loki_stack and efk_stack samples generated with --self-monitoring
+#
+PIPELINE_DASHBOARDS = {
+    'loki': {
+        'title': 'Loki pipeline',
+        'panels': [
+            ('Promtail entries sent/s', 'sum(rate(promtail_sent_entries_total[1m]))'),
+            ('Promtail entries dropped/s', 'sum(rate(promtail_dropped_entries_total[1m]))'),
+            ('Promtail send p99 latency',
+             'histogram_quantile(0.99, sum(rate(promtail_request_duration_seconds_bucket[1m])) by (le))'),
+            ('Loki lines received/s', 'sum(rate(loki_distributor_lines_received_total[1m]))'),
+            ('Loki bytes received/s', 'sum(rate(loki_distributor_bytes_received_total[1m]))'),
+            ('Loki discarded samples/s', 'sum(rate(loki_discarded_samples_total[1m])) by (reason)'),
+            ('Loki push p99 latency', 'histogram_quantile(0.99, sum(rate('
+                                      'loki_request_duration_seconds_bucket{route="loki_api_v1_push"}[1m])) by (le))'),
+            ('Loki in-memory streams', 'sum(loki_ingester_memory_streams)'),
+        ],
+    },
+    'efk': {
+        'title': 'EFK pipeline',
+        'panels': [
+            ('Fluentd records emitted/s', 'sum(rate(fluentd_output_status_emit_records[1m]))'),
+            ('Fluentd retries/s', 'sum(rate(fluentd_output_status_retry_count[1m]))'),
+            ('Fluentd buffer queue length', 'sum(fluentd_output_status_buffer_queue_length) by (kubernetes_pod_name)'),
+            ('Fluentd buffer size', 'sum(fluentd_output_status_buffer_total_bytes) by (kubernetes_pod_name)'),
+            ('Elasticsearch documents indexed/s', 'sum(rate(elasticsearch_indices_indexing_index_total[1m]))'),
+            ('Elasticsearch write rejections/s',
+             'sum(rate(elasticsearch_thread_pool_rejected_count{type="write"}[1m]))'),
+            ('Elasticsearch write queue', 'sum(elasticsearch_thread_pool_queue_count{type="write"}) by (name)'),
+            ('Elasticsearch heap used', 'sum(elasticsearch_jvm_memory_used_bytes{area="heap"}) by (name)'),
+        ],
+    },
+}
+
+
+def arg_parser():
+    """
+    Returns the command line parser of the sample.
+    """
+    parser = sample.arg_parser(SIZE_PRESETS, LOAD_PROFILES)
+    parser.add_argument('--ksm-shards', help='kube-state-metrics shards', type=int)
+    parser.add_argument('--node-exporter-collectors', help='node exporter collector set', default='default',
+                        choices=list(NODE_EXPORTER_COLLECTORS))
+    parser.add_argument('--pipeline-dashboards', help='add the dashboards of a log pipeline sample', action='append',
+                        default=[], choices=list(PIPELINE_DASHBOARDS))
+    parser.add_argument('--loki-datasource', help='add the Loki of loki_stack as a Grafana datasource',
+                        action='store_true')
+    parser.add_argument('--dashboard-packing', help='grafana dashboard packing', default='default',
+                        choices=list(DASHBOARD_PACKINGS))
+    return parser
+
+
+def build(args):
+    """
+    Builds the sample from the parsed command line arguments, without saving it.
+
+    :return: a (KubraGen, OutputProject) tuple
+    """
+    kgprovider = sample.kubragen_provider(args.provider)
+
+    size_preset = SIZE_PRESETS[args.size]
+    rollout_profile = ROLLOUT_PROFILES[args.rollout]
+    placement = PLACEMENT_PROFILES[args.placement]
+    load_profile = LOAD_PROFILES[args.load]
+    ksm_shards = args.ksm_shards if args.ksm_shards is not None else size_preset['kube-state-metrics']['shards']
+    node_exporter_collectors = NODE_EXPORTER_COLLECTORS[args.node_exporter_collectors]
+    dashboard_packing = DASHBOARD_PACKINGS[args.dashboard_packing]
+    storage_tier = STORAGE_TIERS[args.storage_tier]
+    if storage_tier is not None:
+        storage_tier = storage_tier[kgprovider.provider]
+
+    build_cache = None
+    if not args.no_cache:
+        build_cache = BuildCache()
 
-    file.append({
-        'apiVersion': 'traefik.containo.us/v1alpha1',
-        'kind': 'IngressRoute',
-        'metadata': {
-            'name': 'admin-traefik',
-            'namespace': kg.option_get('namespaces.default'),
+    kg = KubraGen(provider=kgprovider, options=Options({
+        'namespaces': {
+            'default': 'default',
+            'mon': 'monitoring',
         },
-        'spec': {
-            'entryPoints': ['web'],
-            'routes': [{
-                'match': f'Host(`admin-traefik.localdomain`)',
-                'kind': 'Rule',
-                'services': [{
-                    'name': traefik2_config.object_name('service'),
-                    'port': 8080
-                }],
-            }]
-        }
-    })
+    }))
 
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+    # the dashboards are downloaded concurrently, while the other objects are built
+    dashboard_executor = ThreadPoolExecutor(max_workers=4)
+    dashboard_futures = [dashboard_executor.submit(fetch_dashboard, dashboard) for dashboard in [
+        GrafanaDashboardSource_GNet(provider='default', name='prometheus', gnetId=2, revision=2,
+                                    datasource='Prometheus'),
+        GrafanaDashboardSource_Url(provider='default', name='kubernetes',
+                                   url='https://raw.githubusercontent.com/zaneclaes/grafana-dashboards/master/kubernetes.json'),
+    ]]
+    try:
+        sample.storage_profiles(kg)
+        if storage_tier is not None:
+            sample.storage_class_add(kg, storage_tier)
+        sample.storage_claim_add(kg, 'prometheus', storage_tier, size_preset['prometheus']['storage'],
+                                 sample.storage_disk(args, 'prometheus'))
+
+        out = OutputProject(kg)
+
+        shell_script = OutputFile_ShellScript('create_{}.sh'.format(args.provider))
+        out.append(shell_script)
+
+        shell_script.append('set -e')
+
+        #
+        # Provider setup
+        #
+        sample.cluster_setup(kg, out, shell_script, args, 'kgsample-prometheus-stack', placement)
+
+        #
+        # OUTPUTFILE: namespace.yaml
+        #
+        sample.namespace_file(out, shell_script, placement)
+
+        #
+        # OUTPUTFILE: prepull.yaml
+        #
+        images_file = None
+        prepull_file = None
+        if args.prepull:
+            # filled after all other files, with the images they use
+            images_file, prepull_file = sample.image_prepull_files(kg, out, shell_script, 'kgsample-prometheus-stack')
+
+        #
+        # OUTPUTFILE: storage.yaml
+        #
+        sample.storage_file(kg, out, shell_script)
+
+        #
+        # SETUP: Traefik 2
+        #
+        traefik2_config, traefik_transport_name = traefik_files(kg, out, shell_script, args, size_preset, placement,
+                                                                build_cache)
+
+        grafana_dashboards = [future.result() for future in dashboard_futures]
+    finally:
+        # also waits for the downloads if the build failed, so no threads are left running
+        dashboard_executor.shutdown(wait=True)
 
     #
     # SETUP: prometheusstack
     #
+    for pipeline in args.pipeline_dashboards:
+        # the log pipeline pods are scraped through their prometheus.io annotations, in any namespace
+        grafana_dashboards.append(GrafanaDashboardSource_Str(
+            provider='default', name='{}-pipeline'.format(pipeline), source=graph_dashboard(
+                PIPELINE_DASHBOARDS[pipeline]['title'], 'kgsample-{}-pipeline'.format(pipeline), 'Prometheus',
+                PIPELINE_DASHBOARDS[pipeline]['panels'])))
+    if load_profile is not None:
+        grafana_dashboards.append(GrafanaDashboardSource_Str(provider='default', name='load', source=graph_dashboard(
+            'Load generators', 'kgsample-load', 'Prometheus', [
+                ('Samples ingested/s', 'rate(prometheus_tsdb_head_samples_appended_total[1m])'),
+                ('Head series', 'prometheus_tsdb_head_series'),
+                ('Load generator scrape duration', 'scrape_duration_seconds{app="metrics-generator"}'),
+                ('Rule group duration', 'prometheus_rule_group_last_duration_seconds'),
+                ('Traefik web requests/s', 'sum(rate(traefik_entrypoint_requests_total{entrypoint="web"}[1m])) by (code)'),
+                ('Traefik web p99 latency', 'histogram_quantile(0.99, sum(rate('
+                                            'traefik_entrypoint_request_duration_seconds_bucket{entrypoint="web"}[1m])) by (le))'),
+            ])))
+
     pstack_config = PrometheusStackBuilder(kubragen=kg, options=PrometheusStackOptions({
         'namespace': OptionRoot('namespaces.mon'),
         'config': {
@@ -273,7 +527,13 @@ def main():
                         'type': 'prometheus',
                         'access': 'proxy',
                         'url': 'http://{}:{}'.format('prometheus', 80),
-                    }],
+                    }] + ([{
+                        # the service of loki_stack, on the same namespace
+                        'name': 'Loki',
+                        'type': 'loki',
+                        'access': 'proxy',
+                        'url': 'http://{}:{}'.format('loki', 80),
+                    }] if args.loki_datasource else []),
                     'dashboards': [
                         {
                             'name': 'default',
@@ -281,12 +541,7 @@ def main():
                         },
                     ],
                 },
-                'dashboards': [
-                    GrafanaDashboardSource_GNet(provider='default', name='prometheus', gnetId=2, revision=2,
-                                                datasource='Prometheus'),
-                    GrafanaDashboardSource_Url(provider='default', name='kubernetes',
-                                               url='https://raw.githubusercontent.com/zaneclaes/grafana-dashboards/master/kubernetes.json'),
-                ],
+                'dashboards': grafana_dashboards,
                 'admin': {
                     'user': 'myuser',
                     'password': 'mypassword',
@@ -295,17 +550,65 @@ def main():
         },
         'kubernetes': {
             'volumes': {
-                'prometheus-data': {
-                    'persistentVolumeClaim': {
-                        'claimName': 'prometheus-storage-claim'
-                    }
-                }
+                'prometheus-data': sample.storage_volume('prometheus', storage_tier,
+                                                         size_preset['prometheus']['storage']),
+            },
+            'resources': {
+                'prometheus-statefulset': size_preset['prometheus']['resources'],
+                'kube-state-metrics-deployment': size_preset['kube-state-metrics']['resources'],
+                'node-exporter-daemonset': size_preset['node-exporter']['resources'],
+                'grafana-deployment': size_preset['grafana']['resources'],
             },
         },
     })).object_names_change({
         'prometheus-service': 'prometheus',
     })
 
+    pstack_jsonpatches = []
+    if size_preset['prometheus']['retention'] is not None:
+        pstack_jsonpatches.append(FilterJSONPatch(filters={'names': [pstack_config.BUILDITEM_PROMETHEUS_STATEFULSET]}, patches=[
+            {'op': 'add', 'path': '/spec/template/spec/containers/0/args/-',
+             'value': '--storage.tsdb.retention.time={}'.format(size_preset['prometheus']['retention'])},
+        ]))
+    if size_preset['prometheus']['resources'] is not None:
+        # init containers must also have resources for the pod to have the Guaranteed QoS class
+        pstack_jsonpatches.append(FilterJSONPatch(filters={'names': [pstack_config.BUILDITEM_PROMETHEUS_STATEFULSET]}, patches=[
+            {'op': 'add', 'path': '/spec/template/spec/initContainers/0/resources',
+             'value': size_preset['prometheus']['resources']},
+        ]))
+    if rollout_profile['parallel']:
+        pstack_jsonpatches.append(FilterJSONPatch(filters={'names': [pstack_config.BUILDITEM_PROMETHEUS_STATEFULSET]}, patches=[
+            {'op': 'add', 'path': '/spec/podManagementPolicy', 'value': 'Parallel'},
+        ]))
+    if rollout_profile['startup'] is not None:
+        pstack_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [pstack_config.BUILDITEM_PROMETHEUS_STATEFULSET]},
+            patches=rollout_probe_patches(rollout_profile, {'path': '/-/ready', 'port': 9090})))
+        pstack_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [pstack_config.BUILDITEM_GRAFANA_DEPLOYMENT]},
+            patches=rollout_probe_patches(rollout_profile, {'path': '/api/health', 'port': 3000})))
+    if node_exporter_collectors is not None:
+        pstack_jsonpatches.append(FilterJSONPatch(filters={'names': [pstack_config.BUILDITEM_NODEEXPORTER_DAEMONSET]}, patches=[
+            {'op': 'replace', 'path': '/spec/template/spec/containers/0/image', 'value': node_exporter_collectors['image']},
+            *[{'op': 'add', 'path': '/spec/template/spec/containers/0/args/-', 'value': arg}
+              for arg in ['--collector.disable-defaults'] + ['--collector.{}'.format(collector)
+                                                             for collector in node_exporter_collectors['collectors']]],
+        ]))
+    if placement is not None:
+        pstack_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [pstack_config.BUILDITEM_PROMETHEUS_STATEFULSET]},
+            patches=placement_patches(placement, 'monitoring', NODE_POOL_LABELS[kgprovider.provider])))
+        pstack_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [pstack_config.BUILDITEM_GRAFANA_DEPLOYMENT]},
+            patches=placement_patches(placement, 'monitoring', NODE_POOL_LABELS[kgprovider.provider])))
+        pstack_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [pstack_config.BUILDITEM_KUBESTATEMETRICS_DEPLOYMENT]},
+            patches=placement_patches(placement, 'monitoring', NODE_POOL_LABELS[kgprovider.provider])))
+        pstack_jsonpatches.append(FilterJSONPatch(
+            filters={'names': [pstack_config.BUILDITEM_NODEEXPORTER_DAEMONSET]},
+            patches=placement_patches(placement, 'monitoring', NODE_POOL_LABELS[kgprovider.provider], daemonset=True)))
+    pstack_config.jsonpatches(pstack_jsonpatches)
+
     pstack_config.ensure_build_names(pstack_config.BUILD_ACCESSCONTROL, pstack_config.BUILD_CONFIG,
                                      pstack_config.BUILD_SERVICE)
 
@@ -315,7 +618,17 @@ def main():
     file = OutputFile_Kubernetes('prometheus-config.yaml')
     out.append(file)
 
-    file.append(pstack_config.build(pstack_config.BUILD_ACCESSCONTROL, pstack_config.BUILD_CONFIG))
+    pstack_config_objects = cached_build(build_cache, pstack_config, pstack_config.BUILD_ACCESSCONTROL,
+                                         pstack_config.BUILD_CONFIG)
+    dashboard_configmaps = {}
+    if dashboard_packing is not None:
+        for o in pstack_config_objects:
+            if o.name.startswith('grafana-config-dashboard-'):
+                dashboard_configmaps[o['metadata']['name']] = grafana_dashboard_configmaps(o, dashboard_packing)
+        pstack_config_objects = [configmap for o in pstack_config_objects
+                                 for configmap in (dashboard_configmaps[o['metadata']['name']]
+                                                   if o.name.startswith('grafana-config-dashboard-') else [o])]
+    file.append(pstack_config_objects)
 
     shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
 
@@ -325,7 +638,17 @@ def main():
     file = OutputFile_Kubernetes('prometheus.yaml')
     out.append(file)
 
-    file.append(pstack_config.build(pstack_config.BUILD_SERVICE))
+    pstack_objects = cached_build(build_cache, pstack_config, pstack_config.BUILD_SERVICE)
+    if ksm_shards > 1:
+        # each shard pod is scraped separately by the kubernetes-pods job, through the prometheus.io annotations
+        # copied from the Deployment, with its shard label
+        pstack_objects = [shard_object for o in pstack_objects
+                          for shard_object in ([kube_state_metrics_shard(o, shard, ksm_shards) for shard in range(ksm_shards)]
+                                               if o.name == pstack_config.BUILDITEM_KUBESTATEMETRICS_DEPLOYMENT else [o])]
+    if dashboard_packing is not None:
+        pstack_objects = [grafana_dashboard_deployment(o, dashboard_configmaps, dashboard_packing)
+                          if o.name == pstack_config.BUILDITEM_GRAFANA_DEPLOYMENT else o for o in pstack_objects]
+    file.append(pstack_objects)
 
     file.append([{
         'apiVersion': 'traefik.containo.us/v1alpha1',
@@ -343,6 +666,7 @@ def main():
                     'name': pstack_config.object_name('prometheus-service'),
                     'namespace': pstack_config.namespace(),
                     'port': pstack_config.option_get('config.prometheus.service_port'),
+                    'serversTransport': ValueData(value=traefik_transport_name, disabled_if_none=True),
                 }],
             }]
         }
@@ -362,6 +686,7 @@ def main():
                     'name': pstack_config.object_name('grafana-service'),
                     'namespace': pstack_config.namespace(),
                     'port': pstack_config.option_get('config.grafana.service_port'),
+                    'serversTransport': ValueData(value=traefik_transport_name, disabled_if_none=True),
                 }],
             }]
         }
@@ -369,148 +694,41 @@ def main():
 
     shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
 
+
     #
     # OUTPUTFILE: http-echo.yaml
     #
-    file = OutputFile_Kubernetes('http-echo.yaml')
-    out.append(file)
-
-    file.append([{
-        'apiVersion': 'apps/v1',
-        'kind': 'Deployment',
-        'metadata': {
-            'name': 'echo-deployment',
-            'namespace': kg.option_get('namespaces.default'),
-            'labels': {
-                'app': 'echo'
-            }
-        },
-        'spec': {
-            'replicas': 1,
-            'selector': {
-                'matchLabels': {
-                    'app': 'echo'
-                }
-            },
-            'template': {
-                'metadata': {
-                    'labels': {
-                        'app': 'echo'
-                    }
-                },
-                'spec': {
-                    'containers': [{
-                        'name': 'echo',
-                        'image': 'mendhak/http-https-echo',
-                        'ports': [{
-                            'containerPort': 80
-                        },
-                        {
-                            'containerPort': 443
-                        }],
-                    }]
-                }
-            }
-        }
-    },
-    {
-        'apiVersion': 'v1',
-        'kind': 'Service',
-        'metadata': {
-            'name': 'echo-service',
-            'namespace': kg.option_get('namespaces.default'),
-        },
-        'spec': {
-            'selector': {
-                'app': 'echo'
-            },
-            'ports': [{
-                'name': 'http',
-                'port': 80,
-                'targetPort': 80,
-                'protocol': 'TCP'
-            }]
-        }
-    }, {
-        'apiVersion': 'traefik.containo.us/v1alpha1',
-        'kind': 'IngressRoute',
-        'metadata': {
-            'name': 'http-echo',
-            'namespace': kg.option_get('namespaces.default'),
-        },
-        'spec': {
-            'entryPoints': ['web'],
-            'routes': [{
-                # 'match': f'Host(`http-echo.localdomain`)',
-                'match': f'PathPrefix(`/`)',
-                'kind': 'Rule',
-                'services': [{
-                    'name': 'echo-service',
-                    'port': 80,
-                }],
-            }]
-        }
-    }])
-
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+    sample.http_echo_file(kg, out, shell_script, size_preset, traefik_transport_name)
 
     #
     # OUTPUTFILE: ingress.yaml
     #
-    file = OutputFile_Kubernetes('ingress.yaml')
-    http_path = '/'
-    if kgprovider.provider == PROVIDER_GOOGLE or kgprovider.provider == PROVIDER_AMAZON:
-        http_path = '/*'
-
-    file_data = [
-        Object({
-            'apiVersion': 'extensions/v1beta1',
-            'kind': 'Ingress',
-            'metadata': {
-                'name': 'ingress',
-                'namespace': kg.option_get('namespaces.default'),
-            },
-            'spec': {
-                'rules': [{
-                    'http': {
-                        'paths': [{
-                            'path': http_path,
-                            'backend': {
-                                'serviceName': traefik2_config.object_name('service'),
-                                'servicePort': 80,
-                            }
-                        }]
-                    }
-                }]
-            }
-        }, name='ingress', source='app', instance='ingress')
-    ]
+    sample.ingress_file(kg, out, shell_script, args, traefik2_config)
 
-    if kgprovider.provider == PROVIDER_AMAZON:
-        FilterJSONPatches_Apply(file_data, jsonpatches=[
-            FilterJSONPatch(filters={'names': ['ingress']}, patches=[
-                {'op': 'merge', 'path': '/metadata', 'value': {'annotations': {
-                    'kubernetes.io/ingress.class': 'alb',
-                    'alb.ingress.kubernetes.io/scheme': 'internet-facing',
-                    'alb.ingress.kubernetes.io/listen-ports': QuotedStr('[{"HTTP": 80}]'),
-                }}}
-            ])
+    #
+    # OUTPUTFILE: load.yaml
+    #
+    if load_profile is not None:
+        file = OutputFile_Kubernetes('load.yaml')
+        out.append(file)
+
+        file.append([
+            metrics_generator_deployment(kg.option_get('namespaces.default'), load_profile['metrics']),
+            # the requests go through the Traefik web entrypoint to the echo service
+            http_load_job(kg.option_get('namespaces.default'), 'http://{}.{}.svc/'.format(
+                traefik2_config.object_name('service'), traefik2_config.namespace()), load_profile['http']),
         ])
 
-    file.append(file_data)
-    out.append(file)
-    shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
+        shell_script.append(OD_FileTemplate(f'kubectl apply -f ${{FILE_{file.fileid}}}'))
 
-    #
-    # OUTPUT
-    #
-    output_path = os.path.join(args.output_path, '{}-{}'.format(
-        args.provider, datetime.datetime.today().strftime("%Y%m%d-%H%M%S")))
-    print('Saving files to {}'.format(output_path))
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
+    if images_file is not None:
+        sample.image_prepull_fill(out, images_file, prepull_file)
+
+    return kg, out
 
-    out.output(OutputDriver_Directory(output_path))
+
+def main():
+    sample.main(arg_parser(), build)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,175 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('kubernetes')
+
+from kgsamples.apply import KubernetesApplier, APPLY_APPLIED, APPLY_UNCHANGED
+
+CORE_RESOURCES = [
+    {'name': 'namespaces', 'kind': 'Namespace', 'namespaced': False},
+    {'name': 'configmaps', 'kind': 'ConfigMap', 'namespaced': True},
+]
+CRD_RESOURCES = [
+    {'name': 'customresourcedefinitions', 'kind': 'CustomResourceDefinition', 'namespaced': False},
+]
+WIDGET_RESOURCES = [
+    {'name': 'widgets', 'kind': 'Widget', 'namespaced': True},
+]
+
+
+class FakeAPIServer:
+    """
+    Kubernetes API server keeping the applied objects in memory. The ```example.com/v1``` API is only discovered after
+    the Widget CustomResourceDefinition is applied, and after ```crd_delay``` seconds.
+    """
+    def __init__(self, crd_delay=0.0):
+        self.crd_delay = crd_delay
+        self.crd_applied = None
+        self.objects = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                with server.lock:
+                    server.requests.append(('GET', path))
+                    crd_applied = server.crd_applied
+                    obj = server.objects.get(path)
+                if path == '/api/v1':
+                    self._send(200, {'resources': CORE_RESOURCES})
+                elif path == '/apis/apiextensions.k8s.io/v1':
+                    self._send(200, {'resources': CRD_RESOURCES})
+                elif path == '/apis/example.com/v1':
+                    if crd_applied is None or time.monotonic() < crd_applied + server.crd_delay:
+                        self._send(404, {'kind': 'Status', 'code': 404})
+                    else:
+                        self._send(200, {'resources': WIDGET_RESOURCES})
+                elif obj is not None:
+                    self._send(200, obj)
+                else:
+                    self._send(404, {'kind': 'Status', 'code': 404})
+
+            def do_PATCH(self):
+                path = self.path.split('?')[0]
+                obj = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with server.lock:
+                    server.requests.append(('PATCH', path))
+                    status = 200 if path in server.objects else 201
+                    server.objects[path] = obj
+                    if obj['kind'] == 'CustomResourceDefinition':
+                        server.crd_applied = time.monotonic()
+                self._send(status, obj)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def patches(self):
+        with self.lock:
+            return [path for method, path in self.requests if method == 'PATCH']
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _applier(server, tmp_path, monkeypatch, **kwargs):
+    kubeconfig = tmp_path / 'kubeconfig'
+    kubeconfig.write_text(json.dumps({
+        'apiVersion': 'v1',
+        'kind': 'Config',
+        'clusters': [{'name': 'fake', 'cluster': {'server': server.url}}],
+        'users': [{'name': 'fake', 'user': {'token': 'fake'}}],
+        'contexts': [{'name': 'fake', 'context': {'cluster': 'fake', 'user': 'fake'}}],
+        'current-context': 'fake',
+    }))
+    from kubernetes.config import kube_config
+    monkeypatch.setattr(kube_config, 'KUBE_CONFIG_DEFAULT_LOCATION', str(kubeconfig))
+    return KubernetesApplier(**kwargs)
+
+
+def _waves():
+    return [[{
+        'apiVersion': 'v1',
+        'kind': 'Namespace',
+        'metadata': {'name': 'monitoring'},
+    }, {
+        'apiVersion': 'apiextensions.k8s.io/v1',
+        'kind': 'CustomResourceDefinition',
+        'metadata': {'name': 'widgets.example.com'},
+        'spec': {'group': 'example.com'},
+    }], [{
+        'apiVersion': 'example.com/v1',
+        'kind': 'Widget',
+        'metadata': {'name': 'widget', 'namespace': 'monitoring'},
+    }, {
+        'apiVersion': 'v1',
+        'kind': 'ConfigMap',
+        'metadata': {'name': 'config', 'namespace': 'monitoring'},
+        'data': {'key': 'value'},
+    }]]
+
+
+def test_apply_waves_in_order(tmp_path, monkeypatch):
+    with FakeAPIServer() as server:
+        results = _applier(server, tmp_path, monkeypatch).apply(_waves())
+
+    assert [status for obj, status in results] == [APPLY_APPLIED] * 4
+    patches = server.patches()
+    # the custom resource is only applied after its definition, from the previous wave
+    assert patches.index('/apis/example.com/v1/namespaces/monitoring/widgets/widget') > \
+        patches.index('/apis/apiextensions.k8s.io/v1/customresourcedefinitions/widgets.example.com')
+    assert set(patches[:2]) == {'/api/v1/namespaces/monitoring',
+                                '/apis/apiextensions.k8s.io/v1/customresourcedefinitions/widgets.example.com'}
+    assert server.objects['/api/v1/namespaces/monitoring/configmaps/config']['metadata']['annotations'][
+        'kgsamples/applied-hash']
+
+
+def test_apply_skips_unchanged(tmp_path, monkeypatch):
+    with FakeAPIServer() as server:
+        applier = _applier(server, tmp_path, monkeypatch)
+        applier.apply(_waves())
+        patch_count = len(server.patches())
+
+        waves = _waves()
+        results = applier.apply(waves)
+        assert [status for obj, status in results] == [APPLY_UNCHANGED] * 4
+        assert len(server.patches()) == patch_count
+
+        waves[1][1]['data']['key'] = 'changed'
+        results = applier.apply(waves)
+        assert [status for obj, status in results] == [APPLY_UNCHANGED] * 3 + [APPLY_APPLIED]
+        assert server.patches()[patch_count:] == ['/api/v1/namespaces/monitoring/configmaps/config']
+
+
+def test_apply_waits_for_crd_without_blocking(tmp_path, monkeypatch):
+    with FakeAPIServer(crd_delay=1.5) as server:
+        results = _applier(server, tmp_path, monkeypatch, discovery_timeout=10).apply(_waves())
+
+    assert [status for obj, status in results] == [APPLY_APPLIED] * 4
+    # the ConfigMap is applied while the Widget waits for its API to be discovered
+    patches = server.patches()
+    assert patches.index('/api/v1/namespaces/monitoring/configmaps/config') < \
+        patches.index('/apis/example.com/v1/namespaces/monitoring/widgets/widget')
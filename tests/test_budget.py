@@ -0,0 +1,121 @@
+import json
+
+import pytest
+from kubragen import KubraGen
+from kubragen.output import OutputProject, OutputFile_Kubernetes, OutputFile_ShellScript
+from kubragen.provider import Provider_Generic
+
+from kgsamples.budget import BudgetError, DEFAULT_BUDGETS, budget_violations, budgets, parse_budget, size_report
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('object_bytes=512', {'object_bytes': 512}),
+    ('object_bytes=512K', {'object_bytes': 512 * 1000}),
+    ('file_bytes=2Mi', {'file_bytes': 2 * 1024 ** 2}),
+    ('total_bytes=3ki', {'total_bytes': 3 * 1024}),
+    ('total_bytes=1 M', {'total_bytes': 1000 ** 2}),
+    ('total_objects=40', {'total_objects': 40}),
+    ('object_bytes=none', {'object_bytes': None}),
+])
+def test_parse_budget(value, expected):
+    assert parse_budget(value) == expected
+
+
+@pytest.mark.parametrize('value', [
+    'object_bytes',
+    'other=1',
+    'object_bytes=',
+    'object_bytes=1G',
+    'object_bytes=-1',
+    'object_bytes=1.5Mi',
+])
+def test_parse_budget_invalid(value):
+    with pytest.raises(BudgetError):
+        parse_budget(value)
+
+
+def test_budgets():
+    assert budgets() == DEFAULT_BUDGETS
+    assert budgets(['object_bytes=none', 'total_objects=10']) == dict(DEFAULT_BUDGETS, object_bytes=None,
+                                                                       total_objects=10)
+
+
+def _objects():
+    return [{
+        'apiVersion': 'v1',
+        'kind': 'ConfigMap',
+        'metadata': {'name': 'small', 'namespace': 'monitoring'},
+        'data': {'key': 'value'},
+    }, {
+        'apiVersion': 'v1',
+        'kind': 'ConfigMap',
+        'metadata': {'name': 'large', 'namespace': 'monitoring'},
+        'data': {'key': 'x' * 1000},
+    }, {
+        'apiVersion': 'v1',
+        'kind': 'Service',
+        'metadata': {'name': 'service', 'namespace': 'monitoring'},
+        'spec': {'ports': [{'port': 80}]},
+    }]
+
+
+def _project():
+    kg = KubraGen(provider=Provider_Generic())
+    out = OutputProject(kg)
+    out.append(OutputFile_ShellScript('create.sh'))
+    objects = _objects()
+    config_file = OutputFile_Kubernetes('config.yaml')
+    config_file.append(objects[:2])
+    out.append(config_file)
+    service_file = OutputFile_Kubernetes('service.yaml')
+    service_file.append(objects[2:])
+    out.append(service_file)
+    return kg, out
+
+
+def _size(obj):
+    return len(json.dumps(obj, separators=(',', ':')).encode('utf-8'))
+
+
+def test_size_report():
+    report = size_report(*_project())
+    small, large, service = _objects()
+
+    assert report['total_objects'] == 3
+    assert [f['objects'] for f in report['files']] == [2, 1]
+    assert report['total_bytes'] == sum(f['bytes'] for f in report['files'])
+    assert report['kinds'] == {
+        'ConfigMap': {'count': 2, 'bytes': _size(small) + _size(large)},
+        'Service': {'count': 1, 'bytes': _size(service)},
+    }
+    # the objects are sorted by size, largest first
+    assert [o['name'] for o in report['objects']] == ['large', 'service', 'small']
+    assert [o['name'] for o in report['largest']['ConfigMap']] == ['large', 'small']
+    assert 'Service' not in report['largest']
+    assert report['objects'][0] == {
+        'file': report['files'][0]['name'],
+        'kind': 'ConfigMap',
+        'namespace': 'monitoring',
+        'name': 'large',
+        'bytes': _size(large),
+    }
+    # the report is written as JSON
+    json.dumps(report)
+
+
+def test_budget_violations():
+    report = size_report(*_project())
+    large_size = report['objects'][0]['bytes']
+
+    assert budget_violations(report, budgets()) == []
+    assert budget_violations(report, budgets(['object_bytes={}'.format(large_size)])) == []
+
+    violations = budget_violations(report, budgets([
+        'object_bytes={}'.format(large_size - 1),
+        'file_bytes=1',
+        'total_bytes=1',
+        'total_objects=2',
+    ]))
+    assert violations[0].startswith('ConfigMap "large" in ')
+    assert len(violations) == 1 + 2 + 1 + 1
+    assert violations[-1] == 'The output has 3 objects, over the budget of 2'
@@ -0,0 +1,174 @@
+import importlib.util
+import os
+import stat
+import sys
+import time
+
+import pytest
+
+from kgsamples.cache import BuildCache, cached_build
+
+BUILDS = []
+
+
+class FakeBuilder:
+    """
+    Picklable builder returning ```size``` bytes of data, recording its builds.
+    """
+    def __init__(self, name, size=1000):
+        self.name = name
+        self.size = size
+
+    def build(self, *buildnames):
+        BUILDS.append(self.name)
+        return [{'name': self.name, 'buildnames': list(buildnames), 'data': 'x' * self.size}]
+
+
+@pytest.fixture(autouse=True)
+def clear_builds():
+    BUILDS.clear()
+
+
+def _entries(path):
+    return sorted(entry for entry in os.listdir(path) if entry.endswith('.pickle'))
+
+
+def test_cache_hit(tmp_path):
+    cache = BuildCache(path=str(tmp_path / 'cache'))
+    first = cache.build(FakeBuilder('a'), 'service')
+    second = cache.build(FakeBuilder('a'), 'service')
+    assert first == second
+    assert BUILDS == ['a']
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.build(FakeBuilder('a'), 'config')
+    assert BUILDS == ['a', 'a']
+
+
+def test_cache_directory_is_private(tmp_path):
+    cache = BuildCache(path=str(tmp_path / 'cache'))
+    cache.build(FakeBuilder('a'))
+    assert stat.S_IMODE(os.stat(cache.path).st_mode) & 0o077 == 0
+
+
+def test_cache_eviction(tmp_path):
+    cache = BuildCache(path=str(tmp_path / 'cache'), max_size=2500)
+    now = time.time()
+
+    cache.build(FakeBuilder('a'))
+    (entry_a,) = _entries(cache.path)
+    os.utime(os.path.join(cache.path, entry_a), (now - 100, now - 100))
+
+    cache.build(FakeBuilder('b'))
+    (entry_b,) = set(_entries(cache.path)) - {entry_a}
+    os.utime(os.path.join(cache.path, entry_b), (now - 50, now - 50))
+
+    # a hit makes the entry the most recently used
+    cache.build(FakeBuilder('a'))
+    assert BUILDS == ['a', 'b']
+
+    cache.build(FakeBuilder('c'))
+    entries = _entries(cache.path)
+    assert len(entries) == 2
+    assert entry_a in entries and entry_b not in entries
+
+    cache.build(FakeBuilder('b'))
+    assert BUILDS == ['a', 'b', 'c', 'b']
+
+
+def test_cache_clear(tmp_path):
+    cache = BuildCache(path=str(tmp_path / 'cache'))
+    cache.build(FakeBuilder('a'))
+    cache.clear()
+    assert _entries(cache.path) == []
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid') or os.getuid() != 0, reason='changing the owner requires root')
+def test_cache_ignores_entries_of_other_users(tmp_path):
+    cache = BuildCache(path=str(tmp_path / 'cache'))
+    cache.build(FakeBuilder('a'))
+    (entry,) = _entries(cache.path)
+    os.chown(os.path.join(cache.path, entry), os.getuid() + 1, -1)
+
+    cache.build(FakeBuilder('a'))
+    assert BUILDS == ['a', 'a']
+    assert cache.hits == 0
+
+
+def test_cache_unwritable(tmp_path):
+    # the cache path is a file, so the directory can't be created
+    path = tmp_path / 'cache'
+    path.write_text('')
+    cache = BuildCache(path=str(path))
+    assert cache.build(FakeBuilder('a'))[0]['name'] == 'a'
+    assert cache.build(FakeBuilder('a'))[0]['name'] == 'a'
+    assert BUILDS == ['a', 'a']
+
+
+def test_cached_build_without_cache():
+    assert cached_build(None, FakeBuilder('a'), 'service')[0]['buildnames'] == ['service']
+    assert BUILDS == ['a']
+
+
+class UnpicklableBuilder(FakeBuilder):
+    """
+    Builder with state that can't be pickled, like the configuration file extensions of the samples.
+    """
+    def __init__(self, name, size=1000):
+        super().__init__(name, size)
+        self.filter = lambda line: 'debug' not in line
+
+
+def test_cache_key_state():
+    cache = BuildCache()
+    assert cache.key(FakeBuilder('a'), ['service']) == cache.key(FakeBuilder('a'), ['service'])
+    assert cache.key(FakeBuilder('a'), ['service']) != cache.key(FakeBuilder('b'), ['service'])
+    assert cache.key(FakeBuilder('a'), ['service']) != cache.key(FakeBuilder('a'), ['config'])
+    assert cache.key(FakeBuilder('a', 1000), []) != cache.key(FakeBuilder('a', 1000.0), [])
+
+    shared = ['x']
+    builder = FakeBuilder(shared, shared)
+    # whether the objects are shared doesn't change the key
+    assert cache.key(builder, []) == cache.key(FakeBuilder(['x'], ['x']), [])
+
+
+def _load_extension(monkeypatch, path, module_name, source):
+    path.write_text(source)
+    spec = importlib.util.spec_from_file_location(module_name, str(path))
+    module = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, module_name, module)
+    spec.loader.exec_module(module)
+    return module.Extension()
+
+
+def test_cache_key_class_source(tmp_path, monkeypatch):
+    cache = BuildCache()
+    source = 'class Extension:\n    def process(self):\n        return {}\n'
+    extension = _load_extension(monkeypatch, tmp_path / 'a.py', 'kgsamples_test_a', source.format(1))
+    # the module name depends on how the sample is imported, and is not used
+    same = _load_extension(monkeypatch, tmp_path / 'b.py', 'kgsamples_test_b', source.format(1))
+    changed = _load_extension(monkeypatch, tmp_path / 'c.py', 'kgsamples_test_c', source.format(2))
+    assert cache.key(FakeBuilder(extension), []) == cache.key(FakeBuilder(same), [])
+    assert cache.key(FakeBuilder(extension), []) != cache.key(FakeBuilder(changed), [])
+
+
+def test_cache_unpicklable_builder(tmp_path):
+    cache = BuildCache(path=str(tmp_path / 'cache'))
+    cache.build(UnpicklableBuilder('a'))
+    cache.build(UnpicklableBuilder('a'))
+    assert BUILDS == ['a']
+    assert cache.hits == 1
+
+
+class UnpicklableOutputBuilder(FakeBuilder):
+    def build(self, *buildnames):
+        BUILDS.append(self.name)
+        return [{'name': self.name, 'process': lambda: None}]
+
+
+def test_cache_unpicklable_output(tmp_path):
+    cache = BuildCache(path=str(tmp_path / 'cache'))
+    with pytest.warns(UserWarning, match='The output of UnpicklableOutputBuilder is not cached'):
+        cache.build(UnpicklableOutputBuilder('a'))
+    assert cache.skipped == 1
+    assert not os.path.exists(str(tmp_path / 'cache'))
@@ -0,0 +1,93 @@
+import io
+import json
+from collections import Counter
+
+import pytest
+import yaml
+from kubragen.output import OutputDataDumperDefault, OutputFile_Kubernetes, OutputFile_ShellScript
+
+from kgsamples.compose import compose, compose_overrides, main
+from kgsamples.render import RenderError
+
+
+def test_compose_overrides():
+    assert compose_overrides(['loki', 'efk'], {'size': 'small'}, {'efk': {'es-topology': 'dedicated'}}) == {
+        'loki': {'size': 'small'},
+        'efk': {'size': 'small', 'es-topology': 'dedicated'},
+    }
+
+
+def test_compose_overrides_grafana():
+    overrides = compose_overrides(['prometheus', 'loki'], {'size': 'small'}, {'loki': {'size': 'medium'}})
+    assert overrides == {
+        'prometheus': {'size': 'small', 'loki_datasource': True},
+        'loki': {'size': 'medium', 'no_grafana': True},
+    }
+
+
+def test_compose_overrides_copies_options():
+    options = {'size': 'small'}
+    overrides = compose_overrides(['prometheus', 'loki'], options)
+    assert options == {'size': 'small'}
+    assert overrides['prometheus'] is not overrides['loki']
+
+
+def test_compose_no_stacks():
+    with pytest.raises(RenderError):
+        compose('k3d', ['other'])
+
+
+def _fake_urlopen(url, *args, **kwargs):
+    return io.BytesIO(json.dumps({'title': 'dashboard', 'panels': [{'datasource': 'x', 'id': 1}]}).encode('utf-8'))
+
+
+def test_compose_merge(tmp_path, monkeypatch):
+    # the k3d samples create their storage directory in the current directory
+    monkeypatch.chdir(tmp_path)
+    # the Prometheus stack downloads its dashboards
+    monkeypatch.setattr('urllib.request.urlopen', _fake_urlopen)
+    stacks = ['efk', 'loki', 'prometheus']
+    out, warnings = compose('k3d', stacks, compose_overrides(stacks, {'no-cache': True}))
+    assert warnings == []
+
+    dumper = OutputDataDumperDefault(out.kg, {})
+    files = {}
+    for file in out.out_sequence:
+        if isinstance(file, OutputFile_Kubernetes):
+            files[file.filename] = [obj for obj in yaml.safe_load_all(file.to_string(dumper)) if obj is not None]
+    filenames = list(files)
+
+    # the shared files are output once, before the files of the stacks
+    assert filenames[0] == 'namespace.yaml'
+    assert filenames.index('storage.yaml') < filenames.index('prometheus.yaml')
+    assert filenames.index('traefik.yaml') < filenames.index('lokistack.yaml')
+    assert filenames.index('traefik.yaml') < filenames.index('efk.yaml')
+    # the shared files that follow the stack files stay after the files of all the stacks
+    assert filenames[-1] == 'ingress.yaml'
+
+    objects = [obj for file_objects in files.values() for obj in file_objects]
+    keys = Counter((obj['kind'], obj['metadata'].get('namespace'), obj['metadata']['name']) for obj in objects)
+    assert [key for key, count in keys.items() if count > 1] == []
+    # one Traefik, and only the Grafana of the Prometheus stack
+    assert len([obj for obj in objects if obj['kind'] == 'Deployment' and 'traefik' in obj['metadata']['name']]) == 1
+    assert len([obj for obj in objects if obj['kind'] == 'Deployment' and 'grafana' in obj['metadata']['name']]) == 1
+
+    (shell_script,) = [file for file in out.out_single if isinstance(file, OutputFile_ShellScript)]
+    applies = [data for data in shell_script.data if str(data).startswith('kubectl apply -f ')]
+    assert len(applies) == len(filenames)
+
+
+def test_compose_option_error(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(RenderError, match='loki: The "direct" load balancer mode is not supported on k3d'):
+        compose('k3d', ['loki'], compose_overrides(['loki'], {'no-cache': True, 'loadbalancer': 'direct'}))
+
+
+def test_compose_main_option_error(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('sys.argv', ['compose', '-p', 'k3d', '--stacks', 'loki', '--option', 'no-cache',
+                                     '--option', 'loadbalancer=direct'])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 2
+    assert 'not supported on k3d' in capsys.readouterr().err
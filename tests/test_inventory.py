@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+from kubragen import KubraGen
+from kubragen.output import OutputProject, OutputFile_Kubernetes
+from kubragen.provider import Provider_Generic
+
+from kgsamples import inventory
+from kgsamples.inventory import InventoryError, InventoryJob, inventory_jobs, render_inventory, render_job
+
+
+class FakeStack:
+    """
+    Sample rendering a single ConfigMap, sleeping first if it is slow.
+    """
+    def __init__(self, stack):
+        self.stack = stack
+
+    def build(self, args):
+        if self.stack == 'efk':
+            time.sleep(5)
+        kg = KubraGen(provider=Provider_Generic())
+        out = OutputProject(kg)
+        file = OutputFile_Kubernetes('config.yaml')
+        file.append([{
+            'apiVersion': 'v1',
+            'kind': 'ConfigMap',
+            'metadata': {'name': self.stack},
+            'data': {'size': args.size},
+        }])
+        out.append(file)
+        return kg, out
+
+
+@pytest.fixture
+def fake_stacks(monkeypatch):
+    # the worker processes are forked, and get the fake samples
+    monkeypatch.setattr(inventory, 'load_stack', FakeStack)
+
+
+def test_inventory_jobs():
+    jobs = inventory_jobs({
+        'defaults': {'loki': {'size': 'small'}},
+        'clusters': [{'name': 'eu-1', 'provider': 'k3d', 'stacks': {'loki': {'load': 'light'}, 'efk': None}}],
+    })
+    assert jobs == [
+        InventoryJob(cluster='eu-1', stack='loki', provider='k3d', overrides={'size': 'small', 'load': 'light'}),
+        InventoryJob(cluster='eu-1', stack='efk', provider='k3d', overrides={}),
+    ]
+
+
+@pytest.mark.parametrize('name', ['../eu-1', 'eu/1', '.', '..', '', '/tmp'])
+def test_inventory_jobs_invalid_cluster_name(name):
+    with pytest.raises(InventoryError, match='Invalid cluster name'):
+        inventory_jobs({'clusters': [{'name': name, 'provider': 'k3d', 'stacks': {'loki': {}}}]})
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='the workers must be forked to get the fakes')
+def test_render_inventory(tmp_path, fake_stacks):
+    jobs = inventory_jobs({
+        'clusters': [
+            {'name': 'eu-1', 'provider': 'k3d', 'stacks': {'loki': {'size': 'small'}, 'prometheus': {}}},
+            {'name': 'us-1', 'provider': 'google-gke', 'stacks': {'loki': {'size': 'large'}}},
+            {'name': 'us-2', 'provider': 'google-gke', 'stacks': {'loki': {'size': 'huge'}}},
+        ],
+    })
+    results = render_inventory(jobs, str(tmp_path), workers=2)
+    errors = {'{}/{}'.format(result.job.cluster, result.job.stack): result.error for result in results}
+    assert sorted(errors) == ['eu-1/loki', 'eu-1/prometheus', 'us-1/loki', 'us-2/loki']
+    assert "argument --size: invalid choice: 'huge'" in errors.pop('us-2/loki')
+    assert set(errors.values()) == {None}
+
+    with open(os.path.join(str(tmp_path), 'us-1', 'loki', '001-config.yaml')) as f:
+        assert 'size: large' in f.read()
+    assert sorted(os.listdir(str(tmp_path))) == ['eu-1', 'us-1']
+
+
+def test_render_job_timeout(tmp_path, fake_stacks):
+    result = render_job(InventoryJob(cluster='eu-1', stack='efk', provider='k3d', overrides={}), str(tmp_path),
+                        timeout=0.2)
+    assert result.error == 'Timed out after 0.2s'
+    assert result.seconds < 5
+    assert not os.path.exists(str(tmp_path / 'eu-1'))
@@ -0,0 +1,62 @@
+import os
+import stat
+
+from kubragen import KubraGen
+from kubragen.output import OutputProject, OutputFile_Kubernetes, OutputFile_ShellScript
+from kubragen.provider import Provider_Generic
+
+from kgsamples.output import OutputDriver_Changed
+
+
+def _project(files):
+    kg = KubraGen(provider=Provider_Generic())
+    out = OutputProject(kg)
+    shell_script = OutputFile_ShellScript('create.sh')
+    shell_script.append('set -e')
+    out.append(shell_script)
+    for name, value in files:
+        file = OutputFile_Kubernetes('{}.yaml'.format(name))
+        file.append([{
+            'apiVersion': 'v1',
+            'kind': 'ConfigMap',
+            'metadata': {'name': name},
+            'data': {'key': value},
+        }])
+        out.append(file)
+    return out
+
+
+def _output(path, files):
+    driver = OutputDriver_Changed(path)
+    _project(files).output(driver)
+    return driver
+
+
+def test_changed_writes_only_changed_files(tmp_path):
+    path = str(tmp_path / 'output')
+    driver = _output(path, [('config', 'a'), ('other', 'b')])
+    assert sorted(driver.changed) == ['001-config.yaml', '002-other.yaml', 'create.sh']
+    assert os.stat(os.path.join(path, 'create.sh')).st_mode & stat.S_IEXEC
+
+    driver = _output(path, [('config', 'a'), ('other', 'b')])
+    assert driver.changed == []
+    assert sorted(driver.filenames) == ['001-config.yaml', '002-other.yaml', 'create.sh']
+
+    driver = _output(path, [('config', 'a'), ('other', 'c')])
+    assert driver.changed == ['002-other.yaml']
+    with open(os.path.join(path, '002-other.yaml')) as f:
+        assert 'key: c' in f.read()
+
+
+def test_remove_stale(tmp_path):
+    path = str(tmp_path / 'output')
+    _output(path, [('config', 'a'), ('other', 'b')])
+    os.makedirs(os.path.join(path, 'subdir'))
+
+    # the sequence number of the files changes when a file is removed from the project
+    driver = _output(path, [('other', 'b')])
+    assert driver.changed == ['001-other.yaml']
+    assert driver.remove_stale() == ['001-config.yaml', '002-other.yaml']
+    assert sorted(os.listdir(path)) == ['001-other.yaml', 'create.sh', 'subdir']
+
+    assert _output(path, [('other', 'b')]).remove_stale() == []
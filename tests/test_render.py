@@ -0,0 +1,126 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+from kubragen.exception import InvalidParamError
+
+from kgsamples.render import RenderCache, RenderError, overrides_argv, render, render_handler
+
+
+def test_overrides_argv():
+    assert overrides_argv({
+        'size': 'small',
+        'es-topology': 'dedicated',
+        'self_monitoring': True,
+        'prepull': False,
+        'kube_context': None,
+        'budget': ['object_bytes=512Ki', 'file_bytes=1Mi'],
+        'ksm_shards': 3,
+    }) == [
+        '--size', 'small',
+        '--es-topology', 'dedicated',
+        '--self-monitoring',
+        '--budget', 'object_bytes=512Ki', '--budget', 'file_bytes=1Mi',
+        '--ksm-shards', '3',
+    ]
+
+
+def test_overrides_argv_empty():
+    assert overrides_argv({}) == []
+
+
+class FailingCache(RenderCache):
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+
+    def get(self, stack, provider, overrides=None, output_format='yaml'):
+        raise self.error
+
+
+def _get(cache, path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), render_handler(cache))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with urlopen('http://127.0.0.1:{}{}'.format(server.server_address[1], path)) as response:
+            return response.status, response.read().decode('utf-8')
+    except HTTPError as e:
+        return e.code, e.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize('error, status, message', [
+    (RenderError('Unknown stack "x"'), 400, 'Unknown stack "x"\n'),
+    (RuntimeError('build failed'), 500, 'Error rendering: build failed\n'),
+    (InvalidParamError('Error downloading url: timed out'), 500, 'Error rendering: Error downloading url: timed out\n'),
+    (SystemExit(2), 500, 'Error rendering: exited with status 2\n'),
+])
+def test_handler_errors(error, status, message):
+    assert _get(FailingCache(error), '/render/loki/k3d') == (status, message)
+
+
+@pytest.mark.parametrize('query, message', [
+    ('size=huge', "argument --size: invalid choice: 'huge'"),
+    ('loadbalancer=direct', 'The "direct" load balancer mode is not supported on k3d'),
+    ('help=true', 'Invalid options'),
+])
+def test_handler_option_errors(query, message, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    status, text = _get(RenderCache(), '/render/loki/k3d?no-cache=true&{}'.format(query))
+    assert status == 400
+    assert text.startswith(message)
+
+
+def test_handler_not_found():
+    assert _get(FailingCache(RuntimeError()), '/other') == (404, 'Not found\n')
+
+
+def test_render_cache(tmp_path, monkeypatch):
+    # the k3d samples create their storage directory in the current directory
+    monkeypatch.chdir(tmp_path)
+    cache = RenderCache()
+
+    text, hit = cache.get('loki', 'k3d', {'no-cache': True}, output_format='json')
+    assert not hit
+    objects = json.loads(text)
+    assert any(obj['kind'] == 'StatefulSet' for obj in objects)
+
+    text, hit = cache.get('loki', 'k3d', {'no-cache': True, 'output-format': 'zip'}, output_format='yaml')
+    # the output options don't change the rendered objects
+    assert hit
+    assert text.startswith('apiVersion:')
+
+    with pytest.raises(RenderError):
+        cache.get('loki', 'k3d', {'no-cache': True}, output_format='xml')
+    with pytest.raises(RenderError):
+        cache.get('loki', 'k3d', {'no-cache': True, 'loadbalancer': 'direct'})
+
+
+def test_render_efk_dedicated_sizes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    objects = render('efk', 'k3d', {'no-cache': True, 'es-topology': 'dedicated', 'size': 'small'})
+    statefulsets = {obj['metadata']['name']: obj['spec']['replicas'] for obj in objects if obj['kind'] == 'StatefulSet'}
+    assert sorted(statefulsets.values()) == [1, 1, 1, 1]
+    (ilm_config,) = [obj for obj in objects if obj['kind'] == 'ConfigMap' and obj['metadata']['name'].endswith('-ilm')]
+    assert '"index.number_of_replicas": 0' in ''.join(ilm_config['data'].values())
+
+    with pytest.raises(RenderError, match='The "large" size of the "dedicated" Elasticsearch topology does not fit'):
+        render('efk', 'k3d', {'no-cache': True, 'es-topology': 'dedicated', 'size': 'large'})
+
+
+def test_render_vpc_cidr(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    overrides = {'no-cache': True, 'loadbalancer': 'direct', 'vpc-cidr': '10.116.0.0/20'}
+    objects = render('loki', 'digitalocean-kubernetes', overrides)
+    (traefik,) = [obj for obj in objects if obj['kind'] == 'Deployment' and 'traefik' in obj['metadata']['name']]
+    assert '--entrypoints.web.proxyProtocol.trustedIPs=10.116.0.0/20' in \
+        traefik['spec']['template']['spec']['containers'][0]['args']
+
+    with pytest.raises(RenderError, match='Invalid VPC CIDR "10.116.0.1/20"'):
+        render('loki', 'digitalocean-kubernetes', dict(overrides, **{'vpc-cidr': '10.116.0.1/20'}))
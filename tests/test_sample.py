@@ -0,0 +1,72 @@
+import argparse
+
+import pytest
+from kubragen import KubraGen
+from kubragen.exception import InvalidParamError
+
+from kgsamples import sample
+
+
+def _main(monkeypatch, error):
+    def build(args):
+        raise error
+    monkeypatch.setattr('sys.argv', ['generate.py', '-p', 'k3d'])
+    with pytest.raises(SystemExit) as e:
+        sample.main(sample.arg_parser({'default': None}, {'default': None}), build)
+    return e.value.code
+
+
+def test_main_option_error(monkeypatch, capsys):
+    assert _main(monkeypatch, sample.OptionError('Invalid combination')) == 2
+    assert 'usage:' in capsys.readouterr().err
+
+
+def test_main_build_error(monkeypatch, capsys):
+    assert _main(monkeypatch, InvalidParamError('Error downloading url: timed out')) == 1
+    err = capsys.readouterr().err
+    assert 'usage:' not in err
+    assert 'Error building the sample: Error downloading url: timed out' in err
+
+
+def _storage(provider, disk):
+    kg = KubraGen(provider=sample.kubragen_provider(provider))
+    sample.storage_profiles(kg)
+    sample.storage_claim_add(kg, 'loki', None, '10Gi', disk)
+    return kg.persistentvolume_build(), kg.persistentvolumeclaim_build()
+
+
+def test_storage_disk():
+    args = argparse.Namespace(storage_disk=['prometheus=vol-1', 'loki=vol-2'])
+    assert sample.storage_disk(args, 'loki') == 'vol-2'
+    assert sample.storage_disk(args, 'elasticsearch') is None
+    with pytest.raises(sample.OptionError):
+        sample.storage_disk(argparse.Namespace(storage_disk=['loki']), 'loki')
+
+
+@pytest.mark.parametrize('provider, source, field', [
+    ('google-gke', 'gcePersistentDisk', 'pdName'),
+    ('amazon-eks', 'awsElasticBlockStore', 'volumeID'),
+    ('digitalocean-kubernetes', 'csi', 'volumeHandle'),
+])
+def test_storage_claim_disk(provider, source, field):
+    volumes, claims = _storage(provider, 'vol-0123')
+    assert volumes[0]['spec'][source][field] == 'vol-0123'
+    assert claims[0]['spec']['selector'] == {'matchLabels': {'pv.role': 'loki'}}
+
+
+def test_storage_claim_without_disk():
+    # provisioned by the default StorageClass of the cluster
+    volumes, claims = _storage('amazon-eks', None)
+    assert volumes == []
+    assert claims[0]['spec'] == {'accessModes': ['ReadWriteOnce'], 'resources': {'requests': {'storage': '10Gi'}}}
+
+
+def test_storage_claim_k3d():
+    volumes, claims = _storage('k3d', None)
+    assert volumes[0]['spec']['hostPath'] == {'path': '/var/storage/loki'}
+
+
+def test_storage_claim_disk_tier():
+    kg = KubraGen(provider=sample.kubragen_provider('amazon-eks'))
+    with pytest.raises(sample.OptionError):
+        sample.storage_claim_add(kg, 'loki', {'storageclass': 'gp3'}, '10Gi', 'vol-0123')
@@ -0,0 +1,145 @@
+import copy
+
+import pytest
+
+from kgsamples import validate
+from kgsamples.validate import SchemaValidator, load_schemas
+
+SCHEMAS = {
+    'kinds': {
+        'v1/Widget': 'V1Widget',
+    },
+    'types': {
+        'V1Widget': {
+            'fields': {
+                'apiVersion': 'str',
+                'kind': 'str',
+                'metadata': 'V1ObjectMeta',
+                'spec': 'V1WidgetSpec',
+            },
+            'required': [],
+        },
+        'V1ObjectMeta': {
+            'fields': {
+                'name': 'str',
+                'labels': 'Dict[str, str]',
+            },
+            'required': [],
+        },
+        'V1WidgetSpec': {
+            'fields': {
+                'replicas': 'int',
+                'enabled': 'bool',
+                'ratio': 'float',
+                'size': 'quantity',
+                'ports': 'List[int]',
+                'source': 'V1WidgetSource',
+            },
+            'required': [],
+        },
+        'V1WidgetSource': {
+            'fields': {
+                'name': 'str',
+            },
+            'required': ['name'],
+        },
+    },
+}
+
+
+def _widget(spec):
+    return {
+        'apiVersion': 'v1',
+        'kind': 'Widget',
+        'metadata': {'name': 'widget', 'labels': {'app': 'widget'}},
+        'spec': spec,
+    }
+
+
+def test_validate_valid():
+    assert SchemaValidator(SCHEMAS).validate_object(_widget({
+        'replicas': 2,
+        'enabled': True,
+        'ratio': 1,
+        'size': '1Gi',
+        'ports': [80, 443],
+        'source': {'name': 'disk'},
+    })) == []
+
+
+@pytest.mark.parametrize('spec, error', [
+    ({'replicas': '2'}, "spec.replicas: expected int, got str '2'"),
+    ({'replicas': True}, 'spec.replicas: expected int, got bool True'),
+    ({'enabled': 'true'}, "spec.enabled: expected bool, got str 'true'"),
+    ({'ratio': False}, 'spec.ratio: expected float, got bool False'),
+    ({'size': True}, 'spec.size: expected quantity, got bool True'),
+    ({'ports': 80}, 'spec.ports: expected a list'),
+    ({'ports': [80, '443']}, "spec.ports[1]: expected int, got str '443'"),
+    ({'source': 'disk'}, 'spec.source: expected a mapping'),
+    ({'source': {}}, 'spec.source.name: missing required field'),
+    ({'other': 1}, 'spec.other: unknown field'),
+])
+def test_validate_errors(spec, error):
+    assert SchemaValidator(SCHEMAS).validate_object(_widget(spec)) == [error]
+
+
+def test_validate_label_number():
+    obj = _widget({})
+    obj['metadata']['labels']['version'] = 2
+    assert SchemaValidator(SCHEMAS).validate_object(obj) == ['metadata.labels.version: expected str, got int 2']
+
+
+def test_validate_null_is_missing():
+    assert SchemaValidator(SCHEMAS).validate_object(_widget({'replicas': None, 'source': None})) == []
+
+
+def test_validate_custom_resources():
+    crd = {
+        'apiVersion': 'apiextensions.k8s.io/v1',
+        'kind': 'CustomResourceDefinition',
+        'metadata': {'name': 'gadgets.example.com'},
+        'spec': {'group': 'example.com', 'names': {'kind': 'Gadget'}, 'versions': [{'name': 'v1'}]},
+    }
+    gadget = {'apiVersion': 'example.com/v1', 'kind': 'Gadget', 'metadata': {'name': 'gadget'}}
+    validator = SchemaValidator(SCHEMAS)
+    # the custom resources are only skipped if their definition is in the list
+    assert validator.validate([gadget]) == ['Gadget "gadget": unknown kind in example.com/v1']
+    assert validator.validate([gadget, _widget({'replicas': 'x'})]) == [
+        'Gadget "gadget": unknown kind in example.com/v1',
+        'Widget "widget": spec.replicas: expected int, got str \'x\'',
+    ]
+    assert [error for error in validator.validate([crd, gadget]) if error.startswith('Gadget')] == []
+
+
+@pytest.mark.parametrize('provider', ['k3d', 'google-gke', 'amazon-eks', 'digitalocean-kubernetes'])
+def test_validate_default_render(provider, tmp_path, monkeypatch):
+    pytest.importorskip('kubernetes')
+    from kgsamples.render import render
+    from kgsamples.validate import default_validator
+
+    # the k3d samples create their storage directory in the current directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    assert default_validator().validate(render('loki', provider, {'no-cache': True})) == []
+
+
+def test_load_schemas_unwritable_cache(tmp_path, monkeypatch):
+    compiled = []
+
+    def compile_schemas():
+        compiled.append(True)
+        return copy.deepcopy(SCHEMAS)
+
+    monkeypatch.setattr(validate.metadata, 'version', lambda name: '1.0')
+    monkeypatch.setattr(validate, 'compile_kubernetes_schemas', compile_schemas)
+    # the cache path is a file, so the directory can't be created
+    path = tmp_path / 'schemas'
+    path.write_text('')
+    assert 'v1/Widget' in load_schemas(str(path))['kinds']
+    assert 'v1/Widget' in load_schemas(str(path))['kinds']
+    assert len(compiled) == 2
+
+    schemas = load_schemas(str(tmp_path / 'cache'))
+    assert 'v1/Widget' in schemas['kinds']
+    assert load_schemas(str(tmp_path / 'cache')) == schemas
+    assert len(compiled) == 3
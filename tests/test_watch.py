@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from kgsamples import watch
+from kgsamples.watch import SAMPLE_MODULES, StackWatcher
+
+
+class Stop(Exception):
+    pass
+
+
+def _watcher(tmp_path):
+    return StackWatcher('loki', ['-p', 'k3d', '--no-cache', '--output-path', str(tmp_path / 'output')], interval=0)
+
+
+def test_watch_render_reloads_modules(tmp_path, monkeypatch):
+    # the k3d samples create their storage directory in the current directory
+    monkeypatch.chdir(tmp_path)
+    reloaded = []
+
+    def record_reload(module):
+        # the modules are not imported again, the other tests hold their classes
+        reloaded.append(module.__name__)
+        return module
+
+    monkeypatch.setattr(watch.importlib, 'reload', record_reload)
+    watcher = _watcher(tmp_path)
+    watcher.render()
+    assert reloaded == []
+    assert os.path.exists(str(tmp_path / 'output' / 'k3d-watch' / 'create_k3d.sh'))
+
+    watcher.render(reload_modules=True)
+    assert reloaded == SAMPLE_MODULES
+    filenames = watcher.filenames()
+    assert filenames[0] == watcher.filename
+    assert os.path.join('kgsamples', 'traefik.py') in filenames[-1]
+
+
+def test_watch_run_changes(tmp_path, monkeypatch):
+    watcher = _watcher(tmp_path)
+    files = [str(tmp_path / name) for name in ('generate.py', 'profiles.py', 'traefik.py')]
+    for filename in files:
+        open(filename, 'w').close()
+    imported = files[:2]
+    monkeypatch.setattr(watcher, 'filename', files[0])
+    monkeypatch.setattr(watcher, 'filenames', lambda: list(imported))
+
+    renders = []
+    changes = [
+        lambda: None,
+        lambda: os.utime(files[0], ns=(1, 1)),
+        lambda: os.utime(files[1], ns=(1, 1)),
+        # a module imported by the last render is not a change
+        lambda: imported.append(files[2]),
+        # a file missing while an editor saves it is not a change
+        lambda: os.remove(files[1]),
+    ]
+
+    def render(reload_modules=False):
+        renders.append(reload_modules)
+
+    def sleep(interval):
+        if len(changes) == 0:
+            raise Stop()
+        changes.pop(0)()
+
+    monkeypatch.setattr(watcher, 'render', render)
+    monkeypatch.setattr(watch.time, 'sleep', sleep)
+    with pytest.raises(Stop):
+        watcher.run()
+    assert renders == [False, False, True]